@@ -0,0 +1,379 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+
+import asyncio
+from concurrent import futures
+import functools
+import logging
+import time
+import weakref
+
+from quantastica.qiskit_toaster import (
+    ToasterJob,
+    ToasterBalancer,
+    ToasterHttpInterface,
+    ToasterCliInterface,
+    ToasterResult,
+    ToasterScheduler,
+)
+
+from qiskit.providers import JobV1, JobStatus, JobError
+
+logger = logging.getLogger(__name__)
+
+
+# one of toaster_url, toaster_urls or toaster_path MUST be defined
+# toaster_path takes precedence, then toaster_urls (endpoint picked by
+# ToasterScheduler followed by the others it fails over to)
+async def _run_with_qtoaster_async(
+    qobj_dict,
+    get_states,
+    job_id,
+    optimization_level=None,
+    toaster_url=None,
+    toaster_path=None,
+    http_options=None,
+    cache_options=None,
+    result_cache_options=None,
+    statevector_dir=None,
+    compact_counts=False,
+    toaster_urls=None,
+):
+    loop = asyncio.get_running_loop()
+    # conversion, cache lookups and parsing are CPU or disk bound, keep
+    # them off the event loop
+    run = await loop.run_in_executor(
+        None,
+        functools.partial(
+            ToasterJob._ExperimentRun,
+            qobj_dict,
+            get_states,
+            job_id,
+            optimization_level=optimization_level,
+            cache_options=cache_options,
+            result_cache_options=result_cache_options,
+            statevector_dir=statevector_dir,
+            compact_counts=compact_counts,
+        ),
+    )
+    result = await loop.run_in_executor(None, run.cached_result)
+    if result is not None:
+        return result
+
+    async def execute(toaster_key, toaster):
+        """Returns (toaster_key, response) of toaster"""
+        try:
+            response = await run.execute(toaster_key, toaster)
+        except ToasterJob._REJECTED as e:
+            if not run.rejected(toaster_key, e):
+                raise
+            response = await run.execute(toaster_key, toaster)
+        return toaster_key, response
+
+    if toaster_path:
+        toaster_key, toasterjson = await execute(
+            toaster_path,
+            ToasterCliInterface.ToasterAsyncCliInterface(toaster_path),
+        )
+    elif toaster_urls:
+        # endpoints fail over to each other, so each one gives up quickly
+        endpoint_options = dict(http_options or {}, max_retries=0)
+        toaster_key, toasterjson = await ToasterBalancer.failover_async(
+            toaster_urls,
+            lambda url: execute(
+                url,
+                ToasterHttpInterface.ToasterAsyncHttpInterface(
+                    url, **endpoint_options
+                ),
+            ),
+            max_retries=(http_options or {}).get("max_retries"),
+        )
+    else:
+        toaster_key, toasterjson = await execute(
+            toaster_url,
+            ToasterHttpInterface.ToasterAsyncHttpInterface(
+                toaster_url, **(http_options or {})
+            ),
+        )
+    result = await loop.run_in_executor(
+        None, run.result, toaster_key, toasterjson
+    )
+    if toaster_urls:
+        # tells the scheduler which endpoint served the experiment
+        result["toaster_url"] = toaster_key
+    return result
+
+
+async def _run_batch_async(batch, get_states, **kwargs):
+    """
+    Runs batch of (experiment_job_id, single_experiment_qobj_dict) items
+    one after another, returns list of experiment results
+    """
+    return [
+        await _run_with_qtoaster_async(
+            single_exp, get_states, exp_job_id, **kwargs
+        )
+        for exp_job_id, single_exp in batch
+    ]
+
+
+class _LoopExecutor(futures.Executor):
+    """
+    Runs coroutine functions on event loop. Work is submitted by
+    ToasterScheduler, which starts at most max_workers of them at a time
+    and only while they fit into memory budget of the toaster machine,
+    just like with worker pools.
+    """
+
+    def __init__(self, loop, max_workers):
+        # executors are kept per loop, they must not keep it alive
+        self._loop = weakref.ref(loop)
+        self._max_workers = max_workers
+
+    def submit(self, fn, *args, **kwargs):
+        loop = self._loop()
+        if loop is None or loop.is_closed():
+            raise RuntimeError("Event loop of the job is closed")
+        return asyncio.run_coroutine_threadsafe(fn(*args, **kwargs), loop)
+
+
+# executors of each event loop, keyed by max_workers, so the limit is
+# shared by all jobs running on the same loop
+_loop_executors = weakref.WeakKeyDictionary()
+
+
+def _loop_executor(loop, max_workers):
+    executors = _loop_executors.setdefault(loop, dict())
+    executor = executors.get(max_workers)
+    if executor is None:
+        executor = _LoopExecutor(loop, max_workers)
+        executors[max_workers] = executor
+    return executor
+
+
+class ToasterAsyncJob(JobV1):
+    """
+    Job driven by asyncio event loop instead of worker pool.
+
+    Usage (inside a coroutine)::
+
+        job = await backend.run_async(circuits)
+        async for experiment_result in job:
+            ...  # experiments in completion order
+        result = await job
+    """
+
+    def __init__(
+        self,
+        backend,
+        job_id,
+        qobj,
+        toaster_host,
+        toaster_port,
+        getstates=False,
+        backend_options=None,
+        use_cli=False,
+        http_options=None,
+        cache_options=None,
+        result_cache_options=None,
+        statevector_dir=None,
+        compact_counts=False,
+        toaster_endpoints=None,
+        balancer_options=None,
+        shots_per_run=None,
+        max_workers=None,
+        batch_size=None,
+        memory_budget=None,
+        priority=0,
+    ):
+        super().__init__(backend, job_id)
+        self._toaster_url = "http://%s:%d" % (toaster_host, int(toaster_port))
+        self._toaster_target = "%s:%d" % (toaster_host, int(toaster_port))
+        self._toaster_urls = None
+        if toaster_endpoints:
+            urls = [ToasterBalancer.endpoint_url(e) for e in toaster_endpoints]
+            self._toaster_url = urls[0]
+            self._toaster_target = ",".join(
+                url.split("://", 1)[1] for url in urls
+            )
+            if len(urls) > 1:
+                self._toaster_urls = urls
+        self._balancer_options = balancer_options
+        self._http_options = http_options
+        if shots_per_run is None:
+            shots_per_run = ToasterJob.ToasterJob.DEFAULT_SHOTS_PER_RUN
+        self._shots_per_run = shots_per_run
+        self._max_workers = (
+            max_workers or ToasterJob.ToasterJob.DEFAULT_MAX_WORKERS
+        )
+        self._batch_size = batch_size or 1
+        self._memory_budget = memory_budget
+        self._priority = priority
+        self._result = None
+        # template assembly (parameter_binds) produces qobj dict directly
+        if isinstance(qobj, dict):
+            self._qobj_dict = qobj
+        else:
+            self._qobj_dict = qobj.to_dict()
+        # scheduler futures of batches and their asyncio wrappers
+        self._futures = []
+        self._tasks = []
+        self._scheduler = None
+        self._cancelled = False
+        self._getstates = getstates
+        self._backend_options = backend_options
+        self._use_cli = use_cli
+        self._cache_options = cache_options
+        self._result_cache_options = result_cache_options
+        self._statevector_dir = statevector_dir
+        self._compact_counts = compact_counts
+
+    def submit(self):
+        """
+        Schedules experiments on the running event loop. They are started
+        by the same scheduler as worker pool jobs: by priority and
+        estimated cost, at most max_workers at a time (per event loop)
+        and within memory budget of the toaster machine.
+        """
+        if len(self._tasks) > 0:
+            raise JobError("We have already submitted the job!")
+        loop = asyncio.get_running_loop()
+        self._t_submit = time.time()
+
+        # job_timeout becomes deadline shared by all experiments of the job
+        http_options = dict(self._http_options or {})
+        http_options.pop("pool_size", None)
+        http_options.pop("pool_idle_timeout", None)
+        job_timeout = http_options.pop("job_timeout", None)
+        if job_timeout is not None:
+            http_options["deadline"] = self._t_submit + job_timeout
+
+        logger.debug("submitting...")
+        optimization_level = ToasterJob._optimization_level(
+            self._backend_options
+        )
+        toaster_path = ToasterJob._toaster_path(self._use_cli)
+        scheduler = ToasterScheduler.get_scheduler(
+            "cli" if toaster_path else self._toaster_target,
+            self._memory_budget,
+            urls=None if toaster_path else self._toaster_urls,
+            balancer_options=self._balancer_options,
+        )
+        self._scheduler = scheduler
+        cost_model = scheduler.cost_model
+        executor = _loop_executor(loop, self._max_workers)
+
+        # statevector runs are single shot
+        shots_per_run = None if self._getstates else self._shots_per_run
+        for batch in ToasterJob._batch_experiments(
+            self._qobj_dict, self._job_id, self._batch_size, shots_per_run
+        ):
+            memory = max(
+                ToasterScheduler.estimate_memory(single_exp)
+                for _, single_exp in batch
+            )
+            features = [
+                ToasterScheduler.circuit_features(single_exp["experiments"][0])
+                for _, single_exp in batch
+            ]
+            future = scheduler.submit(
+                executor,
+                memory,
+                _run_batch_async,
+                batch,
+                self._getstates,
+                cost=sum(cost_model.estimate(f) for f in features),
+                priority=self._priority,
+                optimization_level=optimization_level,
+                toaster_url=self._toaster_url,
+                toaster_path=toaster_path,
+                http_options=http_options,
+                cache_options=self._cache_options,
+                result_cache_options=self._result_cache_options,
+                statevector_dir=self._statevector_dir,
+                compact_counts=self._compact_counts,
+            )
+            future.add_done_callback(
+                functools.partial(
+                    ToasterJob.ToasterJob._calibrate, cost_model, features
+                )
+            )
+            self._futures.append(future)
+            self._tasks.append(asyncio.wrap_future(future, loop=loop))
+
+    def _merged_results(self, batches):
+        results = [result for batch in batches for result in batch]
+        return ToasterJob._attach_statevectors(
+            ToasterJob._ShotSplitMerger().add(results)
+        )
+
+    async def result_async(self):
+        batches = await asyncio.gather(*self._tasks)
+        if self._result is None:
+            self._result = ToasterJob.ToasterJob._build_result_dict(
+                self._qobj_dict, self._job_id, self._merged_results(batches)
+            )
+            ToasterJob.ToasterJob._run_time += time.time() - self._t_submit
+        return ToasterResult.ToasterResult.from_dict(self._result)
+
+    def __await__(self):
+        return self.result_async().__await__()
+
+    async def __aiter__(self):
+        merger = ToasterJob._ShotSplitMerger()
+        for task in asyncio.as_completed(self._tasks):
+            for result in merger.add(await task):
+                result = ToasterJob._attach_statevectors([result])[0]
+                yield ToasterResult.decode_experiment(result)
+
+    def result(self, timeout=None):
+        if self._result is None:
+            if not all(t.done() for t in self._tasks):
+                raise JobError(
+                    "Job is still running, use 'await job' to wait for results"
+                )
+            self._result = ToasterJob.ToasterJob._build_result_dict(
+                self._qobj_dict,
+                self._job_id,
+                self._merged_results([t.result() for t in self._tasks]),
+            )
+        return ToasterResult.ToasterResult.from_dict(self._result)
+
+    def cancel(self):
+        """
+        Cancels the job: experiments waiting for admission are dropped,
+        running ones are cancelled on the event loop
+        """
+        self._cancelled = True
+        for future in self._futures:
+            self._scheduler.cancel(future)
+        for task in self._tasks:
+            task.cancel()
+        return True
+
+    def status(self):
+        if len(self._tasks) == 0:
+            return JobStatus.INITIALIZING
+        if self._cancelled or any(t.cancelled() for t in self._tasks):
+            return JobStatus.CANCELLED
+        if any(t.done() and t.exception() is not None for t in self._tasks):
+            return JobStatus.ERROR
+        if all(t.done() for t in self._tasks):
+            return JobStatus.DONE
+        if any(f.running() for f in self._futures):
+            return JobStatus.RUNNING
+        return JobStatus.QUEUED
+
+    def backend(self):
+        """Return the instance of the backend used for this job."""
+        return self._backend
@@ -13,8 +13,22 @@
 
 import uuid
 import logging
-from quantastica.qiskit_toaster import ToasterJob
+from urllib.parse import urlsplit
+import numpy as np
+from quantastica.qiskit_toaster import (
+    ToasterJob,
+    ToasterAsyncJob,
+    ToasterBalancer,
+    ToasterExpectation,
+    ToasterGradient,
+    ToasterHttpInterface,
+    ToasterCache,
+    ToasterSampling,
+    ToasterScheduler,
+    ToasterTemplate,
+)
 from quantastica import qconvert
+from qiskit import QuantumCircuit
 from qiskit.providers import BackendV1
 from qiskit.providers.models import BackendConfiguration
 from qiskit.compiler import assemble
@@ -38,7 +52,8 @@ class ToasterBackend(BackendV1):
         "conditional": False,
         "open_pulse": False,
         "memory": True,
-        "max_shots": 65536,
+        # larger experiments are split into several toaster runs
+        "max_shots": 2 ** 31 - 1,
         "description": "An q-toaster based qasm simulator",
         "coupling_map": None,
         "basis_gates": qconvert.supported_gates(),
@@ -53,6 +68,30 @@ class ToasterBackend(BackendV1):
         toaster_host=None,
         toaster_port=None,
         use_cli=False,
+        max_workers=None,
+        executor_type=None,
+        executor_lifetime="shared",
+        http_pool_size=None,
+        http_pool_idle_timeout=None,
+        http_connect_timeout=None,
+        http_read_timeout=None,
+        http_max_retries=None,
+        http_poll_wait=None,
+        job_timeout=None,
+        toaster_endpoints=None,
+        health_check_interval=None,
+        shots_per_run=None,
+        sample_locally=False,
+        sampling_cache_size=None,
+        batch_size=None,
+        conversion_cache_size=None,
+        conversion_cache_dir=None,
+        conversion_cache_disk_size=None,
+        result_cache_dir=None,
+        result_cache_size=None,
+        memory_budget=None,
+        statevector_dir=None,
+        compact_counts=False,
     ):
         configuration = configuration or BackendConfiguration.from_dict(
             self.DEFAULT_CONFIGURATION
@@ -78,19 +117,103 @@ class ToasterBackend(BackendV1):
             toaster_host or ToasterBackend.DEFAULT_TOASTER_HOST
         )
         self._use_cli = use_cli
+        self._toaster_endpoints = toaster_endpoints
+        if toaster_endpoints:
+            # toaster_host/port point to the first endpoint
+            first = urlsplit(
+                ToasterBalancer.endpoint_url(toaster_endpoints[0])
+            )
+            self._toaster_host = first.hostname
+            self._toaster_port = first.port or 80
+        self._balancer_options = {
+            "health_check_interval": health_check_interval,
+        }
+
+        if executor_type is not None and (
+            executor_type not in ToasterJob.ToasterJob.EXECUTOR_TYPES
+        ):
+            raise ValueError(
+                "Unknown executor_type '%s', expected one of: %s"
+                % (
+                    executor_type,
+                    ", ".join(ToasterJob.ToasterJob.EXECUTOR_TYPES),
+                )
+            )
+        if executor_lifetime not in ToasterJob.ToasterJob.EXECUTOR_LIFETIMES:
+            raise ValueError(
+                "Unknown executor_lifetime '%s', expected one of: %s"
+                % (
+                    executor_lifetime,
+                    ", ".join(ToasterJob.ToasterJob.EXECUTOR_LIFETIMES),
+                )
+            )
+        self._max_workers = max_workers
+        self._executor_type = executor_type
+        self._executor_lifetime = executor_lifetime
+        self._executor = None
+        self._batch_size = batch_size
+        self._shots_per_run = shots_per_run
+        self._sampling_options = None
+        if sample_locally:
+            self._sampling_options = {"max_bytes": sampling_cache_size}
+        self._cache_options = {
+            "max_bytes": conversion_cache_size,
+            "directory": conversion_cache_dir,
+            "disk_max_bytes": conversion_cache_disk_size,
+        }
+        self._memory_budget = memory_budget
+        self._statevector_dir = statevector_dir
+        self._compact_counts = compact_counts
+        self._result_cache_options = {
+            "directory": result_cache_dir,
+            "max_bytes": result_cache_size,
+        }
+        self._http_options = {
+            "pool_size": http_pool_size,
+            "pool_idle_timeout": http_pool_idle_timeout,
+            "connect_timeout": http_connect_timeout,
+            "read_timeout": http_read_timeout,
+            "max_retries": http_max_retries,
+            "poll_wait": http_poll_wait,
+            "job_timeout": job_timeout,
+        }
+
+    def _get_executor(self):
+        """Returns (executor, owned_by_job) according to executor_lifetime"""
+        if self._executor_lifetime == "job":
+            executor = ToasterJob.ToasterJob.create_executor(
+                self._executor_type, self._max_workers
+            )
+            return executor, True
+        if self._executor_lifetime == "backend":
+            if self._executor is None:
+                self._executor = ToasterJob.ToasterJob.create_executor(
+                    self._executor_type, self._max_workers
+                )
+            return self._executor, False
+        executor = ToasterJob.ToasterJob.get_shared_executor(
+            self._executor_type, self._max_workers
+        )
+        return executor, False
+
+    def shutdown(self, wait=True):
+        """
+        Shuts down the executor owned by this backend
+        (executor_lifetime="backend"). Shared executors are left running
+        because other backends may still be using them, use
+        ToasterJob.shutdown_shared_executors() to stop those.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
 
     def _assemble(self, circuits, parameter_binds=None, **run_options):
         """Assemble one or more Qobj for running on the simulator"""
-        if parameter_binds:
-            # Handle parameter binding
-            parameterizations = self._convert_binds(circuits, parameter_binds)
-            assemble_binds = []
-            assemble_binds.append({param: 1 for bind in parameter_binds for param in bind})
-
-            qobj = assemble(circuits, self, parameter_binds=assemble_binds,
-                            parameterizations=parameterizations)
-        else:
-            qobj = assemble(circuits, self)
+        if parameter_binds is not None and len(parameter_binds):
+            return self._assemble_templates(
+                circuits, parameter_binds, **run_options
+            )
+        qobj = assemble(circuits, self)
 
         # Add options
         if self.options:
@@ -104,27 +227,292 @@ class ToasterBackend(BackendV1):
 
         return qobj
 
+    def _assemble_templates(self, circuits, parameter_binds, **run_options):
+        """
+        Assembles and converts each parameterized circuit only once, bind
+        sets then just substitute numeric values (see ToasterTemplate).
+        parameter_binds has one entry per circuit: dict
+        {Parameter: value or sequence/numpy array of values} or numpy array
+        of shape (num_bind_sets, num_parameters) with columns in
+        circuit.parameters order.
+        Returns qobj dict with one experiment per circuit and bind set.
+        """
+        if isinstance(circuits, QuantumCircuit):
+            circuits = [circuits]
+        if len(circuits) == 1 and isinstance(
+            parameter_binds, (dict, np.ndarray)
+        ):
+            parameter_binds = [parameter_binds]
+        if len(parameter_binds) != len(circuits):
+            raise ValueError(
+                "Number of parameter_binds (%d) does not match number of "
+                "circuits (%d)" % (len(parameter_binds), len(circuits))
+            )
+        if not ToasterTemplate.TEMPLATES_AVAILABLE:
+            # converter internals missing: convert every bind set
+            bound = [
+                circuit.assign_parameters(dict(zip(circuit.parameters, row)))
+                for circuit, binds in zip(circuits, parameter_binds)
+                for row in ToasterTemplate.bind_sets(
+                    list(circuit.parameters), binds
+                )
+            ]
+            return self._assemble(bound, **run_options).to_dict()
+
+        placeholders = [
+            circuit.assign_parameters({p: 0 for p in circuit.parameters})
+            for circuit in circuits
+        ]
+        qobj_dict = self._assemble(placeholders, **run_options).to_dict()
+        experiments = []
+        for circuit, experiment, binds in zip(
+            circuits, qobj_dict["experiments"], parameter_binds
+        ):
+            template = ToasterTemplate.ToasterCircuitTemplate(
+                circuit, experiment, cache_options=self._cache_options
+            )
+            experiments += template.experiments(binds)
+        qobj_dict["experiments"] = experiments
+        return qobj_dict
+
     # @profile
     def run(self,
             circuits,
             validate=False,
             parameter_binds=None,
             **run_options):
+        priority = run_options.pop("priority", 0)
+        callback = run_options.pop("callback", None)
         qobj = self._assemble(circuits, parameter_binds=parameter_binds, **run_options)            
+        return self._submit(qobj, self._getstates, priority, callback)
+
+    def _submit(self, qobj, getstates, priority=0, callback=None):
         job_id = str(uuid.uuid4())
+        executor, owns_executor = self._get_executor()
         job = ToasterJob.ToasterJob(
             self,
             job_id,
             qobj,
-            getstates=self._getstates,
+            getstates=getstates,
             toaster_host=self._toaster_host,
             toaster_port=self._toaster_port,
 #            backend_options=backend_options,
             use_cli=self._use_cli,
+            executor=executor,
+            owns_executor=owns_executor,
+            http_options=self._http_options,
+            batch_size=self._batch_size,
+            cache_options=self._cache_options,
+            result_cache_options=self._result_cache_options,
+            memory_budget=self._memory_budget,
+            priority=priority,
+            statevector_dir=self._statevector_dir,
+            compact_counts=self._compact_counts,
+            callback=callback,
+            toaster_endpoints=self._toaster_endpoints,
+            balancer_options=self._balancer_options,
+            shots_per_run=self._shots_per_run,
+            sampling_options=self._sampling_options,
+        )
+        job.submit()
+        return job
+
+    def _statevectors(self, circuits, parameter_binds=None, **run_options):
+        """
+        Returns final statevectors of circuits (one per circuit and bind
+        set) simulated in a single job, final measurements are removed
+        """
+        if isinstance(circuits, QuantumCircuit):
+            circuits = [circuits]
+        circuits = [
+            circuit.remove_final_measurements(inplace=False)
+            for circuit in circuits
+        ]
+        qobj = self._assemble(
+            circuits, parameter_binds=parameter_binds, **run_options
+        )
+        result = self._submit(qobj, getstates=True).result()
+        return [
+            result.get_statevector(i) for i in range(len(result.results))
+        ]
+
+    def expectation_values(
+        self, circuits, observables, parameter_binds=None, **run_options
+    ):
+        """
+        Returns expectation values of observables (SparsePauliOp or list
+        of them) in states prepared by circuits, as numpy array of shape
+        (num_experiments, num_observables). Circuits are run once in
+        statevector mode (final measurements are removed, no shots) and
+        expectation values are computed from the amplitudes, see
+        ToasterExpectation. Experiments are ordered as in run(): each
+        circuit with each of its bind sets. Array is real if all
+        observables are hermitian.
+        """
+        if not isinstance(observables, (list, tuple)):
+            observables = [observables]
+        engines = [
+            ToasterExpectation.ToasterPauliExpectation(observable)
+            for observable in observables
+        ]
+        statevectors = self._statevectors(
+            circuits, parameter_binds, **run_options
+        )
+        values = np.zeros((len(statevectors), len(engines)), dtype=complex)
+        for i, statevector in enumerate(statevectors):
+            for j, engine in enumerate(engines):
+                values[i, j] = engine.evaluate(statevector)
+        if all(engine.hermitian for engine in engines):
+            return values.real
+        return values
+
+    def parameter_shift_gradient(
+        self, circuit, observable, parameter_values, **run_options
+    ):
+        """
+        Returns gradient of expectation value of observable
+        (SparsePauliOp) with respect to circuit.parameters, computed by
+        parameter-shift rule, see ToasterGradient. parameter_values is
+        array of one point (in circuit.parameters order) or of shape
+        (num_points, num_parameters), gradient has the same shape.
+
+        All shifted bind sets of all points are simulated as one
+        statevector job from a single converted template, identical bind
+        sets only once.
+        """
+        shift = ToasterGradient.ToasterParameterShift(circuit)
+        points = np.asarray(parameter_values, dtype=float)
+        single = points.ndim == 1
+        points = points.reshape(-1, len(shift.parameters))
+        gradients = np.zeros(points.shape)
+        if shift.occurrences and len(points):
+            bindings = [shift.shifted_bindings(p) for p in points]
+            rows, inverse = np.unique(
+                np.vstack([rows for rows, _ in bindings]),
+                axis=0,
+                return_inverse=True,
+            )
+            binds = {
+                phi: rows[:, k] for k, phi in enumerate(shift.shift_parameters)
+            }
+            statevectors = self._statevectors(
+                shift.circuit, [binds], **run_options
+            )
+            engine = ToasterExpectation.ToasterPauliExpectation(observable)
+            values = np.array([engine.evaluate(s).real for s in statevectors])
+            values = values[inverse.reshape(-1)].reshape(len(points), -1)
+            for i, (_, jacobian) in enumerate(bindings):
+                gradients[i] = shift.gradient(values[i], jacobian)
+        if single:
+            return gradients[0]
+        return gradients
+
+    async def run_async(
+        self, circuits, validate=False, parameter_binds=None, **run_options
+    ):
+        """
+        asyncio counterpart of run(). Must be awaited from a coroutine,
+        returned job is awaitable and can be iterated with `async for`.
+        sample_locally and callback are not supported.
+        """
+        if self._sampling_options is not None:
+            raise ValueError(
+                "run_async doesn't support sample_locally, use run() instead"
+            )
+        if "callback" in run_options:
+            raise ValueError(
+                "run_async doesn't support callback, iterate the job with "
+                "'async for' instead"
+            )
+        priority = run_options.pop("priority", 0)
+        qobj = self._assemble(
+            circuits, parameter_binds=parameter_binds, **run_options
+        )
+        job_id = str(uuid.uuid4())
+        job = ToasterAsyncJob.ToasterAsyncJob(
+            self,
+            job_id,
+            qobj,
+            getstates=self._getstates,
+            toaster_host=self._toaster_host,
+            toaster_port=self._toaster_port,
+            use_cli=self._use_cli,
+            http_options=self._http_options,
+            cache_options=self._cache_options,
+            result_cache_options=self._result_cache_options,
+            statevector_dir=self._statevector_dir,
+            compact_counts=self._compact_counts,
+            toaster_endpoints=self._toaster_endpoints,
+            balancer_options=self._balancer_options,
+            shots_per_run=self._shots_per_run,
+            max_workers=self._max_workers,
+            batch_size=self._batch_size,
+            memory_budget=self._memory_budget,
+            priority=priority,
         )
         job.submit()
         return job
 
+    @staticmethod
+    def connection_pool_stats():
+        """
+        Returns keep-alive connection pool counters of the current process.
+        With process pool executor the connections live in the worker
+        processes, use executor_type="thread" to observe them here.
+        """
+        return ToasterHttpInterface.connection_pool_stats()
+
+    @staticmethod
+    def conversion_cache_stats():
+        """
+        Returns qobj to toaster conversion cache statistics of the current
+        process keyed by cache directory (see connection_pool_stats about
+        process pool executor).
+        """
+        return ToasterCache.conversion_cache_stats()
+
+    @staticmethod
+    def result_cache_stats():
+        """
+        Returns seeded result cache statistics of the current process,
+        keyed by cache directory
+        """
+        return ToasterCache.result_cache_stats()
+
+    @staticmethod
+    def sampling_cache_stats():
+        """
+        Returns hit/miss statistics of cache of outcome probabilities used
+        by sample_locally, in the current process
+        """
+        return ToasterSampling.sampling_cache_stats()
+
+    @staticmethod
+    def scheduler_stats():
+        """
+        Returns admission counters of jobs sent to each toaster target,
+        keyed by "host:port" ("cli" for local toaster binary, joined
+        "host:port" of toaster_endpoints)
+        """
+        return ToasterScheduler.scheduler_stats()
+
+    @staticmethod
+    def budget_stats():
+        """
+        Returns memory budget and memory in flight of each toaster
+        machine, keyed by "host:port" ("cli" for local toaster binary)
+        """
+        return ToasterScheduler.budget_stats()
+
+    @staticmethod
+    def balancer_stats():
+        """
+        Returns in-flight count, latency and health of each balanced
+        toaster endpoint (see toaster_endpoints), as seen by the current
+        process
+        """
+        return ToasterBalancer.balancer_stats()
+
     @staticmethod
     def name():
         return "qubit_toaster"
@@ -135,11 +523,20 @@ class ToasterBackend(BackendV1):
 
 
 def get_backend(
-    backend_name=None, toaster_host=None, toaster_port=None, use_cli=False
+    backend_name=None,
+    toaster_host=None,
+    toaster_port=None,
+    use_cli=False,
+    **kwargs
 ):
+    """
+    Other keyword arguments (max_workers, executor_type, ...) are passed
+    to ToasterBackend constructor.
+    """
     return ToasterBackend(
         backend_name=backend_name,
         toaster_host=toaster_host,
         toaster_port=toaster_port,
         use_cli=use_cli,
+        **kwargs
     )
@@ -0,0 +1,287 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+import asyncio
+import http.client
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+from quantastica.qiskit_toaster import ToasterHttpInterface
+
+logger = logging.getLogger(__name__)
+
+
+class ToasterEndpoint:
+    # weight of the latest request in latency average
+    LATENCY_SMOOTHING = 0.3
+
+    def __init__(self, url):
+        self.url = url
+        self.in_flight = 0
+        # exponentially weighted average of request durations (seconds)
+        self.latency = 0.0
+        self.healthy = True
+        self.requests = 0
+        self.failures = 0
+        self.failed_at = None
+
+    def observe(self, latency):
+        if self.requests == 0:
+            self.latency = latency
+        else:
+            a = ToasterEndpoint.LATENCY_SMOOTHING
+            self.latency = a * latency + (1 - a) * self.latency
+        self.requests += 1
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "latency": self.latency,
+            "healthy": self.healthy,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class ToasterBalancer:
+    """
+    Spreads experiments over several toaster endpoints. Each experiment
+    goes to the healthy endpoint with the fewest requests in flight,
+    ties are broken by average latency of recent requests. Endpoints are
+    picked (and released) by ToasterScheduler of the job's process when
+    experiments are started, so load of all workers is known here.
+
+    Endpoint which can't be connected to is marked unhealthy and the
+    experiment is sent to another endpoint. Unhealthy endpoints are
+    probed in background every health_check_interval seconds and used
+    again once they answer.
+    """
+
+    DEFAULT_HEALTH_CHECK_INTERVAL = 5
+    HEALTH_CHECK_TIMEOUT = 2
+
+    def __init__(self, urls, health_check_interval=None):
+        if health_check_interval is None:
+            health_check_interval = (
+                ToasterBalancer.DEFAULT_HEALTH_CHECK_INTERVAL
+            )
+        self.health_check_interval = health_check_interval
+        self.endpoints = [ToasterEndpoint(url) for url in urls]
+        self._lock = threading.Lock()
+        self._health_checker = None
+
+    def _ranked(self, urls=None):
+        # called with self._lock held
+        endpoints = [
+            e for e in self.endpoints if urls is None or e.url in urls
+        ]
+        healthy = sorted(
+            (e for e in endpoints if e.healthy),
+            key=lambda e: (e.in_flight, e.latency),
+        )
+        unhealthy = sorted(
+            (e for e in endpoints if not e.healthy),
+            key=lambda e: e.failed_at,
+        )
+        return healthy + unhealthy
+
+    def acquire(self, urls=None):
+        """
+        Returns endpoint for the next request, among endpoints of given
+        urls (default: all). When all of them are unhealthy the one
+        which failed longest ago is tried.
+        """
+        with self._lock:
+            endpoint = self._ranked(urls)[0]
+            endpoint.in_flight += 1
+            return endpoint
+
+    def ranked_urls(self):
+        """Returns urls of endpoints, the preferred ones first"""
+        with self._lock:
+            return [e.url for e in self._ranked()]
+
+    def fallback_urls(self, endpoint):
+        """
+        Returns urls to try for request sent to endpoint: its own url
+        first, then the other endpoints in order of preference
+        """
+        urls = self.ranked_urls()
+        urls.remove(endpoint.url)
+        return [endpoint.url] + urls
+
+    def release(self, endpoint, latency=None, failed=False):
+        with self._lock:
+            endpoint.in_flight -= 1
+            if failed:
+                endpoint.failures += 1
+                endpoint.failed_at = time.monotonic()
+                if endpoint.healthy:
+                    logger.warning("Toaster %s is not reachable", endpoint.url)
+                endpoint.healthy = False
+                self._start_health_checker()
+            elif latency is not None:
+                endpoint.observe(latency)
+                endpoint.healthy = True
+
+    def _start_health_checker(self):
+        # called with self._lock held
+        checker = self._health_checker
+        if checker is None or not checker.is_alive():
+            self._health_checker = threading.Thread(
+                target=self._check_health, daemon=True
+            )
+            self._health_checker.start()
+
+    def _check_health(self):
+        """Probes unhealthy endpoints until all of them are back"""
+        while True:
+            time.sleep(self.health_check_interval)
+            with self._lock:
+                unhealthy = [e for e in self.endpoints if not e.healthy]
+            if not unhealthy:
+                return
+            for endpoint in unhealthy:
+                if ToasterBalancer.probe(endpoint.url):
+                    logger.info("Toaster %s is reachable again", endpoint.url)
+                    with self._lock:
+                        endpoint.healthy = True
+
+    @staticmethod
+    def probe(url):
+        """Returns True if toaster at url answers HTTP requests"""
+        parts = urlsplit(url)
+        conn = http.client.HTTPConnection(
+            parts.hostname,
+            parts.port or 80,
+            timeout=ToasterBalancer.HEALTH_CHECK_TIMEOUT,
+        )
+        try:
+            conn.request("GET", "/")
+            conn.getresponse().read()
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            conn.close()
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {e.url: e.stats() for e in self.endpoints}
+
+
+_balancers = dict()
+_balancers_lock = threading.Lock()
+
+
+def _forget_balancers_after_fork():
+    """
+    Forked process balances its own requests, in-flight counts and
+    locks inherited from the parent don't apply to it
+    """
+    global _balancers, _balancers_lock
+    _balancers = dict()
+    _balancers_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_balancers_after_fork)
+
+
+def get_balancer(urls, health_check_interval=None):
+    """Returns balancer of given toaster urls"""
+    key = tuple(urls)
+    with _balancers_lock:
+        balancer = _balancers.get(key)
+        if balancer is None:
+            balancer = ToasterBalancer(urls, health_check_interval)
+            _balancers[key] = balancer
+        elif health_check_interval is not None:
+            balancer.health_check_interval = health_check_interval
+    return balancer
+
+
+def balancer_stats():
+    with _balancers_lock:
+        balancers = list(_balancers.values())
+    stats = dict()
+    for balancer in balancers:
+        stats.update(balancer.stats())
+    return stats
+
+
+def _retry_delay(failures, count, max_retries):
+    """
+    Returns delay before next try after failures-th failed call to one of
+    count endpoints, or None if no tries are left. Each endpoint is tried
+    once right away, then they are tried again with growing delays, up to
+    max_retries more times.
+    """
+    if max_retries is None:
+        max_retries = (
+            ToasterHttpInterface.ToasterHttpInterface.DEFAULT_MAX_RETRIES
+        )
+    if failures > max_retries + count - 1:
+        return None
+    if failures < count:
+        return 0
+    return ToasterHttpInterface.backoff_delay(failures - count + 1)
+
+
+def failover(urls, fn, max_retries=None):
+    """
+    Returns fn(url) of the first of urls whose call doesn't fail with
+    ToasterConnectionError, see _retry_delay. Runs in worker, urls come
+    from the job's process (ToasterBalancer.fallback_urls).
+    """
+    failures = 0
+    while True:
+        url = urls[failures % len(urls)]
+        try:
+            return fn(url)
+        except ToasterHttpInterface.ToasterConnectionError:
+            failures += 1
+            delay = _retry_delay(failures, len(urls), max_retries)
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+
+async def failover_async(urls, fn, max_retries=None):
+    """asyncio counterpart of failover(), fn(url) returns awaitable"""
+    failures = 0
+    while True:
+        url = urls[failures % len(urls)]
+        try:
+            return await fn(url)
+        except ToasterHttpInterface.ToasterConnectionError:
+            failures += 1
+            delay = _retry_delay(failures, len(urls), max_retries)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+
+
+def endpoint_url(endpoint):
+    """
+    Returns toaster url of endpoint given as "host:port", (host, port)
+    or url
+    """
+    if isinstance(endpoint, (tuple, list)):
+        host, port = endpoint
+        return "http://%s:%d" % (host, int(port))
+    if "://" in endpoint:
+        return endpoint.rstrip("/")
+    return "http://%s" % endpoint
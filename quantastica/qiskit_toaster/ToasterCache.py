@@ -0,0 +1,340 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from quantastica.qconvert import qobj_to_toaster
+
+logger = logging.getLogger(__name__)
+
+try:
+    from importlib.metadata import version as _package_version
+
+    QCONVERT_VERSION = _package_version("quantastica-qconvert")
+except Exception:
+    QCONVERT_VERSION = "unknown"
+
+
+def structural_hash(*parts):
+    """sha256 of JSON representation of parts (dict keys are sorted)"""
+    text = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ToasterDiskStore:
+    """
+    Directory of files named by key, bounded to max_bytes in total.
+    Reading a file refreshes its modification time and least recently
+    used files are removed first. Safe to share between processes:
+    files are written to temporary name and atomically renamed.
+    """
+
+    def __init__(self, directory, max_bytes=None, suffix=".json"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.debug("Failed to write cache file: %s", e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        if self.max_bytes is not None:
+            self.evict()
+
+    def evict(self):
+        """Removes least recently used files until store fits max_bytes"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(self.suffix):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        evicted = 0
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        return evicted
+
+
+class ToasterConversionCache:
+    """
+    LRU cache of qobj_to_toaster results keyed by structural hash of the
+    experiment, with optional on-disk tier shared by worker processes.
+    """
+
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, max_bytes=None, directory=None, disk_max_bytes=None):
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.directory = directory
+        self._disk = None
+        if directory:
+            self._disk = ToasterDiskStore(directory, max_bytes=disk_max_bytes)
+        self.max_bytes = ToasterConversionCache.DEFAULT_MAX_BYTES
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.configure(max_bytes, disk_max_bytes)
+
+    def configure(self, max_bytes=None, disk_max_bytes=None):
+        """
+        Changes size limits which are given, keeping entries which still
+        fit in
+        """
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+                self._shrink()
+            if disk_max_bytes is not None and self._disk is not None:
+                self._disk.max_bytes = disk_max_bytes
+
+    @staticmethod
+    def key(qobj_dict):
+        """
+        Hash of everything qobj_to_toaster output depends on: experiment
+        instructions, register layout from experiment header and the
+        converter version.
+        """
+        exp = qobj_dict["experiments"][0]
+        header = exp.get("header", {})
+        return structural_hash(
+            QCONVERT_VERSION,
+            exp.get("instructions"),
+            header.get("n_qubits"),
+            header.get("memory_slots"),
+            header.get("creg_sizes"),
+        )
+
+    def convert(self, qobj_dict):
+        """Returns converted toaster circuit for single-experiment qobj"""
+        if self.max_bytes <= 0 and self._disk is None:
+            return qobj_to_toaster(qobj_dict, {"all_experiments": False})
+
+        key = ToasterConversionCache.key(qobj_dict)
+        with self._lock:
+            converted = self._entries.get(key)
+            if converted is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return converted
+
+        disk = self._disk
+        if disk is not None:
+            data = disk.get(key)
+            if data is not None:
+                converted = data.decode("utf-8")
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, converted)
+                return converted
+
+        with self._lock:
+            self.misses += 1
+        converted = qobj_to_toaster(qobj_dict, {"all_experiments": False})
+        self._remember(key, converted)
+        if disk is not None:
+            disk.put(key, converted.encode("utf-8"))
+        return converted
+
+    def _remember(self, key, converted):
+        size = len(converted)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = converted
+            self._bytes += size
+            self._shrink()
+
+    def _shrink(self):
+        while self._entries and self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "directory": self.directory,
+            }
+
+
+_conversion_caches = dict()
+_conversion_cache_lock = threading.Lock()
+
+
+def get_conversion_cache(max_bytes=None, directory=None, disk_max_bytes=None):
+    """
+    Returns conversion cache of the current process for given on-disk
+    directory (None for memory only cache). Size limits are changed only
+    when given, so backends which don't set them keep limits set by
+    others.
+    """
+    with _conversion_cache_lock:
+        cache = _conversion_caches.get(directory)
+        if cache is None:
+            cache = ToasterConversionCache(
+                max_bytes=max_bytes,
+                directory=directory,
+                disk_max_bytes=disk_max_bytes,
+            )
+            _conversion_caches[directory] = cache
+        else:
+            cache.configure(max_bytes, disk_max_bytes)
+        return cache
+
+
+def conversion_cache_stats():
+    """
+    Returns hit/miss statistics of conversion caches in the current
+    process, keyed by cache directory (None for memory only cache). With
+    process pool executor each worker has its own in-memory cache, use
+    directory to share conversions between them.
+    """
+    with _conversion_cache_lock:
+        caches = list(_conversion_caches.values())
+    return {cache.directory: cache.stats() for cache in caches}
+
+
+class ToasterResultCache:
+    """
+    On-disk cache of raw toaster responses for seeded runs. With fixed
+    seed toaster is deterministic, so response depends only on converted
+    circuit and simulation params.
+    """
+
+    DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+    def __init__(self, directory, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = ToasterResultCache.DEFAULT_MAX_BYTES
+        self._disk = ToasterDiskStore(directory, max_bytes=max_bytes)
+        self._lock = threading.Lock()
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(converted, shots, seed, returns, optimization):
+        return structural_hash(converted, shots, seed, returns, optimization)
+
+    def get(self, key):
+        """Returns cached toaster response (str) or None"""
+        data = self._disk.get(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return data.decode("utf-8")
+
+    def put(self, key, toasterjson):
+        if isinstance(toasterjson, str):
+            toasterjson = toasterjson.encode("utf-8")
+        self._disk.put(key, toasterjson)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "directory": self.directory,
+                "max_bytes": self._disk.max_bytes,
+            }
+
+
+_result_caches = dict()
+
+
+def get_result_cache(directory=None, max_bytes=None):
+    """
+    Returns result cache of the current process for given directory,
+    or None if directory is not set (result caching is opt-in)
+    """
+    if not directory:
+        return None
+    with _conversion_cache_lock:
+        cache = _result_caches.get(directory)
+        if cache is None:
+            cache = ToasterResultCache(directory, max_bytes=max_bytes)
+            _result_caches[directory] = cache
+        elif max_bytes is not None:
+            cache._disk.max_bytes = max_bytes
+        return cache
+
+
+def result_cache_stats():
+    """Returns hit/miss statistics of result caches in the current process"""
+    with _conversion_cache_lock:
+        caches = list(_result_caches.values())
+    return {cache.directory: cache.stats() for cache in caches}
@@ -10,11 +10,52 @@
 # Any modifications or derivative works of this code must retain this
 # copyright notice, and modified files need to carry a notice indicating
 # that they have been altered from the originals.
+from concurrent import futures
 import logging
+import asyncio
 import subprocess
+import threading
+
+from quantastica.qiskit_toaster import ToasterResponse
 
 logger = logging.getLogger(__name__)
 
+# how often running toaster checks if its job was cancelled (seconds)
+CANCEL_POLL_INTERVAL = 0.2
+
+
+class ToasterCliError(RuntimeError):
+    """qubit-toaster exited with non-zero exit code"""
+
+    def __init__(self, returncode):
+        super().__init__(
+            "Error received from CLI, exit code: %d" % returncode
+        )
+        self.returncode = returncode
+
+
+def _kill_on_cancel(proc, is_cancelled):
+    """
+    Starts thread which kills proc as soon as is_cancelled() returns
+    True. Returns event which is set if proc was killed.
+    """
+    killed = threading.Event()
+
+    def watch():
+        while True:
+            try:
+                proc.wait(CANCEL_POLL_INTERVAL)
+                return
+            except subprocess.TimeoutExpired:
+                if is_cancelled():
+                    logger.debug("Job cancelled, killing toaster")
+                    killed.set()
+                    proc.kill()
+                    return
+
+    threading.Thread(target=watch, daemon=True).start()
+    return killed
+
 
 class ToasterCliInterface:
     def __init__(self, toaster_path):
@@ -28,8 +69,109 @@ class ToasterCliInterface:
         shots=None,
         returns=None,
         optimization=None,
+        parser=None,
+        statevector_format=None,
+        is_cancelled=None,
     ):
+        """
+        Returns toaster's stdout, or parsed response if parser
+        (ToasterResponseParser) is given.
+        If is_cancelled() becomes True toaster process is killed and
+        concurrent.futures.CancelledError is raised.
+        """
+        args = self._build_args(
+            seed=seed,
+            shots=shots,
+            returns=returns,
+            optimization=optimization,
+            statevector_format=statevector_format,
+        )
+        proc = subprocess.Popen(
+            args,
+            close_fds=False,
+            restore_signals=False,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+        logger.info("Running q-toaster with following params:")
+        logger.info(args)
+        killed = None
+        if is_cancelled is not None:
+            killed = _kill_on_cancel(proc, is_cancelled)
+        try:
+            if parser is None:
+                qtoasterjson, stderr = proc.communicate(input=jsonstr)
+            else:
+                qtoasterjson, stderr = self._communicate_parsed(
+                    proc, jsonstr, parser
+                )
+        except Exception:
+            if killed is not None and killed.is_set():
+                raise futures.CancelledError(
+                    "Toaster job %s was cancelled" % job_id
+                )
+            raise
+        if killed is not None and killed.is_set():
+            raise futures.CancelledError(
+                "Toaster job %s was cancelled" % job_id
+            )
+        returncode = proc.returncode
+        if returncode > 0:
+            logger.debug(
+                "Toaster finished with non-zero exit code (%d) :" % returncode,
+                stderr,
+            )
+            raise ToasterCliError(returncode)
+
+        return qtoasterjson
 
+    @staticmethod
+    def _communicate_parsed(proc, jsonstr, parser):
+        """
+        Like proc.communicate(), but stdout is fed to parser in chunks
+        instead of being buffered. Returns (parsed response, stderr).
+        """
+        stderr = []
+
+        def write_stdin():
+            try:
+                proc.stdin.write(jsonstr)
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        threads = [
+            threading.Thread(target=write_stdin, daemon=True),
+            threading.Thread(
+                target=lambda: stderr.append(proc.stderr.read()), daemon=True
+            ),
+        ]
+        for thread in threads:
+            thread.start()
+        while True:
+            chunk = proc.stdout.read(ToasterResponse.CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+        for thread in threads:
+            thread.join()
+        proc.stdout.close()
+        proc.stderr.close()
+        proc.wait()
+        if proc.returncode > 0:
+            return None, b"".join(stderr)
+        return parser.close(), b"".join(stderr)
+
+    def _build_args(
+        self,
+        seed=None,
+        shots=None,
+        returns=None,
+        optimization=None,
+        statevector_format=None,
+    ):
         args = [self.toaster_path, "-", "-s", str(shots)]
         if returns:
             returns = returns.split(",")
@@ -44,11 +186,38 @@ class ToasterCliInterface:
         if optimization:
             args.append("-o")
             args.append(str(optimization))
+        if statevector_format:
+            args.append("--statevector-format")
+            args.append(statevector_format)
+        return args
 
-        proc = subprocess.Popen(
-            args,
-            close_fds=False,
-            restore_signals=False,
+
+class ToasterAsyncCliInterface(ToasterCliInterface):
+    """
+    asyncio counterpart of ToasterCliInterface, waits for qubit-toaster
+    process without blocking the event loop.
+    """
+
+    async def execute(
+        self,
+        jsonstr,
+        job_id=None,
+        seed=None,
+        shots=None,
+        returns=None,
+        optimization=None,
+        parser=None,
+        statevector_format=None,
+    ):
+        args = self._build_args(
+            seed=seed,
+            shots=shots,
+            returns=returns,
+            optimization=optimization,
+            statevector_format=statevector_format,
+        )
+        proc = await asyncio.create_subprocess_exec(
+            *args,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -56,15 +225,50 @@ class ToasterCliInterface:
 
         logger.info("Running q-toaster with following params:")
         logger.info(args)
-        qtoasterjson, stderr = proc.communicate(input=jsonstr)
+        try:
+            if parser is None:
+                qtoasterjson, stderr = await proc.communicate(input=jsonstr)
+            else:
+                qtoasterjson, stderr = await self._communicate_parsed_async(
+                    proc, jsonstr, parser
+                )
+        except asyncio.CancelledError:
+            # don't leave cancelled simulation running
+            if proc.returncode is None:
+                proc.kill()
+            raise
         returncode = proc.returncode
         if returncode > 0:
             logger.debug(
-                "Toaster finished with non-zero exit code (%d) :" % returncode,
+                "Toaster finished with non-zero exit code (%d): %s",
+                returncode,
                 stderr,
             )
-            raise RuntimeError(
-                "Error received from CLI, exit code: %d" % returncode
-            )
+            raise ToasterCliError(returncode)
 
         return qtoasterjson
+
+    @staticmethod
+    async def _communicate_parsed_async(proc, jsonstr, parser):
+        async def write_stdin():
+            try:
+                proc.stdin.write(jsonstr)
+                await proc.stdin.drain()
+                proc.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        async def read_stdout():
+            while True:
+                chunk = await proc.stdout.read(ToasterResponse.CHUNK_SIZE)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+
+        _, stderr, _ = await asyncio.gather(
+            write_stdin(), proc.stderr.read(), read_stdout()
+        )
+        await proc.wait()
+        if proc.returncode > 0:
+            return None, stderr
+        return parser.close(), stderr
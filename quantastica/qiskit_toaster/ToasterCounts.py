@@ -0,0 +1,91 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+import numpy as np
+
+# widest register whose outcomes fit into uint64
+_MAX_VECTORIZED_BITS = 64
+_SPACE = ord(" ")
+_ZERO = ord("0")
+
+
+def counts_to_arrays(counts):
+    """
+    Converts toaster counts {"01 1": 10, ...} into parallel arrays
+    (outcomes, frequencies). Outcomes are integers of the bitstrings with
+    register separators removed (uint64, or object for registers wider
+    than 64 bits).
+    """
+    keys = list(counts)
+    frequencies = np.fromiter(counts.values(), dtype=np.int64, count=len(keys))
+    if not keys:
+        return np.zeros(0, dtype=np.uint64), frequencies
+    width = len(keys[0])
+    text = "".join(keys)
+    if len(text) != width * len(keys) or not text.isascii():
+        return _counts_to_arrays_slow(keys), frequencies
+    chars = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    chars = chars.reshape(len(keys), width)
+    # all keys share register layout, separators are in the same columns
+    bits = chars[:, chars[0] != _SPACE]
+    num_bits = bits.shape[1]
+    if num_bits > _MAX_VECTORIZED_BITS:
+        return _counts_to_arrays_slow(keys), frequencies
+    weights = np.left_shift(
+        np.uint64(1), np.arange(num_bits - 1, -1, -1, dtype=np.uint64)
+    )
+    outcomes = (bits - _ZERO).astype(np.uint64) @ weights
+    return outcomes, frequencies
+
+
+def _counts_to_arrays_slow(keys):
+    return np.array(
+        [int(key.replace(" ", ""), 2) for key in keys], dtype=object
+    )
+
+
+def arrays_to_counts(outcomes, frequencies):
+    """Returns counts in qiskit's Result format {"0x1": 10, ...}"""
+    return dict(zip(map(hex, outcomes.tolist()), frequencies.tolist()))
+
+
+def convert_counts(counts):
+    """Converts toaster counts into qiskit's Result format"""
+    return arrays_to_counts(*counts_to_arrays(counts))
+
+
+def merge_counts_arrays(arrays):
+    """
+    Sums list of (outcomes, frequencies) pairs (e.g. counts of sub-runs
+    of the same experiment) into one pair
+    """
+    outcomes = np.concatenate([o for o, _ in arrays])
+    frequencies = np.concatenate([f for _, f in arrays])
+    if len(outcomes) == 0:
+        return outcomes, frequencies
+    unique, inverse = np.unique(outcomes, return_inverse=True)
+    totals = np.zeros(len(unique), dtype=np.int64)
+    np.add.at(totals, inverse, frequencies)
+    return unique, totals
+
+
+def expand_counts(data):
+    """
+    Returns experiment data dict with compact "counts_arrays" converted
+    to counts in qiskit's format (data itself is returned if it has no
+    compact counts)
+    """
+    if "counts_arrays" not in data:
+        return data
+    data = dict(data)
+    data["counts"] = arrays_to_counts(*data.pop("counts_arrays"))
+    return data
@@ -0,0 +1,137 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+import numpy as np
+
+from qiskit.quantum_info import SparsePauliOp
+
+_SQRT_HALF = np.sqrt(0.5)
+
+# single-qubit rotations which map X and Y eigenbasis to Z eigenbasis
+# (H and H * Sdg)
+_ROTATIONS = {
+    "X": np.array([[1, 1], [1, -1]]) * _SQRT_HALF,
+    "Y": np.array([[1, -1j], [1, 1j]]) * _SQRT_HALF,
+}
+
+
+def _rotate(state, qubit, matrix):
+    """Applies 2x2 matrix to qubit of statevector in place"""
+    view = state.reshape(-1, 2, 2 ** qubit)
+    zero = view[:, 0, :].copy()
+    one = view[:, 1, :]
+    view[:, 0, :] = matrix[0, 0] * zero + matrix[0, 1] * one
+    view[:, 1, :] = matrix[1, 0] * zero + matrix[1, 1] * one
+
+
+def _parity_sum(probabilities, mask, n_qubits):
+    """
+    Returns sum of probabilities[i] * (-1)^popcount(i & mask). Qubits are
+    summed out one by one, so it costs about 2^n_qubits additions.
+    """
+    reduced = probabilities.reshape((2,) * n_qubits)
+    for qubit in range(n_qubits - 1, -1, -1):
+        if (mask >> qubit) & 1:
+            reduced = reduced[0] - reduced[1]
+        else:
+            reduced = reduced[0] + reduced[1]
+    return float(reduced)
+
+
+def _walsh_hadamard(probabilities, n_qubits):
+    """
+    Returns parity sums (see _parity_sum) of all 2^n_qubits masks at
+    once, indexed by mask
+    """
+    transformed = probabilities.copy()
+    for qubit in range(n_qubits):
+        view = transformed.reshape(-1, 2, 2 ** qubit)
+        zero = view[:, 0, :].copy()
+        view[:, 0, :] += view[:, 1, :]
+        view[:, 1, :] = zero - view[:, 1, :]
+    return transformed
+
+
+class ToasterPauliExpectation:
+    """
+    Computes expectation value of SparsePauliOp observable directly from
+    statevector amplitudes.
+
+    Terms are grouped into qubit-wise commuting sets. Statevector is
+    rotated into common eigenbasis of each set once, after that every
+    term of the set is a Z string whose expectation is parity sum of the
+    same probabilities. Sets with more terms than qubits get all parity
+    sums from a single Walsh-Hadamard transform.
+    """
+
+    def __init__(self, observable):
+        if not isinstance(observable, SparsePauliOp):
+            observable = SparsePauliOp(observable)
+        self.num_qubits = observable.num_qubits
+        weights = 1 << np.arange(self.num_qubits, dtype=np.int64)
+        # list of (rotations, masks, coefficients) per commuting set
+        self.groups = []
+        for group in observable.group_commuting(qubit_wise=True):
+            x = group.paulis.x
+            z = group.paulis.z
+            xs = x.any(axis=0)
+            ys = (x & z).any(axis=0)
+            rotations = [
+                (qubit, "Y" if ys[qubit] else "X")
+                for qubit in range(self.num_qubits)
+                if xs[qubit]
+            ]
+            masks = (x | z).astype(np.int64) @ weights
+            # label phase (-i)^phase, Y count is in the label itself
+            coefficients = group.coeffs * (-1j) ** group.paulis.phase
+            self.groups.append((rotations, masks, coefficients))
+        # expectation value is real if all coefficients are
+        self.hermitian = all(
+            np.allclose(coefficients.imag, 0)
+            for _, _, coefficients in self.groups
+        )
+
+    def evaluate(self, statevector):
+        """Returns expectation value (complex) in given statevector"""
+        state = np.asarray(statevector, dtype=complex)
+        if len(state) != 2 ** self.num_qubits:
+            raise ValueError(
+                "Statevector of %d amplitudes doesn't match observable "
+                "on %d qubits" % (len(state), self.num_qubits)
+            )
+        value = 0j
+        for rotations, masks, coefficients in self.groups:
+            rotated = state
+            if rotations:
+                rotated = state.copy()
+                for qubit, basis in rotations:
+                    _rotate(rotated, qubit, _ROTATIONS[basis])
+            probabilities = rotated.real ** 2 + rotated.imag ** 2
+            if len(masks) > self.num_qubits:
+                sums = _walsh_hadamard(probabilities, self.num_qubits)[masks]
+            else:
+                sums = np.array(
+                    [
+                        _parity_sum(probabilities, mask, self.num_qubits)
+                        for mask in masks
+                    ]
+                )
+            value += coefficients @ sums
+        return value
+
+
+def expectation_value(statevector, observable):
+    """
+    Returns expectation value of observable (SparsePauliOp or anything
+    it can be constructed from) in statevector
+    """
+    return ToasterPauliExpectation(observable).evaluate(statevector)
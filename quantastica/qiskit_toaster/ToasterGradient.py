@@ -0,0 +1,115 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+import numpy as np
+
+from qiskit.circuit import Parameter, ParameterExpression
+
+# gates whose parameters enter as exp(-i * param / 2 * P) with P having
+# eigenvalues +-1 (up to global phase), so the shift rule is exact, and
+# which toaster converter has matrix definition for
+SHIFTABLE_GATES = {
+    "rx",
+    "ry",
+    "rz",
+    "u1",
+    "u2",
+    "u3",
+}
+SHIFT = np.pi / 2
+
+
+def _bind(expression, values):
+    """Returns float value of expression with values {Parameter: value}"""
+    if not isinstance(expression, ParameterExpression):
+        return float(expression)
+    bound = expression.bind(
+        {p: values[p] for p in expression.parameters}
+    )
+    return float(bound)
+
+
+class ToasterParameterShift:
+    """
+    Parameter-shift gradient of parameterized circuit.
+
+    Every parameterized gate param is replaced by its own shift
+    parameter, so a circuit with P parameters used in K gate params needs
+    2K shifted bind sets of a single circuit (converted to toaster format
+    once as template). Gradient with respect to circuit parameters
+    follows by chain rule, which also covers parameter expressions.
+    """
+
+    def __init__(self, circuit):
+        self.parameters = list(circuit.parameters)
+        # (shift parameter, original param expression) per gate param
+        self.occurrences = []
+        self.circuit = self._expand(circuit)
+        self.shift_parameters = [phi for phi, _ in self.occurrences]
+
+    def _expand(self, circuit):
+        expanded = circuit.copy_empty_like()
+        # global phase doesn't change expectation values
+        expanded.global_phase = 0
+        for instruction in circuit.data:
+            operation = instruction.operation
+            params = []
+            for param in operation.params:
+                if not (
+                    isinstance(param, ParameterExpression) and param.parameters
+                ):
+                    params.append(param)
+                    continue
+                if operation.name not in SHIFTABLE_GATES:
+                    raise ValueError(
+                        "Parameter-shift rule doesn't support gate '%s', "
+                        "supported gates are: %s"
+                        % (operation.name, ", ".join(sorted(SHIFTABLE_GATES)))
+                    )
+                phi = Parameter("_toaster_shift_%d" % len(self.occurrences))
+                self.occurrences.append((phi, param))
+                params.append(phi)
+            if params != list(operation.params):
+                operation = operation.copy()
+                operation.params = params
+            expanded.append(operation, instruction.qubits, instruction.clbits)
+        return expanded
+
+    def shifted_bindings(self, values):
+        """
+        Returns (rows, jacobian) for circuit parameter values (in
+        self.parameters order): array of 2K shift parameter values, plus
+        shifted rows first and minus shifted second, and K x P matrix of
+        derivatives of gate params with respect to circuit parameters
+        """
+        values = dict(zip(self.parameters, values))
+        base = np.array(
+            [_bind(param, values) for _, param in self.occurrences]
+        )
+        jacobian = np.zeros((len(self.occurrences), len(self.parameters)))
+        for k, (_, param) in enumerate(self.occurrences):
+            for j, parameter in enumerate(self.parameters):
+                if parameter in param.parameters:
+                    jacobian[k, j] = _bind(param.gradient(parameter), values)
+        shifts = SHIFT * np.eye(len(base))
+        rows = np.vstack([base + shifts, base - shifts])
+        return rows, jacobian
+
+    @staticmethod
+    def gradient(values, jacobian):
+        """
+        Returns gradient from expectation values of rows returned by
+        shifted_bindings and its jacobian
+        """
+        plus, minus = np.split(np.asarray(values), 2)
+        derivatives = (plus - minus) / (2 * np.sin(SHIFT))
+        return derivatives @ jacobian
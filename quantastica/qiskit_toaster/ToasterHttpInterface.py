@@ -10,19 +10,311 @@
 # Any modifications or derivative works of this code must retain this
 # copyright notice, and modified files need to carry a notice indicating
 # that they have been altered from the originals.
+from concurrent import futures
 import logging
-import urllib
-from urllib import request
+import os
+import asyncio
+import collections
+import http.client
+import random
+import threading
 import time
 import socket
+from urllib.parse import urlsplit
+
+from quantastica.qiskit_toaster import ToasterResponse
 
 
 logger = logging.getLogger(__name__)
 
 
+class ToasterHttpError(Exception):
+    def __init__(self, status, reason):
+        super().__init__("HTTP Error %d: %s" % (status, reason))
+        self.code = status
+        self.reason = reason
+
+
+class ToasterPending(Exception):
+    """Toaster accepted the job, but its result is not ready yet"""
+
+    def __init__(self, status):
+        super().__init__("Result is not ready (HTTP %d)" % status)
+        self.code = status
+
+
+class ToasterDeadlineError(RuntimeError):
+    pass
+
+
+class ToasterConnectionError(RuntimeError):
+    """Toaster could not be reached, the job was not submitted"""
+
+
+class ToasterRequestError(RuntimeError):
+    """Toaster rejected the request (HTTP 4xx)"""
+
+    def __init__(self, msg, code):
+        super().__init__(msg)
+        self.code = code
+
+
+# statuses of /submit and /pollresult responses without result
+PENDING_STATUSES = (202, 204)
+
+# exponential backoff between retries (seconds)
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 10
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+    """
+    Returns delay before retry number attempt (1, 2, ...): exponentially
+    growing up to maximum, randomized into its upper half so clients
+    which failed together don't retry together
+    """
+    delay = min(maximum, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _submit_error(e):
+    """Returns exception to raise for ToasterHttpError of /submit"""
+    msg = "Error received from API(2): %s" % str(e)
+    if 400 <= e.code < 500:
+        return ToasterRequestError(msg, e.code)
+    return RuntimeError(msg)
+
+
+class ToasterConnectionPool:
+    """
+    Keeps idle keep-alive connections to a single toaster endpoint so they
+    can be reused by subsequent requests (experiments, polls and jobs).
+    """
+
+    DEFAULT_POOL_SIZE = 4
+    DEFAULT_IDLE_TIMEOUT = 30
+
+    def __init__(self, host, port, pool_size=None, idle_timeout=None):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size or ToasterConnectionPool.DEFAULT_POOL_SIZE
+        if idle_timeout is None:
+            idle_timeout = ToasterConnectionPool.DEFAULT_IDLE_TIMEOUT
+        self.idle_timeout = idle_timeout
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, timeout=None):
+        """Returns (connection, reused)"""
+        with self._lock:
+            self._evict_idle()
+            if self._idle:
+                conn, _ = self._idle.pop()
+                self.hits += 1
+                reused = True
+            else:
+                conn = None
+                self.misses += 1
+                reused = False
+        if conn is None:
+            conn = http.client.HTTPConnection(
+                self.host, self.port, timeout=timeout
+            )
+        else:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+        return conn, reused
+
+    def release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((conn, time.monotonic()))
+                return
+            self.evictions += 1
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "idle": len(self._idle),
+                "pool_size": self.pool_size,
+                "idle_timeout": self.idle_timeout,
+            }
+
+    def _evict_idle(self):
+        # oldest connections are on the left side of the deque
+        deadline = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < deadline:
+            conn, _ = self._idle.popleft()
+            conn.close()
+            self.evictions += 1
+
+
+_pools = dict()
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(toaster_url, pool_size=None, idle_timeout=None):
+    parts = urlsplit(toaster_url)
+    key = (parts.hostname, parts.port or 80)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ToasterConnectionPool(
+                key[0], key[1], pool_size=pool_size, idle_timeout=idle_timeout
+            )
+            _pools[key] = pool
+        else:
+            if pool_size is not None:
+                pool.pool_size = pool_size
+            if idle_timeout is not None:
+                pool.idle_timeout = idle_timeout
+    return pool
+
+
+def _forget_pools_after_fork():
+    """
+    Forked process (process pool worker) inherits parent's sockets,
+    using them from both processes would interleave requests on the same
+    connection. Child starts with empty pools instead, inherited
+    connections are left to the parent.
+    """
+    global _pools, _pools_lock
+    _pools = dict()
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_pools_after_fork)
+
+
+def connection_pool_stats():
+    """
+    Returns hit/miss/eviction counters of all connection pools in the
+    current process, keyed by "host:port". Note that with process pool
+    executors each worker process has its own set of connection pools.
+    """
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {"%s:%d" % key: pool.stats() for key, pool in pools}
+
+
+def close_connection_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def build_request_headers(
+    job_id=None,
+    seed=None,
+    shots=None,
+    returns=None,
+    optimization=None,
+    statevector_format=None,
+):
+    params = dict()
+    params["x-qtc-return"] = returns or "counts"
+    params["x-qtc-shots"] = "%d" % (shots or 1)
+    params["x-qtc-jobid"] = job_id or ""
+    if seed:
+        params["x-qtc-seed"] = "%d" % seed
+    if optimization:
+        params["x-qtc-optimization"] = "%d" % optimization
+    if statevector_format:
+        params["x-qtc-statevector-format"] = statevector_format
+    params["content-type"] = "application/json"
+    return params
+
+
+def _check_cancelled(is_cancelled, job_id):
+    if is_cancelled is not None and is_cancelled():
+        raise futures.CancelledError("Toaster job %s was cancelled" % job_id)
+
+
+def _check_deadline(deadline, job_id):
+    if deadline is not None and time.time() >= deadline:
+        raise ToasterDeadlineError(
+            "Toaster job %s did not finish before deadline" % job_id
+        )
+
+
+def _time_left(deadline, job_id, timeout):
+    """Returns timeout shortened to time left until deadline"""
+    if deadline is None:
+        return timeout
+    left = deadline - time.time()
+    if left <= 0:
+        _check_deadline(deadline, job_id)
+    if timeout is None:
+        return left
+    return min(timeout, left)
+
+
 class ToasterHttpInterface:
-    def __init__(self, toaster_url):
+    # timeout of abort request (seconds)
+    ABORT_TIMEOUT = 5
+    DEFAULT_CONNECT_TIMEOUT = 10
+    DEFAULT_MAX_RETRIES = 5
+    # long-poll wait asked from toaster (seconds), 0 disables long-polling
+    DEFAULT_POLL_WAIT = 30
+    # extra time given to toaster to answer long-poll
+    POLL_READ_SLACK = 5
+
+    def __init__(
+        self,
+        toaster_url,
+        pool_size=None,
+        pool_idle_timeout=None,
+        connect_timeout=None,
+        read_timeout=None,
+        max_retries=None,
+        poll_wait=None,
+        deadline=None,
+    ):
+        """
+        connect_timeout - seconds to establish connection
+        read_timeout - seconds to wait for toaster's response to /submit
+            (None: wait as long as simulation runs), then job's result is
+            polled for
+        max_retries - retries of failed connections, with exponential
+            backoff between them
+        poll_wait - seconds toaster may hold /pollresult until result is
+            ready
+        deadline - time.time() by which execute() must return, otherwise
+            ToasterDeadlineError is raised
+        """
         self.toaster_url = toaster_url
+        self._pool = get_connection_pool(
+            toaster_url, pool_size=pool_size, idle_timeout=pool_idle_timeout
+        )
+        if connect_timeout is None:
+            connect_timeout = ToasterHttpInterface.DEFAULT_CONNECT_TIMEOUT
+        if max_retries is None:
+            max_retries = ToasterHttpInterface.DEFAULT_MAX_RETRIES
+        if poll_wait is None:
+            poll_wait = ToasterHttpInterface.DEFAULT_POLL_WAIT
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.poll_wait = poll_wait
+        self.deadline = deadline
 
     def execute(
         self,
@@ -32,85 +324,432 @@ class ToasterHttpInterface:
         shots=None,
         returns=None,
         optimization=None,
+        parser=None,
+        statevector_format=None,
+        is_cancelled=None,
     ):
-
-        params = dict()
-        params["x-qtc-return"] = returns or "counts"
-        params["x-qtc-shots"] = "%d" % (shots or 1)
-        params["x-qtc-jobid"] = job_id or ""
-        if seed:
-            params["x-qtc-seed"] = "%d" % seed
-        if optimization:
-            params["x-qtc-optimization"] = "%d" % optimization
-
+        """
+        Returns toaster response as text, or as parsed dict if
+        parser (ToasterResponseParser) is given.
+        Retrying and polling stop with concurrent.futures.CancelledError
+        once is_cancelled() returns True.
+        """
+        params = build_request_headers(
+            job_id=job_id,
+            seed=seed,
+            shots=shots,
+            returns=returns,
+            optimization=optimization,
+            statevector_format=statevector_format,
+        )
         logger.info("Sending circuit to toaster, url: %s", self.toaster_url)
         logger.info("Simulation params: %s", params)
-        timeout = None
-        params["content-type"] = "application/json"
-        req = request.Request(
-            self.toaster_url + "/submit", data=jsonstr, headers=params
-        )
-        txt = None
-        max_retries = 5
         retry_count = 0
 
         while True:
+            self._check(job_id, is_cancelled)
+            timeout = self._timeout(job_id, self.read_timeout)
             try:
-                response = request.urlopen(req, timeout=timeout)
-            except socket.timeout as e:
+                body = self._request(
+                    "POST", "/submit", jsonstr, params, timeout, parser
+                )
+            except (socket.timeout, ToasterPending) as e:
+                # still running, lets wait for results
                 logger.debug("Exception raised: %s", e)
-                txt = self._fetch_last_response(timeout, job_id)
-                if txt is None:
-                    continue
-                else:
-                    break
-            except urllib.error.HTTPError as e:
+                return self._fetch_last_response(job_id, parser, is_cancelled)
+            except ToasterHttpError as e:
                 logger.debug("Exception raised: %s", e)
                 # already submitted, lets fetch results
                 if e.code == 409:
-                    txt = self._fetch_last_response(timeout, job_id)
-                    if txt is None:
-                        continue
-                    else:
-                        break
-                else:
-                    raise RuntimeError(
-                        "Error received from API(2): %s" % str(e)
+                    return self._fetch_last_response(
+                        job_id, parser, is_cancelled
                     )
-            except Exception:
-                if retry_count < max_retries:
-                    retry_count += 1
-                    logger.debug(
-                        "Connection failed, retrying (#%d)...", retry_count
+                raise _submit_error(e)
+            except Exception as e:
+                if retry_count >= self.max_retries:
+                    msg = (
+                        "Failed to connect to qubit-toaster, probably not running (url: %s)"
+                        % self.toaster_url
                     )
-                    time.sleep(0.2)
+                    logger.critical(msg)
+                    raise ToasterConnectionError(msg)
+                retry_count += 1
+                delay = backoff_delay(retry_count)
+                logger.debug(
+                    "Connection failed (%s), retrying (#%d) in %.2fs...",
+                    e,
+                    retry_count,
+                    delay,
+                )
+                self._sleep(job_id, delay)
+            else:
+                return body if parser else body.decode("utf8")
+
+    def _fetch_last_response(self, job_id, parser=None, is_cancelled=None):
+        """
+        Polls for result of job_id. Toaster can hold each poll for up to
+        poll_wait seconds and answer 202/204 if the result is not ready
+        yet, so a long running job costs only a few requests.
+        """
+        path = "/pollresult/%s" % job_id
+        headers = dict()
+        timeout = self.read_timeout
+        if self.poll_wait:
+            headers["x-qtc-wait"] = "%d" % self.poll_wait
+            timeout = self.poll_wait + ToasterHttpInterface.POLL_READ_SLACK
+        failures = 0
+        while True:
+            self._check(job_id, is_cancelled)
+            started = time.monotonic()
+            request_timeout = self._timeout(job_id, timeout)
+            try:
+                body = self._request(
+                    "GET", path, None, headers, request_timeout, parser
+                )
+            except ToasterPending:
+                waited = time.monotonic() - started
+                if self.poll_wait > 0 and waited >= self.poll_wait / 2:
+                    # long-poll expired, ask again right away
+                    failures = 0
+                    continue
+                # toaster doesn't hold polls, don't hammer it
+                failures += 1
+                self._sleep(job_id, backoff_delay(failures))
+            except ToasterHttpError as e:
+                raise RuntimeError("Error received from API(1): %s" % str(e))
+            except (OSError, http.client.HTTPException) as e:
+                failures += 1
+                delay = backoff_delay(failures)
+                logger.debug(
+                    "Exception raised: %s, polling again in %.2fs", e, delay
+                )
+                self._sleep(job_id, delay)
+            else:
+                return body if parser else body.decode("utf8")
+
+    def _check(self, job_id, is_cancelled):
+        _check_cancelled(is_cancelled, job_id)
+        _check_deadline(self.deadline, job_id)
+
+    def _timeout(self, job_id, timeout):
+        return _time_left(self.deadline, job_id, timeout)
+
+    def _sleep(self, job_id, delay):
+        time.sleep(self._timeout(job_id, delay))
+
+    def abort(self, job_id):
+        """
+        Asks toaster to abort job_id. Returns False if toaster doesn't
+        support aborting or doesn't know the job.
+        """
+        try:
+            self._request(
+                "POST",
+                "/abort/%s" % job_id,
+                b"",
+                {},
+                ToasterHttpInterface.ABORT_TIMEOUT,
+            )
+        except (ToasterHttpError, OSError, http.client.HTTPException) as e:
+            logger.debug("Abort of %s failed: %s", job_id, e)
+            return False
+        return True
+
+    def _request(self, method, path, body, headers, timeout, parser=None):
+        """
+        Sends request over pooled connection and returns response body,
+        or parsed response if parser is given (body is then fed to the
+        parser as it arrives).
+        Connection that was closed by the server while idling in the pool
+        is silently replaced with a new one.
+        timeout applies to reading the response, connecting is limited by
+        connect_timeout.
+        """
+        while True:
+            conn, reused = self._pool.acquire(self.connect_timeout)
+            try:
+                if conn.sock is None:
+                    try:
+                        conn.connect()
+                    except socket.timeout as e:
+                        # not a slow simulation, toaster is unreachable
+                        raise ConnectionError(
+                            "Connecting to %s timed out" % self.toaster_url
+                        ) from e
+                conn.sock.settimeout(timeout)
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                if parser is None or response.status != 200:
+                    data = response.read()
                 else:
+                    parser.reset()
+                    while True:
+                        chunk = response.read(ToasterResponse.CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        parser.feed(chunk)
+                    data = parser.close()
+            except (
+                http.client.RemoteDisconnected,
+                ConnectionResetError,
+                BrokenPipeError,
+            ):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._pool.release(conn)
+
+            if response.status >= 400:
+                raise ToasterHttpError(response.status, response.reason)
+            if response.status in PENDING_STATUSES:
+                raise ToasterPending(response.status)
+            return data
+
+
+class ToasterAsyncHttpInterface:
+    """
+    asyncio counterpart of ToasterHttpInterface. Requests are sent over
+    non-blocking sockets so a single event loop can wait on many toaster
+    jobs at once. Timeouts, retries, long-polling and deadline work as in
+    ToasterHttpInterface.
+    """
+
+    def __init__(
+        self,
+        toaster_url,
+        connect_timeout=None,
+        read_timeout=None,
+        max_retries=None,
+        poll_wait=None,
+        deadline=None,
+    ):
+        parts = urlsplit(toaster_url)
+        self.toaster_url = toaster_url
+        self._host = parts.hostname
+        self._port = parts.port or 80
+        if connect_timeout is None:
+            connect_timeout = ToasterHttpInterface.DEFAULT_CONNECT_TIMEOUT
+        if max_retries is None:
+            max_retries = ToasterHttpInterface.DEFAULT_MAX_RETRIES
+        if poll_wait is None:
+            poll_wait = ToasterHttpInterface.DEFAULT_POLL_WAIT
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.poll_wait = poll_wait
+        self.deadline = deadline
+
+    async def execute(
+        self,
+        jsonstr,
+        job_id=None,
+        seed=None,
+        shots=None,
+        returns=None,
+        optimization=None,
+        parser=None,
+        statevector_format=None,
+    ):
+        params = build_request_headers(
+            job_id=job_id,
+            seed=seed,
+            shots=shots,
+            returns=returns,
+            optimization=optimization,
+            statevector_format=statevector_format,
+        )
+        logger.info("Sending circuit to toaster, url: %s", self.toaster_url)
+        logger.info("Simulation params: %s", params)
+        retry_count = 0
+
+        while True:
+            _check_deadline(self.deadline, job_id)
+            timeout = _time_left(self.deadline, job_id, self.read_timeout)
+            try:
+                body = await self._request(
+                    "POST", "/submit", jsonstr, params, timeout, parser
+                )
+            except (asyncio.TimeoutError, ToasterPending) as e:
+                # still running, lets wait for results
+                logger.debug("Exception raised: %r", e)
+                return await self._fetch_last_response(job_id, parser)
+            except ToasterHttpError as e:
+                logger.debug("Exception raised: %s", e)
+                # already submitted, lets fetch results
+                if e.code == 409:
+                    return await self._fetch_last_response(job_id, parser)
+                raise _submit_error(e)
+            except (OSError, asyncio.IncompleteReadError):
+                if retry_count >= self.max_retries:
                     msg = (
                         "Failed to connect to qubit-toaster, probably not running (url: %s)"
                         % self.toaster_url
                     )
                     logger.critical(msg)
-                    raise RuntimeError(msg)
+                    raise ToasterConnectionError(msg)
+                retry_count += 1
+                logger.debug(
+                    "Connection failed, retrying (#%d)...", retry_count
+                )
+                await self._sleep(job_id, backoff_delay(retry_count))
             else:
-                txt = response.read().decode("utf8")
-                break
+                return body if parser else body.decode("utf8")
 
-        return txt
-
-    def _fetch_last_response(self, timeout, job_id):
-        req = request.Request("%s/pollresult/%s" % (self.toaster_url, job_id))
-        txt = None
+    async def _fetch_last_response(self, job_id, parser=None):
+        path = "/pollresult/%s" % job_id
+        headers = dict()
+        timeout = self.read_timeout
+        if self.poll_wait:
+            headers["x-qtc-wait"] = "%d" % self.poll_wait
+            timeout = self.poll_wait + ToasterHttpInterface.POLL_READ_SLACK
+        failures = 0
         while True:
+            _check_deadline(self.deadline, job_id)
+            started = time.monotonic()
+            request_timeout = _time_left(self.deadline, job_id, timeout)
             try:
-                response = request.urlopen(req, timeout=timeout)
-            except urllib.error.HTTPError as e:
+                body = await self._request(
+                    "GET", path, None, headers, request_timeout, parser
+                )
+            except ToasterPending:
+                waited = time.monotonic() - started
+                if self.poll_wait > 0 and waited >= self.poll_wait / 2:
+                    failures = 0
+                    continue
+                failures += 1
+                await self._sleep(job_id, backoff_delay(failures))
+            except ToasterHttpError as e:
                 raise RuntimeError("Error received from API(1): %s" % str(e))
-            except (socket.timeout, urllib.error.URLError) as e:
-                logger.debug("Exception raised: %s", e)
-                time.sleep(0.2)
-                continue
+            except (
+                OSError, asyncio.IncompleteReadError, asyncio.TimeoutError
+            ) as e:
+                failures += 1
+                logger.debug("Exception raised: %r", e)
+                await self._sleep(job_id, backoff_delay(failures))
             else:
-                txt = response.read().decode("utf8")
+                return body if parser else body.decode("utf8")
+
+    async def _sleep(self, job_id, delay):
+        await asyncio.sleep(_time_left(self.deadline, job_id, delay))
+
+    async def _request(
+        self, method, path, body, headers, timeout, parser=None
+    ):
+        """
+        Sends request over new connection and returns response body (or
+        parsed response). timeout (None: unlimited) applies to the whole
+        exchange, connecting is limited by connect_timeout.
+        """
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self._host, self._port),
+                self.connect_timeout,
+            )
+        except asyncio.TimeoutError as e:
+            # not a slow simulation, toaster is unreachable
+            raise ConnectionError(
+                "Connecting to %s timed out" % self.toaster_url
+            ) from e
+        try:
+            return await asyncio.wait_for(
+                self._exchange(
+                    reader, writer, method, path, body, headers, parser
+                ),
+                timeout,
+            )
+        finally:
+            writer.close()
+
+    async def _exchange(
+        self, reader, writer, method, path, body, headers, parser
+    ):
+        """Writes request and reads response, see _request"""
+        body = body or b""
+        lines = [
+            "%s %s HTTP/1.1" % (method, path),
+            "Host: %s:%d" % (self._host, self._port),
+            "Connection: close",
+            "Content-Length: %d" % len(body),
+        ]
+        lines += ["%s: %s" % item for item in headers.items()]
+        head = "\r\n".join(lines) + "\r\n\r\n"
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+        status_line = (await reader.readline()).decode("latin-1")
+        parts = status_line.split(" ", 2)
+        if len(parts) < 2:
+            raise ConnectionResetError(
+                "Invalid response from toaster: %r" % status_line
+            )
+        status = int(parts[1])
+        reason = parts[2].strip() if len(parts) > 2 else ""
+
+        response_headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if status >= 400:
+            raise ToasterHttpError(status, reason)
+        if status in PENDING_STATUSES:
+            raise ToasterPending(status)
+
+        if parser is None:
+            chunks = []
+            consume = chunks.append
+        else:
+            parser.reset()
+            consume = parser.feed
+        encoding = response_headers.get("transfer-encoding", "")
+        if encoding.lower() == "chunked":
+            await self._read_chunked(reader, consume)
+        elif "content-length" in response_headers:
+            length = int(response_headers["content-length"])
+            await self._read_length(reader, length, consume)
+        else:
+            await self._read_length(reader, None, consume)
+
+        if parser is None:
+            return b"".join(chunks)
+        return parser.close()
+
+    @staticmethod
+    async def _read_length(reader, length, consume):
+        """Reads length bytes (until EOF if None) in chunks"""
+        while length is None or length > 0:
+            size = ToasterResponse.CHUNK_SIZE
+            if length is not None:
+                size = min(size, length)
+            chunk = await reader.read(size)
+            if not chunk:
+                if length is not None:
+                    raise asyncio.IncompleteReadError(b"", length)
                 break
+            consume(chunk)
+            if length is not None:
+                length -= len(chunk)
 
-        return txt
+    @staticmethod
+    async def _read_chunked(reader, consume):
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b";")[0].strip(), 16)
+            if size == 0:
+                # skip trailers
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            await ToasterAsyncHttpInterface._read_length(reader, size, consume)
+            await reader.readexactly(2)
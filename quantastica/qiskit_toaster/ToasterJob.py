@@ -12,35 +12,273 @@
 # that they have been altered from the originals.
 
 from concurrent import futures
+import functools
 import logging
 import json
 import time
-import copy
 import os
+import queue
 import sys
+import tempfile
+import threading
+import uuid
+import weakref
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
 
-from quantastica.qconvert import qobj_to_toaster
 from quantastica.qiskit_toaster import (
+    ToasterBalancer,
     ToasterHttpInterface,
     ToasterCliInterface,
+    ToasterCache,
+    ToasterCounts,
+    ToasterResponse,
+    ToasterResult,
+    ToasterSampling,
+    ToasterScheduler,
 )
 
 from qiskit.providers import JobV1, JobStatus, JobError
-from qiskit.result import Result
 
 logger = logging.getLogger(__name__)
 
 
-# one of toaster_url or toaster_path MUST be defined
-# if both are defined toaster_path takes precedence
-def _run_with_qtoaster_static(
-    qobj_dict,
-    get_states,
-    job_id,
-    optimization_level=None,
-    toaster_url=None,
-    toaster_path=None,
+# smaller statevectors are pickled
+_SHM_MIN_BYTES = 1024 * 1024
+
+# qtoaster_version last reported by each toaster (url or CLI path)
+_toaster_versions = dict()
+
+# toasters (url or CLI path) which rejected binary statevector format
+_npy_rejected = set()
+
+# errors of toasters which may not understand the statevector format
+_REJECTED = (
+    ToasterHttpInterface.ToasterRequestError,
+    ToasterCliInterface.ToasterCliError,
+)
+
+
+def _statevector_format(toaster, get_states):
+    """
+    Binary statevector is requested only from toasters which already
+    reported version supporting it, older ones keep getting JSON
+    """
+    # npy response (x-qtc-statevector-format header, --statevector-format
+    # flag) is assumed protocol until toaster implements it, toasters
+    # rejecting it get JSON again (see _ExperimentRun.rejected)
+    if toaster in _npy_rejected:
+        return None
+    version = _toaster_versions.get(toaster)
+    if get_states and version and ToasterJob._check_qtoaster_version(
+        version, ToasterJob._MINQTOASTERVERSION_NPY
+    ):
+        return ToasterResponse.STATEVECTOR_FORMAT_NPY
+    return None
+
+
+def _remember_toaster_version(toaster, result):
+    if result["success"]:
+        _toaster_versions[toaster] = result["toaster_version"]
+
+
+def _response_parser(
+    qobj_dict, get_states, job_id, statevector_dir=None, allocator=None
+):
+    """
+    Returns parser which decodes statevector while the response is being
+    received, or None when only (small) counts are expected.
+    With statevector_dir the statevector is spooled to a file there,
+    otherwise it is decoded into array of allocator (if given).
+    """
+    if not get_states:
+        return None
+    header = qobj_dict["experiments"][0].get("header", {})
+    spool_path = None
+    if statevector_dir:
+        os.makedirs(statevector_dir, exist_ok=True)
+        spool_path = os.path.join(statevector_dir, "%s.npy" % job_id)
+    return ToasterResponse.ToasterResponseParser(
+        header.get("n_qubits"), spool_path=spool_path, allocator=allocator
+    )
+
+
+class _SharedMemoryAllocator:
+    """
+    Allocates arrays of response parser in worker process: large ones in
+    shared memory blocks, so statevector is decoded straight into memory
+    which the parent process maps (see _export_statevectors). Each block
+    is closed in this process once its array is no longer used.
+    """
+
+    def __init__(self):
+        # (block, array) of each allocated block
+        self.blocks = []
+
+    def __call__(self, shape, dtype=np.complex128):
+        dtype = np.dtype(dtype)
+        if int(np.prod(shape)) * dtype.itemsize < _SHM_MIN_BYTES:
+            return np.empty(shape, dtype=dtype)
+        shm = shared_memory.SharedMemory(
+            create=True, size=int(np.prod(shape)) * dtype.itemsize
+        )
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        # block must stay mapped while the array is used
+        weakref.finalize(array, shm.close)
+        self.blocks.append((shm, array))
+        return array
+
+    def block_of(self, array):
+        """Returns shared memory block holding array, or None"""
+        for shm, block_array in self.blocks:
+            if np.may_share_memory(array, block_array):
+                return shm
+        return None
+
+    def release(self, keep=()):
+        """Unlinks blocks except those named in keep and forgets all"""
+        for shm, array in self.blocks:
+            if shm.name not in keep:
+                shm.unlink()
+        self.blocks = []
+
+
+def _statevector_allocator():
+    """
+    Returns _SharedMemoryAllocator in worker process, or None in the main
+    process where statevectors are not sent anywhere
+    """
+    if multiprocessing.parent_process() is None:
+        return None
+    return _SharedMemoryAllocator()
+
+
+def _export_statevectors(results, allocator=None):
+    """
+    Called in worker process: replaces large statevectors of experiment
+    result dicts with handles (name, shape, dtype) of shared memory blocks
+    holding them. Avoids pickling statevectors on the way back to the
+    parent process. Statevectors decoded by allocator are there already,
+    others are copied. Blocks of allocator not holding any statevector
+    are released.
+    """
+    if allocator is None:
+        allocator = _statevector_allocator()
+        if allocator is None:
+            return results
+    exported = set()
+    try:
+        for result in results:
+            data = result["data"]
+            statevector = data.get("statevector")
+            if not isinstance(statevector, np.ndarray) or isinstance(
+                statevector, np.memmap
+            ):
+                continue
+            shm = allocator.block_of(statevector)
+            if shm is None:
+                if statevector.nbytes < _SHM_MIN_BYTES:
+                    continue
+                # e.g. statevector was shorter than expected
+                copy = allocator(statevector.shape, statevector.dtype)
+                copy[...] = statevector
+                shm = allocator.block_of(copy)
+            exported.add(shm.name)
+            del data["statevector"]
+            data["statevector_shm"] = {
+                "name": shm.name,
+                "shape": statevector.shape,
+                "dtype": statevector.dtype.str,
+            }
+    finally:
+        # exported blocks are owned (and unlinked) by the parent
+        allocator.release(keep=exported)
+    return results
+
+
+def _attach_statevectors(results):
+    """
+    Replaces statevector handles in experiment result dicts with arrays:
+    spooled files become read-only memory maps, shared memory blocks are
+    mapped without copying and unlinked right away (memory is released
+    when the array is no longer used).
+    """
+    for result in results:
+        data = result["data"]
+        path = data.pop("statevector_file", None)
+        if path is not None:
+            data["statevector"] = np.load(path, mmap_mode="r")
+        handle = data.pop("statevector_shm", None)
+        if handle is not None:
+            shm = shared_memory.SharedMemory(name=handle["name"])
+            try:
+                statevector = np.ndarray(
+                    tuple(handle["shape"]),
+                    dtype=np.dtype(handle["dtype"]),
+                    buffer=shm.buf,
+                )
+            except BaseException:
+                shm.close()
+                raise
+            finally:
+                shm.unlink()
+            weakref.finalize(statevector, shm.close)
+            data["statevector"] = statevector
+    return results
+
+
+def _track_statevectors(tracked, future):
+    """
+    Done callback: remembers experiment results of future which hold
+    shared memory blocks, so they can be released if the job is dropped
+    before the blocks are attached
+    """
+    if future.cancelled() or future.exception() is not None:
+        return
+    tracked.extend(
+        result for result in future.result()
+        if "statevector_shm" in result["data"]
+    )
+
+
+def _unlink_statevectors(results):
+    """Releases shared memory blocks of results not attached yet"""
+    for result in results:
+        handle = result["data"].pop("statevector_shm", None)
+        if handle is None:
+            continue
+        try:
+            shm = shared_memory.SharedMemory(name=handle["name"])
+        except FileNotFoundError:
+            continue
+        shm.close()
+        shm.unlink()
+
+
+def _cancel_marker(job_id):
+    """
+    Path of file which marks job as cancelled. Workers (possibly in other
+    processes) check for it while experiments are running.
+    Each call returns a new path (process id and random suffix), so a
+    marker left behind by an interrupted run doesn't cancel other jobs
+    with the same job_id.
+    """
+    return os.path.join(
+        tempfile.gettempdir(),
+        "qiskit-toaster-%s-%d-%s.cancelled"
+        % (job_id, os.getpid(), uuid.uuid4().hex),
+    )
+
+
+def _prepare_toaster_request(
+    qobj_dict, get_states, job_id, cache_options=None
 ):
+    """
+    Converts single-experiment qobj dict into toaster circuit and
+    collects the simulation params which are sent along with it.
+    """
     SEED_SIMULATOR_KEY = "seed_simulator"
     if get_states:
         shots = 1
@@ -55,41 +293,54 @@ def _run_with_qtoaster_static(
     if SEED_SIMULATOR_KEY in qobj_dict["config"]:
         seed = qobj_dict["config"][SEED_SIMULATOR_KEY]
 
-    converted = qobj_to_toaster(qobj_dict, {"all_experiments": False})
+    # experiments bound from ToasterTemplate are already converted
+    converted = qobj_dict["experiments"][0].get("toaster_circuit")
+    if converted is None:
+        cache = ToasterCache.get_conversion_cache(**(cache_options or {}))
+        converted = cache.convert(qobj_dict)
 
     dump_dir = os.getenv("TOASTER_DUMP_DIR", None)
     if dump_dir is not None:
         path_req = "%s/%s.request.json" % (dump_dir, job_id)
         with open(path_req, "w") as f:
             f.write(converted)
-    if toaster_path:
-        toaster = ToasterCliInterface.ToasterCliInterface(toaster_path)
-    else:
-        toaster = ToasterHttpInterface.ToasterHttpInterface(toaster_url)
-
-    toasterjson = toaster.execute(
-        converted.encode("utf-8"),
-        job_id=job_id,
-        returns=returns,
-        seed=seed,
-        optimization=optimization_level,
-        shots=shots,
-    )
+
+    return {
+        "converted": converted,
+        "shots": shots,
+        "returns": returns,
+        "seed": seed,
+    }
+
+
+def _build_experiment_result(
+    qobj_dict, toasterjson, job_id, shots, seed, compact_counts=False
+):
+    """
+    Parses toaster response into experiment result dict
+    (as expected by qiskit's Result.from_dict). toasterjson is either
+    response text or response already parsed by ToasterResponseParser.
+    With compact_counts, counts are kept as (outcomes, frequencies) arrays
+    under "counts_arrays" key, see _expand_counts.
+    """
+    dump_dir = os.getenv("TOASTER_DUMP_DIR", None)
     if dump_dir is not None:
         path_res = "%s/%s.response.json" % (dump_dir, job_id)
         with open(path_res, "w") as f:
-            f.write(str(toasterjson))
+            if isinstance(toasterjson, dict):
+                f.write(ToasterResponse.to_json(toasterjson))
+            else:
+                f.write(str(toasterjson))
 
     resultraw = None
-    if toasterjson:
+    if isinstance(toasterjson, dict):
+        resultraw = toasterjson
+    elif toasterjson:
         resultraw = json.loads(toasterjson)
 
     success = resultraw is not None
     # print(success)
     data = dict()
-    exp_dict = qobj_dict["experiments"][0]
-    exp_header = exp_dict["header"]
-    expname = exp_header["name"]
     time_taken = 0
     rawversion = "0.0.0"
     if success:
@@ -102,13 +353,30 @@ def _run_with_qtoaster_static(
                 "Unsupported qtoaster_version, got '%s' - minimum expected is '%s'.\n\rPlease update your q-toaster to latest version"
                 % (rawversion, ToasterJob._MINQTOASTERVERSION)
             )
-        counts = ToasterJob._convert_counts(resultraw["counts"])
+        counts = ToasterCounts.counts_to_arrays(resultraw["counts"])
+        if compact_counts:
+            data["counts_arrays"] = counts
+        else:
+            data["counts"] = ToasterCounts.arrays_to_counts(*counts)
         statevector = resultraw.get("statevector")
-        data["counts"] = counts
-        if statevector is not None and len(statevector) > 0:
+        if isinstance(statevector, np.memmap):
+            # spooled statevector is passed back by file name, so it is
+            # not copied when result is sent from worker process
+            data["statevector_file"] = statevector.filename
+        elif statevector is not None and len(statevector) > 0:
             data["statevector"] = statevector
         time_taken = resultraw["time_taken"]
 
+    return _experiment_result(
+        qobj_dict, success, shots, data, time_taken, seed, rawversion
+    )
+
+
+def _experiment_result(
+    qobj_dict, success, shots, data, time_taken, seed, rawversion
+):
+    """Returns experiment result dict of single-experiment qobj dict"""
+    exp_header = qobj_dict["experiments"][0]["header"]
     result = {
         "success": success,
         "meas_level": 2,
@@ -117,22 +385,514 @@ def _run_with_qtoaster_static(
         "header": exp_header,
         "status": "DONE",
         "time_taken": time_taken,
-        "name": expname,
+        "name": exp_header["name"],
         "seed_simulator": seed,
         "toaster_version": rawversion,
     }
+    if "shot_split" in qobj_dict:
+        result["shot_split"] = qobj_dict["shot_split"]
+    return result
+
+
+def _optimization_level(backend_options):
+    optimization_level = None
+    if backend_options:
+        optimization_level = backend_options.get("toaster_optimization", None)
+    return optimization_level
+
+
+def _toaster_path(use_cli):
+    toaster_path = None
+    if int(use_cli) != 0:
+        toaster_path = "qubit-toaster"
+    return toaster_path
+
+
+def _split_experiments(qobj_dict, job_id):
+    """
+    Yields (experiment_job_id, single_experiment_qobj_dict) for each
+    experiment in qobj dict.
+    Single experiment dicts are shallow: config and header are shared with
+    qobj_dict (and between each other) and must not be modified.
+    """
+    shared = {
+        key: value for key, value in qobj_dict.items() if key != "experiments"
+    }
+    exp_index = 0
+    for exp in qobj_dict["experiments"]:
+        exp_index += 1
+        exp_job_id = "Exp_%d_%s" % (exp_index, job_id)
+        single_exp = dict(shared)
+        single_exp["experiments"] = [exp]
+        yield exp_job_id, single_exp
+
+
+def _derive_seed(seed, index):
+    """
+    Returns seed of sub-run number index of experiment seeded with seed,
+    or random seed if the experiment is not seeded
+    """
+    if seed:
+        sequence = np.random.SeedSequence([seed, index])
+    else:
+        sequence = np.random.SeedSequence()
+    # toaster treats seed 0 as "not seeded"
+    return int(sequence.generate_state(1)[0]) or 1
+
+
+def _split_shots(items, shots_per_run):
+    """
+    Splits (experiment_job_id, single_experiment_qobj_dict) items with
+    more than shots_per_run shots into sub-runs with derived seeds, see
+    _ShotSplitMerger for putting their results together
+    """
+    for exp_job_id, single_exp in items:
+        config = single_exp["config"]
+        shots = config.get("shots", 1)
+        if not shots_per_run or shots <= shots_per_run:
+            yield exp_job_id, single_exp
+            continue
+        count = -(-shots // shots_per_run)
+        seed = config.get("seed_simulator") or 0
+        for index in range(count):
+            sub_run = dict(single_exp)
+            sub_run["config"] = dict(
+                config,
+                shots=shots * (index + 1) // count - shots * index // count,
+                seed_simulator=_derive_seed(seed, index),
+            )
+            sub_run["shot_split"] = {
+                "experiment": exp_job_id,
+                "index": index,
+                "count": count,
+                "seed": seed,
+            }
+            yield "%s_shots%d" % (exp_job_id, index), sub_run
+
+
+class _ShotSplitMerger:
+    """
+    Collects experiment results of shot sub-runs (which may arrive from
+    different workers in any order) and merges them once all sub-runs of
+    an experiment are in
+    """
+
+    def __init__(self):
+        self._parts = dict()
+        self._lock = threading.Lock()
+
+    def add(self, results):
+        """Returns results which are complete, sub-runs merged"""
+        complete = []
+        for result in results:
+            split = result.get("shot_split")
+            if split is None:
+                complete.append(result)
+                continue
+            with self._lock:
+                parts = self._parts.setdefault(split["experiment"], [])
+                parts.append(result)
+                if len(parts) < split["count"]:
+                    continue
+                del self._parts[split["experiment"]]
+            complete.append(_ShotSplitMerger._merge(parts))
+        return complete
+
+    @staticmethod
+    def _merge(parts):
+        parts.sort(key=lambda r: r["shot_split"]["index"])
+        merged = dict(parts[0])
+        split = merged.pop("shot_split")
+        data = dict(merged["data"])
+        counts = ToasterCounts.merge_counts_arrays(
+            [_counts_arrays(p) for p in parts]
+        )
+        if "counts_arrays" in data:
+            data["counts_arrays"] = counts
+        else:
+            data["counts"] = ToasterCounts.arrays_to_counts(*counts)
+        merged["data"] = data
+        merged["success"] = all(p["success"] for p in parts)
+        merged["shots"] = sum(p["shots"] for p in parts)
+        merged["time_taken"] = sum(p["time_taken"] for p in parts)
+        merged["seed_simulator"] = split["seed"]
+        return merged
+
+
+def _batch_experiments(qobj_dict, job_id, batch_size, shots_per_run=None):
+    """
+    Groups output of _split_experiments (experiments with more than
+    shots_per_run shots split into sub-runs) into lists of at most
+    batch_size items
+    """
+    batch = []
+    items = _split_experiments(qobj_dict, job_id)
+    for item in _split_shots(items, shots_per_run):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# one of toaster_url, toaster_urls or toaster_path MUST be defined
+# toaster_path takes precedence, then toaster_urls (endpoint picked by
+# ToasterScheduler followed by the others it fails over to)
+def _run_with_qtoaster_static(
+    qobj_dict,
+    get_states,
+    job_id,
+    optimization_level=None,
+    toaster_url=None,
+    toaster_path=None,
+    http_options=None,
+    cache_options=None,
+    result_cache_options=None,
+    statevector_dir=None,
+    compact_counts=False,
+    is_cancelled=None,
+    toaster_urls=None,
+    sampling_options=None,
+    allocator=None,
+):
+    if sampling_options is not None and not get_states:
+        measurements = ToasterSampling.terminal_measurements(
+            qobj_dict["experiments"][0]
+        )
+        if measurements is not None:
+            return _sample_locally(
+                qobj_dict,
+                job_id,
+                measurements,
+                sampling_options,
+                compact_counts,
+                optimization_level=optimization_level,
+                toaster_url=toaster_url,
+                toaster_path=toaster_path,
+                http_options=http_options,
+                cache_options=cache_options,
+                is_cancelled=is_cancelled,
+                toaster_urls=toaster_urls,
+                allocator=allocator,
+            )
+
+    run = _ExperimentRun(
+        qobj_dict,
+        get_states,
+        job_id,
+        optimization_level=optimization_level,
+        cache_options=cache_options,
+        result_cache_options=result_cache_options,
+        statevector_dir=statevector_dir,
+        compact_counts=compact_counts,
+        allocator=allocator,
+    )
+    result = run.cached_result()
+    if result is not None:
+        return result
+
+    def execute(toaster_key, toaster):
+        """Returns (toaster_key, response) of toaster"""
+        try:
+            response = run.execute(
+                toaster_key, toaster, is_cancelled=is_cancelled
+            )
+        except _REJECTED as e:
+            if not run.rejected(toaster_key, e):
+                raise
+            response = run.execute(
+                toaster_key, toaster, is_cancelled=is_cancelled
+            )
+        return toaster_key, response
+
+    if toaster_path:
+        toaster_key, toasterjson = execute(
+            toaster_path, ToasterCliInterface.ToasterCliInterface(toaster_path)
+        )
+    elif toaster_urls:
+        # endpoints fail over to each other, so each one gives up quickly
+        endpoint_options = dict(http_options or {}, max_retries=0)
+        toaster_key, toasterjson = ToasterBalancer.failover(
+            toaster_urls,
+            lambda url: execute(
+                url,
+                ToasterHttpInterface.ToasterHttpInterface(
+                    url, **endpoint_options
+                ),
+            ),
+            max_retries=(http_options or {}).get("max_retries"),
+        )
+    else:
+        toaster_key, toasterjson = execute(
+            toaster_url,
+            ToasterHttpInterface.ToasterHttpInterface(
+                toaster_url, **(http_options or {})
+            ),
+        )
+    result = run.result(toaster_key, toasterjson)
+    if toaster_urls:
+        # tells the scheduler which endpoint served the experiment
+        result["toaster_url"] = toaster_key
     return result
 
 
+class _ExperimentRun:
+    """
+    Toaster run of single-experiment qobj dict, shared by worker pool and
+    asyncio jobs: prepares toaster request, looks its response up in
+    result cache, and builds (and caches) experiment result from
+    toaster's response.
+    """
+
+    def __init__(
+        self,
+        qobj_dict,
+        get_states,
+        job_id,
+        optimization_level=None,
+        cache_options=None,
+        result_cache_options=None,
+        statevector_dir=None,
+        compact_counts=False,
+        allocator=None,
+    ):
+        self.qobj_dict = qobj_dict
+        self.get_states = get_states
+        self.job_id = job_id
+        self.optimization_level = optimization_level
+        self.statevector_dir = statevector_dir
+        self.compact_counts = compact_counts
+        self.allocator = allocator
+        # format requested by the last execute()
+        self.statevector_format = None
+        self.request = _prepare_toaster_request(
+            qobj_dict, get_states, job_id, cache_options=cache_options
+        )
+        # seeded runs are deterministic, their responses can be reused
+        # (sub-runs of unseeded experiments get random seeds, see
+        # _split_shots)
+        self.result_cache = None
+        self.result_key = None
+        split = qobj_dict.get("shot_split")
+        if self.request["seed"] and (split is None or split["seed"]):
+            self.result_cache = ToasterCache.get_result_cache(
+                **(result_cache_options or {})
+            )
+        if self.result_cache is not None:
+            self.result_key = ToasterCache.ToasterResultCache.key(
+                self.request["converted"],
+                self.request["shots"],
+                self.request["seed"],
+                self.request["returns"],
+                optimization_level,
+            )
+
+    def cached_result(self):
+        """Returns experiment result of cached response, or None"""
+        if self.result_cache is None:
+            return None
+        toasterjson = self.result_cache.get(self.result_key)
+        if toasterjson is None:
+            return None
+        logger.debug("Result cache hit for %s", self.job_id)
+        return self._build(toasterjson)
+
+    def execute(self, toaster_key, toaster, **kwargs):
+        """
+        Sends the request to toaster (ToasterHttpInterface,
+        ToasterCliInterface or their asyncio counterparts, whose
+        awaitable is returned)
+        """
+        self.statevector_format = _statevector_format(
+            toaster_key, self.get_states
+        )
+        return toaster.execute(
+            self.request["converted"].encode("utf-8"),
+            job_id=self.job_id,
+            returns=self.request["returns"],
+            seed=self.request["seed"],
+            optimization=self.optimization_level,
+            shots=self.request["shots"],
+            parser=_response_parser(
+                self.qobj_dict,
+                self.get_states,
+                self.job_id,
+                self.statevector_dir,
+                self.allocator,
+            ),
+            statevector_format=self.statevector_format,
+            **kwargs
+        )
+
+    def rejected(self, toaster_key, error):
+        """
+        Returns True if toaster's error (one of _REJECTED) can be caused
+        by requested statevector format. Toaster gets JSON from now on,
+        so the request should be sent once again.
+        """
+        if not self.statevector_format:
+            return False
+        logger.warning(
+            "Toaster %s rejected %s statevector format (%s), "
+            "falling back to JSON",
+            toaster_key, self.statevector_format, error,
+        )
+        _npy_rejected.add(toaster_key)
+        return True
+
+    def result(self, toaster_key, toasterjson):
+        """Returns experiment result of toaster's response"""
+        result = self._build(toasterjson)
+        _remember_toaster_version(toaster_key, result)
+        if self.result_cache is not None and _cacheable(result):
+            if isinstance(toasterjson, dict):
+                toasterjson = ToasterResponse.to_json(toasterjson)
+            self.result_cache.put(self.result_key, toasterjson)
+        return result
+
+    def _build(self, toasterjson):
+        return _build_experiment_result(
+            self.qobj_dict,
+            toasterjson,
+            self.job_id,
+            self.request["shots"],
+            self.request["seed"],
+            self.compact_counts,
+        )
+
+
+def _sample_locally(
+    qobj_dict, job_id, measurements, sampling_options, compact_counts, **kwargs
+):
+    """
+    Samples counts of experiment whose measurements are all terminal from
+    its statevector. Statevector is simulated once (without measurements)
+    and outcome probabilities are cached, so runs of the same circuit with
+    other shots or seeds don't simulate it again.
+    """
+    stripped = ToasterSampling.without_measurements(qobj_dict)
+    cache = ToasterSampling.get_sampling_cache(**sampling_options)
+    key = ToasterSampling.ToasterSamplingCache.key(
+        stripped, measurements, kwargs.get("optimization_level")
+    )
+    time_taken = 0
+    toaster_url = None
+    entry = cache.get(key)
+    if entry is None:
+        state_result = _run_with_qtoaster_static(
+            stripped, True, job_id, **kwargs
+        )
+        if not state_result["success"]:
+            return state_result
+        outcomes, probabilities = ToasterSampling.marginal_probabilities(
+            state_result["data"]["statevector"], measurements
+        )
+        entry = (outcomes, probabilities, state_result["toaster_version"])
+        cache.put(key, entry)
+        time_taken = state_result["time_taken"]
+        toaster_url = state_result.get("toaster_url")
+    else:
+        logger.debug("Sampling cache hit for %s", job_id)
+
+    outcomes, probabilities, rawversion = entry
+    shots = qobj_dict["config"]["shots"]
+    seed = qobj_dict["config"].get("seed_simulator", 0)
+    counts = ToasterSampling.sample_counts(
+        outcomes, probabilities, shots, seed
+    )
+    if compact_counts:
+        data = {"counts_arrays": counts}
+    else:
+        data = {"counts": ToasterCounts.arrays_to_counts(*counts)}
+    result = _experiment_result(
+        qobj_dict, True, shots, data, time_taken, seed, rawversion
+    )
+    if toaster_url is not None:
+        result["toaster_url"] = toaster_url
+    return result
+
+
+def _counts_arrays(result):
+    """Returns (outcomes, frequencies) of experiment result dict"""
+    data = result["data"]
+    if "counts_arrays" in data:
+        return data["counts_arrays"]
+    counts = data.get("counts", {})
+    outcomes = np.array([int(key, 16) for key in counts], dtype=object)
+    if len(outcomes) and max(outcomes) < 2 ** 64:
+        outcomes = outcomes.astype(np.uint64)
+    frequencies = np.fromiter(counts.values(), dtype=np.int64)
+    return outcomes, frequencies
+
+
+def _cacheable(result):
+    # spooled statevectors are too big to be cached
+    return result["success"] and "statevector_file" not in result["data"]
+
+
+def _run_batch_with_qtoaster_static(
+    batch, get_states, cancel_marker=None, **kwargs
+):
+    """
+    Runs batch of (experiment_job_id, single_experiment_qobj_dict) items
+    one after another in the same worker, so dispatch and transport setup
+    are paid once per batch. Returns list of experiment results.
+    Raises concurrent.futures.CancelledError once cancel_marker file
+    exists.
+    """
+    is_cancelled = None
+    if cancel_marker:
+        is_cancelled = functools.partial(os.path.exists, cancel_marker)
+    # statevectors are decoded into shared memory in worker processes
+    allocator = _statevector_allocator()
+    results = []
+    try:
+        for exp_job_id, single_exp in batch:
+            if is_cancelled is not None and is_cancelled():
+                raise futures.CancelledError(
+                    "Job %s was cancelled" % exp_job_id
+                )
+            try:
+                result = _run_with_qtoaster_static(
+                    single_exp,
+                    get_states,
+                    exp_job_id,
+                    is_cancelled=is_cancelled,
+                    allocator=allocator,
+                    **kwargs
+                )
+            except Exception as e:
+                # e.g. aborted request is reported as error by toaster
+                if is_cancelled is not None and is_cancelled():
+                    raise futures.CancelledError(
+                        "Job %s was cancelled" % exp_job_id
+                    ) from e
+                raise
+            results.append(result)
+    except BaseException:
+        if allocator is not None:
+            allocator.release()
+        raise
+    return _export_statevectors(results, allocator)
+
+
 class ToasterJob(JobV1):
     DEFAULT_TOASTER_HOST = "127.0.0.1"
     DEFAULT_TOASTER_PORT = 8001
+    DEFAULT_MAX_WORKERS = 2
+    EXECUTOR_TYPES = ["thread", "process"]
+    EXECUTOR_LIFETIMES = ["shared", "backend", "job"]
     _MINQTOASTERVERSION = "0.9.9"
+    # first version accepting binary (.npy) statevector format
+    _MINQTOASTERVERSION_NPY = "1.0.0"
+    # experiments with more shots are split into several toaster runs
+    DEFAULT_SHOTS_PER_RUN = 65536
 
-    if sys.platform in ["darwin", "win32"]:
-        _executor = futures.ThreadPoolExecutor(max_workers=2)
-    else:
-        _executor = futures.ProcessPoolExecutor(max_workers=2)
+    # executors shared by all backends with "shared" lifetime,
+    # keyed by (executor_type, max_workers) and created on first use
+    _shared_executors = dict()
+    _shared_executors_lock = threading.Lock()
     _run_time = 0
 
     def __init__(
@@ -145,93 +905,367 @@ class ToasterJob(JobV1):
         getstates=False,
         backend_options=None,
         use_cli=False,
+        executor=None,
+        owns_executor=False,
+        http_options=None,
+        batch_size=None,
+        cache_options=None,
+        result_cache_options=None,
+        memory_budget=None,
+        priority=0,
+        statevector_dir=None,
+        compact_counts=False,
+        callback=None,
+        toaster_endpoints=None,
+        balancer_options=None,
+        shots_per_run=None,
+        sampling_options=None,
     ):
         super().__init__(backend, job_id)
         self._toaster_url = "http://%s:%d" % (toaster_host, int(toaster_port))
+        self._toaster_target = "%s:%d" % (toaster_host, int(toaster_port))
+        # several endpoints are balanced, toaster_host/port are not used
+        self._toaster_urls = None
+        if toaster_endpoints:
+            urls = [ToasterBalancer.endpoint_url(e) for e in toaster_endpoints]
+            self._toaster_url = urls[0]
+            self._toaster_target = ",".join(
+                url.split("://", 1)[1] for url in urls
+            )
+            if len(urls) > 1:
+                self._toaster_urls = urls
+        self._balancer_options = balancer_options
         self._result = None
-        self._qobj_dict = qobj.to_dict()
+        # template assembly (parameter_binds) produces qobj dict directly
+        if isinstance(qobj, dict):
+            self._qobj_dict = qobj
+        else:
+            self._qobj_dict = qobj.to_dict()
         self._futures = []
+        # experiment job ids of each batch, in self._futures order
+        self._batch_job_ids = []
+        self._scheduler = None
+        self._cancelled = False
+        self._cancel_marker = _cancel_marker(job_id)
         self._getstates = getstates
         self._backend_options = backend_options
         self._use_cli = use_cli
+        self._executor = executor or ToasterJob.get_shared_executor()
+        self._owns_executor = owns_executor
+        self._http_options = http_options
+        self._batch_size = batch_size or 1
+        self._cache_options = cache_options
+        self._result_cache_options = result_cache_options
+        self._memory_budget = memory_budget
+        self._priority = priority
+        self._statevector_dir = statevector_dir
+        self._compact_counts = compact_counts
+        self._callback = callback
+        self._callback_merger = _ShotSplitMerger()
+        # finished futures waiting for callback thread
+        self._callback_queue = queue.Queue()
+        if shots_per_run is None:
+            shots_per_run = ToasterJob.DEFAULT_SHOTS_PER_RUN
+        self._shots_per_run = shots_per_run
+        # None, or options of ToasterSampling.get_sampling_cache
+        self._sampling_options = sampling_options
+        # batches whose results were not passed to callback yet
+        self._callbacks_pending = 0
+        self._callbacks_condition = threading.Condition()
+        # results with shared memory blocks, released when job is dropped
+        # (the finalizer must not reference the job itself)
+        self._shm_results = []
+        weakref.finalize(self, _unlink_statevectors, self._shm_results)
+
+    @staticmethod
+    def default_executor_type():
+        if sys.platform in ["darwin", "win32"]:
+            return "thread"
+        return "process"
+
+    @staticmethod
+    def create_executor(executor_type=None, max_workers=None):
+        executor_type = executor_type or ToasterJob.default_executor_type()
+        max_workers = max_workers or ToasterJob.DEFAULT_MAX_WORKERS
+        if executor_type == "thread":
+            return futures.ThreadPoolExecutor(max_workers=max_workers)
+        elif executor_type == "process":
+            # workers share tracker of this process, so shared memory
+            # blocks they create are released when this process unlinks
+            # them (and not when a worker exits)
+            resource_tracker.ensure_running()
+            return futures.ProcessPoolExecutor(max_workers=max_workers)
+        raise ValueError(
+            "Unknown executor_type '%s', expected one of: %s"
+            % (executor_type, ", ".join(ToasterJob.EXECUTOR_TYPES))
+        )
+
+    @classmethod
+    def get_shared_executor(cls, executor_type=None, max_workers=None):
+        key = (
+            executor_type or cls.default_executor_type(),
+            max_workers or cls.DEFAULT_MAX_WORKERS,
+        )
+        with cls._shared_executors_lock:
+            executor = cls._shared_executors.get(key)
+            if executor is None:
+                executor = cls.create_executor(*key)
+                cls._shared_executors[key] = executor
+        return executor
+
+    @classmethod
+    def shutdown_shared_executors(cls, wait=True):
+        with cls._shared_executors_lock:
+            executors = list(cls._shared_executors.values())
+            cls._shared_executors.clear()
+        for executor in executors:
+            executor.shutdown(wait=wait)
 
     def submit(self):
         if len(self._futures) > 0:
             raise JobError("We have already submitted the job!")
         self._t_submit = time.time()
+        # job_timeout becomes deadline shared by all experiments of the job
+        http_options = dict(self._http_options or {})
+        job_timeout = http_options.pop("job_timeout", None)
+        if job_timeout is not None:
+            http_options["deadline"] = self._t_submit + job_timeout
+        self._http_options = http_options
 
         logger.debug("submitting...")
-        all_exps = self._qobj_dict
-        exp_index = 0
-        optimization_level = None
-        backend_options = self._backend_options
-        if backend_options:
-            optimization_level = backend_options.get(
-                "toaster_optimization", None
-            )
+        optimization_level = _optimization_level(self._backend_options)
+        toaster_path = _toaster_path(self._use_cli)
+        # experiments are started cheapest first, and only while they
+        # fit into memory of the machine running toaster
+        scheduler = ToasterScheduler.get_scheduler(
+            "cli" if toaster_path else self._toaster_target,
+            self._memory_budget,
+            urls=None if toaster_path else self._toaster_urls,
+            balancer_options=self._balancer_options,
+        )
+        self._scheduler = scheduler
+        cost_model = scheduler.cost_model
 
-        toaster_path = None
-        if int(self._use_cli) != 0:
-            toaster_path = "qubit-toaster"
-
-        for exp in all_exps["experiments"]:
-            exp_index += 1
-            exp_job_id = "Exp_%d_%s" % (exp_index, self._job_id)
-            single_exp = copy.deepcopy(all_exps)
-            single_exp["experiments"] = [exp]
-            self._futures.append(
-                self._executor.submit(
-                    _run_with_qtoaster_static,
-                    single_exp,
-                    self._getstates,
-                    exp_job_id,
-                    optimization_level=optimization_level,
-                    toaster_url=self._toaster_url,
-                    toaster_path=toaster_path,
+        # statevector runs are single shot, sampled runs need no splitting
+        shots_per_run = self._shots_per_run
+        if self._getstates or self._sampling_options is not None:
+            shots_per_run = None
+        for batch in _batch_experiments(
+            self._qobj_dict, self._job_id, self._batch_size, shots_per_run
+        ):
+            memory = max(
+                ToasterScheduler.estimate_memory(single_exp)
+                for _, single_exp in batch
+            )
+            features = [
+                ToasterScheduler.circuit_features(single_exp["experiments"][0])
+                for _, single_exp in batch
+            ]
+            future = scheduler.submit(
+                self._executor,
+                memory,
+                _run_batch_with_qtoaster_static,
+                batch,
+                self._getstates,
+                cost=sum(cost_model.estimate(f) for f in features),
+                priority=self._priority,
+                optimization_level=optimization_level,
+                toaster_url=self._toaster_url,
+                sampling_options=self._sampling_options,
+                toaster_path=toaster_path,
+                http_options=self._http_options,
+                cache_options=self._cache_options,
+                result_cache_options=self._result_cache_options,
+                statevector_dir=self._statevector_dir,
+                compact_counts=self._compact_counts,
+                cancel_marker=self._cancel_marker,
+            )
+            future.add_done_callback(
+                lambda f, features=features: ToasterJob._calibrate(
+                    cost_model, features, f
                 )
             )
+            future.add_done_callback(
+                functools.partial(_track_statevectors, self._shm_results)
+            )
+            if self._callback is not None:
+                with self._callbacks_condition:
+                    self._callbacks_pending += 1
+                future.add_done_callback(self._callback_queue.put)
+            self._futures.append(future)
+            self._batch_job_ids.append([exp_job_id for exp_job_id, _ in batch])
+        if self._callback is not None:
+            threading.Thread(
+                target=self._notify_callback,
+                args=(len(self._futures),),
+                name="toaster-callback-%s" % self._job_id,
+                daemon=True,
+            ).start()
+
+    def _notify_callback(self, count):
+        """
+        Passes experiment results of count finished batches to job's
+        callback. Runs on job's own thread, so slow callback doesn't hold
+        up worker pool threads which complete other experiments.
+        """
+        for i in range(count):
+            future = self._callback_queue.get()
+            try:
+                if not future.cancelled() and future.exception() is None:
+                    results = _attach_statevectors(future.result())
+                    for result in self._callback_merger.add(results):
+                        self._callback(
+                            ToasterResult.decode_experiment(result)
+                        )
+            except Exception:
+                logger.exception("Callback of job %s failed", self._job_id)
+            finally:
+                with self._callbacks_condition:
+                    self._callbacks_pending -= 1
+                    self._callbacks_condition.notify_all()
+
+    @staticmethod
+    def _calibrate(cost_model, features, future):
+        """Feeds time_taken of finished experiments to the cost model"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        for f, result in zip(features, future.result()):
+            if result["success"]:
+                cost_model.observe(f, result["time_taken"])
 
     def wait(self, timeout=None):
+        if self._cancelled:
+            raise JobError("Job %s was cancelled" % self._job_id)
         if self.status() in [JobStatus.RUNNING, JobStatus.QUEUED]:
             futures.wait(self._futures, timeout)
+        # results are complete only after callback has seen all of them
+        if all(f.done() for f in self._futures):
+            with self._callbacks_condition:
+                self._callbacks_condition.wait_for(
+                    lambda: self._callbacks_pending == 0
+                )
         if self._result is None and self.status() is JobStatus.DONE:
             results = []
             for f in self._futures:
-                results.append(f.result())
-            qobj_dict = self._qobj_dict
-            qobjid = qobj_dict["qobj_id"]
-            qobj_header = qobj_dict["header"]
-            rawversion = "1.0.0"
-            if len(results):
-                if "toaster_version" in results[0]:
-                    rawversion = results[0]["toaster_version"]
-
-            self._result = {
-                "success": True,
-                "backend_name": "Toaster",
-                "qobj_id": qobjid,
-                "backend_version": rawversion,
-                "header": qobj_header,
-                "job_id": self._job_id,
-                "results": results,
-                "status": "COMPLETED",
-            }
+                results.extend(f.result())
+            _attach_statevectors(results)
+            results = _ShotSplitMerger().add(results)
+            self._result = ToasterJob._build_result_dict(
+                self._qobj_dict, self._job_id, results
+            )
             ToasterJob._run_time += time.time() - self._t_submit
 
+        if self._owns_executor and all(f.done() for f in self._futures):
+            self._executor.shutdown(wait=False)
+
         if len(self._futures) > 0:
             for f in self._futures:
                 if f.exception():
+                    self._release_statevectors()
                     raise f.exception()
 
+    def _release_statevectors(self):
+        """
+        Releases shared memory of experiments which succeeded, their
+        statevectors won't be used
+        """
+        for f in self._futures:
+            if f.done() and not f.cancelled() and f.exception() is None:
+                _unlink_statevectors(f.result())
+
+    @staticmethod
+    def _build_result_dict(qobj_dict, job_id, results):
+        qobjid = qobj_dict["qobj_id"]
+        qobj_header = qobj_dict["header"]
+        rawversion = "1.0.0"
+        if len(results):
+            if "toaster_version" in results[0]:
+                rawversion = results[0]["toaster_version"]
+
+        return {
+            "success": True,
+            "backend_name": "Toaster",
+            "qobj_id": qobjid,
+            "backend_version": rawversion,
+            "header": qobj_header,
+            "job_id": job_id,
+            "results": results,
+            "status": "COMPLETED",
+        }
+
     def result(self, timeout=None):
         self.wait(timeout)
-        return Result.from_dict(self._result)
+        return ToasterResult.ToasterResult.from_dict(self._result)
+
+    def iter_results(self, timeout=None):
+        """
+        Yields ExperimentResult of each experiment as soon as it is
+        finished, in completion order (use header.name to tell them
+        apart). Raises exception of the first failed experiment batch,
+        and TimeoutError if results are not available within timeout.
+        """
+        merger = _ShotSplitMerger()
+        for future in futures.as_completed(self._futures, timeout):
+            results = _attach_statevectors(future.result())
+            for result in merger.add(results):
+                yield ToasterResult.decode_experiment(result)
+
+    def counts_arrays(self, timeout=None):
+        """
+        Returns list of (outcomes, frequencies) NumPy arrays, one item per
+        experiment. Outcomes are integer values of measured bitstrings.
+        With compact_counts backend option counts are never converted to
+        qiskit's dict format on this path.
+        """
+        self.wait(timeout)
+        return [_counts_arrays(r) for r in self._result["results"]]
 
     def cancel(self):
-        return
-        # return self._future.cancel()
+        """
+        Cancels the job: queued experiments are dropped, running toaster
+        processes are killed (CLI) or stop being polled and toaster is
+        asked to abort them (HTTP). Returns False if the job has already
+        finished.
+        """
+        if self._cancelled:
+            return True
+        if not self._futures or all(f.done() for f in self._futures):
+            return False
+        self._cancelled = True
+        # running workers see the marker and give up
+        open(self._cancel_marker, "w").close()
+        running = []
+        for future, job_ids in zip(self._futures, self._batch_job_ids):
+            if not self._scheduler.cancel(future) and not future.done():
+                running.extend(job_ids)
+        if running and not _toaster_path(self._use_cli):
+            # any of balanced endpoints can be running the experiment
+            for url in self._toaster_urls or [self._toaster_url]:
+                toaster = ToasterHttpInterface.ToasterHttpInterface(
+                    url, **(self._http_options or {})
+                )
+                for exp_job_id in running:
+                    toaster.abort(exp_job_id)
+        self._release_statevectors()
+        for future in self._futures:
+            future.add_done_callback(self._cleanup_cancelled)
+        return True
+
+    def _cleanup_cancelled(self, future):
+        """Removes cancel marker once all workers have given up"""
+        if not all(f.done() for f in self._futures):
+            return
+        try:
+            os.remove(self._cancel_marker)
+        except FileNotFoundError:
+            pass
+        self._release_statevectors()
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
 
     def status(self):
+        if self._cancelled:
+            return JobStatus.CANCELLED
 
         if len(self._futures) == 0:
             _status = JobStatus.INITIALIZING
@@ -281,18 +1315,15 @@ class ToasterJob(JobV1):
         return verint
 
     @classmethod
-    def _check_qtoaster_version(cls, versionstring):
+    def _check_qtoaster_version(cls, versionstring, minversion=None):
         verint = cls._qtoaster_version_to_int(versionstring)
-        minverint = cls._qtoaster_version_to_int(cls._MINQTOASTERVERSION)
+        minverint = cls._qtoaster_version_to_int(
+            minversion or cls._MINQTOASTERVERSION
+        )
         if verint < minverint:
             return False
         return True
 
     @staticmethod
     def _convert_counts(counts):
-        ret = dict()
-        for key in counts:
-            nicekey = key.replace(" ", "")
-            nicekey = hex(int(nicekey, 2))
-            ret[nicekey] = counts[key]
-        return ret
+        return ToasterCounts.convert_counts(counts)
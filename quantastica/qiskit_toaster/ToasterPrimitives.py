@@ -0,0 +1,237 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+import numpy as np
+
+from qiskit.primitives import (
+    BaseEstimator,
+    BaseSampler,
+    EstimatorResult,
+    SamplerResult,
+)
+from qiskit.primitives.primitive_job import PrimitiveJob
+from qiskit.primitives.utils import _circuit_key, _observable_key
+from qiskit.result import QuasiDistribution
+
+from quantastica.qiskit_toaster import (
+    ToasterBackend,
+    ToasterExpectation,
+    ToasterSampling,
+)
+
+
+def _unique_bindings(circuits, parameter_values):
+    """
+    Returns (unique_circuits, binds, experiments): distinct circuits,
+    array of distinct parameter values (one row per bind set) of each of
+    them, and for every (circuit, values) entry index of the experiment
+    which computes it. Backend runs experiments circuit by circuit, bind
+    set by bind set.
+    """
+    circuit_index = dict()
+    unique_circuits = []
+    rows = []
+    entries = []
+    for circuit, values in zip(circuits, parameter_values):
+        key = _circuit_key(circuit)
+        index = circuit_index.get(key)
+        if index is None:
+            index = len(unique_circuits)
+            circuit_index[key] = index
+            unique_circuits.append(circuit)
+            rows.append(dict())
+        values = tuple(float(v) for v in values)
+        row = rows[index].setdefault(values, len(rows[index]))
+        entries.append((index, row))
+    offsets = np.cumsum([0] + [len(r) for r in rows])
+    binds = [
+        np.array(list(r), dtype=float).reshape(len(r), c.num_parameters)
+        for r, c in zip(rows, unique_circuits)
+    ]
+    experiments = [int(offsets[index]) + row for index, row in entries]
+    return unique_circuits, binds, experiments
+
+
+def _terminal_measurements(circuit):
+    """
+    Returns sorted list of (qubit, clbit) measured in circuit. Raises
+    ValueError if circuit measures nothing or acts on measured qubit.
+    """
+    measured = dict()
+    for instruction in circuit.data:
+        qubits = [circuit.find_bit(q).index for q in instruction.qubits]
+        name = instruction.operation.name
+        if name == "measure":
+            measured[circuit.find_bit(instruction.clbits[0]).index] = qubits[0]
+        elif name != "barrier" and set(qubits) & set(measured.values()):
+            raise ValueError(
+                "Circuit '%s' acts on a qubit after it is measured, set "
+                "shots to sample it" % circuit.name
+            )
+    if not measured:
+        raise ValueError("Circuit '%s' has no measurements" % circuit.name)
+    return sorted((qubit, clbit) for clbit, qubit in measured.items())
+
+
+class ToasterSampler(BaseSampler):
+    """
+    Sampler primitive running circuits on ToasterBackend.
+
+    Each call is sent to toaster as a single job. Equal circuits are
+    converted to toaster format once and simulated once per distinct set
+    of parameter values.
+
+    Options:
+        shots - number of shots, when None (default) quasi-distributions
+            are exact probabilities computed from toaster statevector
+        seed - seed_simulator of sampled counts
+    """
+
+    def __init__(self, backend=None, options=None):
+        super().__init__(options=options)
+        if backend is None:
+            backend = ToasterBackend.get_backend("qasm_simulator")
+        self.backend = backend
+
+    def _run(self, circuits, parameter_values, **run_options):
+        job = PrimitiveJob(
+            self._call, circuits, parameter_values, **run_options
+        )
+        job.submit()
+        return job
+
+    def _call(self, circuits, parameter_values, shots=None, seed=None,
+              **run_options):
+        unique_circuits, binds, experiments = _unique_bindings(
+            circuits, parameter_values
+        )
+        if shots is None:
+            distributions = self._probabilities(
+                unique_circuits, binds, **run_options
+            )
+        else:
+            if seed is not None:
+                run_options["seed_simulator"] = seed
+            distributions = self._counts(
+                unique_circuits, binds, shots, **run_options
+            )
+        quasi_dists = [
+            QuasiDistribution(distributions[i], shots=shots)
+            for i in experiments
+        ]
+        metadata = [{"shots": shots} for _ in experiments]
+        return SamplerResult(quasi_dists, metadata)
+
+    def _probabilities(self, circuits, binds, **run_options):
+        measurements = [_terminal_measurements(c) for c in circuits]
+        statevectors = self.backend._statevectors(
+            circuits, binds, **run_options
+        )
+        circuit_indices = np.repeat(
+            np.arange(len(circuits)), [len(b) for b in binds]
+        )
+        distributions = []
+        for statevector, index in zip(statevectors, circuit_indices):
+            outcomes, probabilities = ToasterSampling.marginal_probabilities(
+                statevector, measurements[index]
+            )
+            distributions.append(
+                dict(zip(outcomes.tolist(), probabilities.tolist()))
+            )
+        return distributions
+
+    def _counts(self, circuits, binds, shots, **run_options):
+        result = self.backend.run(
+            circuits, parameter_binds=binds, shots=shots, **run_options
+        ).result()
+        distributions = []
+        for i in range(len(result.results)):
+            counts = result.get_counts(i)
+            distributions.append(
+                {
+                    int(key.replace(" ", ""), 2): count / shots
+                    for key, count in counts.items()
+                }
+            )
+        return distributions
+
+
+class ToasterEstimator(BaseEstimator):
+    """
+    Estimator primitive running circuits on ToasterBackend.
+
+    Each call is sent to toaster as a single statevector job. Equal
+    circuits are converted to toaster format once and simulated once per
+    distinct set of parameter values, expectation values of all
+    observables measured on the same state are computed from its
+    amplitudes (see ToasterExpectation).
+
+    Options:
+        shots - when set, gaussian noise with variance of the observable
+            divided by shots is added to exact expectation values
+        seed - seed of the noise
+    """
+
+    def __init__(self, backend=None, options=None):
+        super().__init__(options=options)
+        if backend is None:
+            backend = ToasterBackend.get_backend("statevector_simulator")
+        self.backend = backend
+
+    def _run(self, circuits, observables, parameter_values, **run_options):
+        job = PrimitiveJob(
+            self._call, circuits, observables, parameter_values,
+            **run_options
+        )
+        job.submit()
+        return job
+
+    def _call(self, circuits, observables, parameter_values, shots=None,
+              seed=None, **run_options):
+        unique_circuits, binds, experiments = _unique_bindings(
+            circuits, parameter_values
+        )
+        statevectors = self.backend._statevectors(
+            unique_circuits, binds, **run_options
+        )
+        engines = dict()
+        values = []
+        for experiment, observable in zip(experiments, observables):
+            key = _observable_key(observable)
+            engine = engines.get(key)
+            if engine is None:
+                engine = ToasterExpectation.ToasterPauliExpectation(
+                    observable
+                )
+                engines[key] = engine
+            values.append(engine.evaluate(statevectors[experiment]))
+        values = np.real_if_close(np.array(values))
+        if shots is None:
+            return EstimatorResult(values, [dict() for _ in values])
+
+        rng = np.random.default_rng(seed)
+        metadata = []
+        noisy = []
+        for experiment, observable, value in zip(
+            experiments, observables, values
+        ):
+            square = observable.compose(observable).simplify()
+            variance = float(
+                ToasterExpectation.expectation_value(
+                    statevectors[experiment], square
+                ).real
+                - np.real(value) ** 2
+            )
+            variance = max(variance, 0.0)
+            noisy.append(rng.normal(value, np.sqrt(variance / shots)))
+            metadata.append({"variance": variance, "shots": shots})
+        return EstimatorResult(np.array(noisy), metadata)
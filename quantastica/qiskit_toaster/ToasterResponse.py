@@ -0,0 +1,298 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+import ast
+import io
+import json
+import logging
+import re
+import struct
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# size of reads from socket or toaster's stdout
+CHUNK_SIZE = 1024 * 1024
+
+_STATEVECTOR_KEY = re.compile(rb'"statevector"\s*:\s*\[')
+_STATEVECTOR_END = re.compile(rb"\]\s*\]")
+_SEPARATORS = bytes.maketrans(b"[],", b"   ")
+
+# binary response: statevector in .npy format followed by JSON with the
+# rest of the response
+STATEVECTOR_FORMAT_NPY = "npy"
+_NPY_MAGIC = b"\x93NUMPY"
+
+
+class ToasterResponseParser:
+    """
+    Incremental parser of toaster response. Bytes are fed as they arrive
+    and "statevector" array ([[re, im], ...]) is decoded straight into
+    preallocated complex128 array, the rest of the response (counts,
+    time_taken, ...) is small and parsed with json at the end.
+
+    Binary responses (statevector in .npy format, then JSON) are
+    recognized by the .npy magic and copied into the array as is.
+
+    With spool_path the statevector is written to .npy file instead of
+    memory and returned as numpy.memmap. Otherwise arrays are allocated
+    by allocator(shape, dtype) if given (e.g. in shared memory).
+    """
+
+    def __init__(self, n_qubits=None, spool_path=None, allocator=None):
+        self.n_qubits = n_qubits
+        self.spool_path = spool_path
+        self.allocator = allocator
+        self.reset()
+
+    def reset(self):
+        """Discards everything fed so far (e.g. before retrying request)"""
+        # response without statevector
+        self._head = bytearray()
+        self._scanned = 0
+        self._in_statevector = False
+        self._values_seen = False
+        # statevector text which is not decoded yet
+        self._tail = b""
+        self._buffer = None
+        self._floats = None
+        self._size = 0
+        self._statevector = None
+        # binary response state
+        self._started = False
+        self._npy_header = None
+        self._npy_bytes = None
+        self._npy_offset = 0
+
+    def feed(self, data):
+        if not self._started:
+            data = self._start(data)
+            if data is None:
+                return
+        if self._npy_bytes is not None:
+            data = self._feed_npy(data)
+            if not data:
+                return
+        if self._in_statevector:
+            self._feed_statevector(bytes(data))
+        else:
+            self._feed_head(data)
+
+    def _start(self, data):
+        """
+        Detects binary response. Returns data to process further, or None
+        while more data is needed.
+        """
+        if self._npy_header is not None:
+            data = self._npy_header + bytes(data)
+        if not data:
+            return None
+        if len(data) < len(_NPY_MAGIC) and _NPY_MAGIC.startswith(data):
+            self._npy_header = bytes(data)
+            return None
+        if not data.startswith(_NPY_MAGIC):
+            self._started = True
+            self._npy_header = None
+            return data
+        header = self._parse_npy_header(data)
+        if header is None:
+            self._npy_header = bytes(data)
+            return None
+        self._started = True
+        self._npy_header = None
+        dtype, shape, offset = header
+        if self.spool_path and dtype != np.complex128:
+            raise ValueError(
+                "Cannot spool statevector of type %s to file" % dtype
+            )
+        self._statevector = self._new_array(shape, dtype)
+        self._npy_bytes = self._statevector.reshape(-1).view(np.uint8)
+        self._npy_offset = 0
+        return data[offset:]
+
+    @staticmethod
+    def _parse_npy_header(data):
+        """Returns (dtype, shape, data offset) or None if incomplete"""
+        if len(data) < 12:
+            return None
+        major = data[6]
+        if major == 1:
+            (length,) = struct.unpack("<H", data[8:10])
+            start = 10
+        else:
+            (length,) = struct.unpack("<I", data[8:12])
+            start = 12
+        if len(data) < start + length:
+            return None
+        header = ast.literal_eval(
+            bytes(data[start:start + length]).decode("latin-1")
+        )
+        if header.get("fortran_order"):
+            raise ValueError("Fortran ordered statevector is not supported")
+        return np.dtype(header["descr"]), header["shape"], start + length
+
+    def _feed_npy(self, data):
+        """Copies statevector bytes, returns data which follows them"""
+        size = min(len(data), len(self._npy_bytes) - self._npy_offset)
+        end = self._npy_offset + size
+        self._npy_bytes[self._npy_offset:end] = np.frombuffer(
+            data, dtype=np.uint8, count=size
+        )
+        self._npy_offset = end
+        if end < len(self._npy_bytes):
+            return None
+        self._npy_bytes = None
+        if self._statevector.dtype != np.complex128:
+            self._statevector = self._statevector.astype(np.complex128)
+        return data[size:]
+
+    def close(self):
+        """Returns parsed response dict, or None if response was empty"""
+        if self._in_statevector or self._npy_bytes is not None:
+            raise ValueError("Toaster response ended inside statevector")
+        if self._npy_header is not None:
+            raise ValueError("Toaster response ended inside .npy header")
+        if not bytes(self._head).strip():
+            return None
+        result = json.loads(bytes(self._head))
+        if self._statevector is not None:
+            if isinstance(self._statevector, np.memmap):
+                self._statevector.flush()
+            result["statevector"] = self._statevector
+        return result
+
+    def _new_array(self, shape, dtype=np.complex128):
+        if isinstance(shape, int):
+            shape = (shape,)
+        if self.spool_path:
+            return np.lib.format.open_memmap(
+                self.spool_path, mode="w+", dtype=dtype, shape=shape
+            )
+        if self.allocator is not None:
+            return self.allocator(shape, dtype)
+        return np.empty(shape, dtype=dtype)
+
+    def _feed_head(self, data):
+        self._head += data
+        if self._statevector is not None:
+            return
+        match = _STATEVECTOR_KEY.search(self._head, self._scanned)
+        if match is None:
+            # key can be split between two chunks
+            self._scanned = max(0, len(self._head) - 64)
+            return
+        rest = bytes(self._head[match.end():])
+        del self._head[match.start():]
+        self._head += b'"statevector": null'
+        self._in_statevector = True
+        self._allocate(2 ** self.n_qubits if self.n_qubits else 1024)
+        self._feed_statevector(rest)
+
+    def _feed_statevector(self, data):
+        data = self._tail + data
+        if not self._values_seen:
+            stripped = data.lstrip()
+            if not stripped:
+                self._tail = b""
+                return
+            self._values_seen = True
+            if stripped.startswith(b"]"):
+                # empty statevector
+                self._finish_statevector(stripped[1:])
+                return
+        match = _STATEVECTOR_END.search(data)
+        if match is not None:
+            self._decode(data[: match.start()])
+            self._finish_statevector(data[match.end():])
+            return
+        # keep the last "]" so the end of array is found across chunks
+        cut = data.rfind(b"]")
+        if cut < 0:
+            self._tail = data
+            return
+        self._decode(data[:cut])
+        self._tail = data[cut:]
+
+    def _finish_statevector(self, rest):
+        count = self._size // 2
+        statevector = self._buffer[:count]
+        if count != len(self._buffer):
+            if self.spool_path:
+                raise ValueError(
+                    "Statevector is smaller than expected, cannot spool it"
+                )
+            statevector = statevector.copy()
+        self._statevector = statevector
+        self._buffer = None
+        self._floats = None
+        self._tail = b""
+        self._in_statevector = False
+        self._feed_head(rest)
+
+    def _allocate(self, amplitudes):
+        if self.spool_path and self._buffer is not None:
+            raise ValueError(
+                "Statevector is larger than expected, cannot spool it"
+            )
+        buffer = self._new_array(amplitudes)
+        if self._size:
+            buffer.view(np.float64)[: self._size] = self._floats[: self._size]
+        self._buffer = buffer
+        self._floats = buffer.view(np.float64)
+
+    def _decode(self, text):
+        values = np.fromstring(
+            text.translate(_SEPARATORS), dtype=np.float64, sep=" "
+        )
+        end = self._size + len(values)
+        if end > len(self._floats):
+            logger.debug("Statevector is larger than expected, growing")
+            self._allocate(max(len(self._buffer) * 2, (end + 1) // 2))
+        self._floats[self._size:end] = values
+        self._size = end
+
+
+def to_npy(result):
+    """
+    Serializes parsed toaster response to binary format: statevector in
+    .npy format followed by JSON with the rest of the response
+    """
+    result = dict(result)
+    statevector = np.asarray(result.pop("statevector"), dtype="<c16")
+    out = io.BytesIO()
+    np.save(out, statevector, allow_pickle=False)
+    out.write(json.dumps(result).encode("utf-8"))
+    return out.getvalue()
+
+
+def parse(data, n_qubits=None):
+    """Parses complete toaster response (bytes or str)"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    parser = ToasterResponseParser(n_qubits)
+    parser.feed(data)
+    return parser.close()
+
+
+def to_json(result):
+    """
+    Serializes parsed toaster response back to toaster's JSON format
+    (statevector as [[re, im], ...])
+    """
+
+    def default(value):
+        if isinstance(value, np.ndarray):
+            return np.column_stack((value.real, value.imag)).tolist()
+        raise TypeError("%r is not JSON serializable" % type(value))
+
+    return json.dumps(result, default=default)
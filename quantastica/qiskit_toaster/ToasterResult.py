@@ -0,0 +1,109 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+import collections.abc
+import copy
+import warnings
+
+from quantastica.qiskit_toaster import ToasterCounts
+
+from qiskit import QuantumCircuit
+from qiskit.qobj import QobjHeader
+from qiskit.result import Result
+from qiskit.result.models import ExperimentResult
+
+
+def decode_experiment(raw):
+    """Creates ExperimentResult from raw experiment result dict"""
+    data = ToasterCounts.expand_counts(raw["data"])
+    return ExperimentResult.from_dict(dict(raw, data=data))
+
+
+class LazyExperimentResults(collections.abc.Sequence):
+    """
+    Sequence of ExperimentResult objects which are created from raw
+    experiment result dicts on first access
+    """
+
+    def __init__(self, raw_results):
+        self._raw = list(raw_results)
+        self._decoded = [None] * len(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self._raw)
+        if not 0 <= index < len(self._raw):
+            raise IndexError("experiment result index out of range")
+        experiment = self._decoded[index]
+        if experiment is None:
+            experiment = decode_experiment(self._raw[index])
+            self._decoded[index] = experiment
+        return experiment
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def index_of(self, name):
+        """
+        Returns indices of experiments with given name, found in raw
+        headers without decoding the experiments
+        """
+        return [
+            i
+            for i, raw in enumerate(self._raw)
+            if raw.get("header", {}).get("name", "") == name
+        ]
+
+    @property
+    def decoded(self):
+        """Number of experiments decoded so far"""
+        return sum(1 for e in self._decoded if e is not None)
+
+
+class ToasterResult(Result):
+    """
+    Result which keeps raw experiment results and decodes each
+    experiment (counts, header, ...) only when it is accessed.
+    Accessors of qiskit's Result (get_counts, get_statevector, data, ...)
+    work as usual.
+    """
+
+    @classmethod
+    def from_dict(cls, data):
+        in_data = copy.copy(data)
+        in_data["results"] = LazyExperimentResults(in_data.pop("results"))
+        if in_data.get("header") is not None:
+            in_data["header"] = QobjHeader.from_dict(in_data.pop("header"))
+        return cls(**in_data)
+
+    def _get_experiment(self, key=None):
+        # look names up in raw headers, so only the match gets decoded
+        if isinstance(key, QuantumCircuit):
+            key = key.name
+        if isinstance(key, str) and isinstance(
+            self.results, LazyExperimentResults
+        ):
+            indices = self.results.index_of(key)
+            if len(indices) > 1:
+                warnings.warn(
+                    'Result object contained multiple results matching name '
+                    '"%s", only first match will be returned. Use an integer '
+                    "index to retrieve results for all entries." % key
+                )
+            if indices:
+                key = indices[0]
+        return super()._get_experiment(key)
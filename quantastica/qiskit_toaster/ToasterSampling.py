@@ -0,0 +1,213 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+import collections
+import logging
+import threading
+
+import numpy as np
+
+from quantastica.qiskit_toaster import ToasterCache
+
+logger = logging.getLogger(__name__)
+
+# instructions whose outcome depends on measurement or which collapse the
+# state, circuits with them can't be sampled from a single statevector
+_NON_UNITARY = {"reset", "bfunc", "initialize"}
+
+
+def terminal_measurements(experiment):
+    """
+    Returns sorted list of (qubit, memory_slot) measured in qobj experiment
+    dict if no gate acts on a qubit after it is measured (and nothing is
+    conditioned on measurements), otherwise None
+    """
+    if "toaster_circuit" in experiment:
+        # template experiments are already converted with measurements
+        return None
+    measured = dict()
+    measured_qubits = set()
+    for instruction in experiment.get("instructions", []):
+        name = instruction["name"]
+        if name == "measure":
+            for qubit, slot in zip(
+                instruction["qubits"], instruction["memory"]
+            ):
+                measured[slot] = qubit
+                measured_qubits.add(qubit)
+            continue
+        if name == "barrier":
+            continue
+        if name in _NON_UNITARY or "conditional" in instruction:
+            return None
+        if measured_qubits.intersection(instruction.get("qubits", [])):
+            return None
+    return sorted((qubit, slot) for slot, qubit in measured.items())
+
+
+def without_measurements(qobj_dict):
+    """
+    Returns single-experiment qobj dict of the same circuit without
+    measurements, configured for a single unseeded shot
+    """
+    experiment = dict(qobj_dict["experiments"][0])
+    experiment["instructions"] = [
+        i for i in experiment.get("instructions", []) if i["name"] != "measure"
+    ]
+    config = dict(qobj_dict["config"], shots=1)
+    config.pop("seed_simulator", None)
+    stripped = dict(qobj_dict, config=config, experiments=[experiment])
+    stripped.pop("shot_split", None)
+    return stripped
+
+
+def marginal_probabilities(statevector, measurements):
+    """
+    Returns (outcomes, probabilities): distinct values of measured
+    classical register (uint64) and their probabilities
+    """
+    statevector = np.asarray(statevector)
+    probabilities = statevector.real ** 2 + statevector.imag ** 2
+    if not measurements:
+        return np.zeros(1, dtype=np.uint64), np.ones(1)
+    indices = np.arange(len(probabilities), dtype=np.uint64)
+    n_qubits = len(probabilities).bit_length() - 1
+    if measurements == [(q, q) for q in range(n_qubits)]:
+        # every qubit measured into the slot with the same index
+        values = indices
+    else:
+        values = np.zeros(len(probabilities), dtype=np.uint64)
+        for qubit, slot in measurements:
+            values |= ((indices >> np.uint64(qubit)) & np.uint64(1)) << (
+                np.uint64(slot)
+            )
+    outcomes, inverse = np.unique(values, return_inverse=True)
+    marginal = np.bincount(
+        inverse, weights=probabilities, minlength=len(outcomes)
+    )
+    return outcomes, marginal / marginal.sum()
+
+
+def sample_counts(outcomes, probabilities, shots, seed=None):
+    """
+    Returns (outcomes, frequencies) of shots drawn from probabilities.
+    Equal seeds give equal samples.
+    """
+    rng = np.random.default_rng(seed or None)
+    frequencies = rng.multinomial(shots, probabilities)
+    nonzero = frequencies > 0
+    return outcomes[nonzero], frequencies[nonzero].astype(np.int64)
+
+
+class ToasterSamplingCache:
+    """
+    LRU cache of measurement outcome probabilities computed from toaster
+    statevectors, keyed by circuit (without measurements), measured
+    qubits and toaster optimization level
+    """
+
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, max_bytes=None):
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.configure(max_bytes)
+
+    def configure(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = ToasterSamplingCache.DEFAULT_MAX_BYTES
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._shrink()
+
+    @staticmethod
+    def key(stripped_qobj_dict, measurements, optimization=None):
+        return ToasterCache.structural_hash(
+            ToasterCache.ToasterConversionCache.key(stripped_qobj_dict),
+            measurements,
+            optimization,
+        )
+
+    @staticmethod
+    def _size(entry):
+        outcomes, probabilities, _ = entry
+        return outcomes.nbytes + probabilities.nbytes
+
+    def get(self, key):
+        """Returns (outcomes, probabilities, toaster_version) or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        size = ToasterSamplingCache._size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            self._bytes += size
+            self._shrink()
+
+    def _shrink(self):
+        while self._entries and self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= ToasterSamplingCache._size(evicted)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_sampling_cache = None
+_sampling_cache_lock = threading.Lock()
+
+
+def get_sampling_cache(max_bytes=None):
+    """Returns sampling cache of the current process"""
+    global _sampling_cache
+    with _sampling_cache_lock:
+        if _sampling_cache is None:
+            _sampling_cache = ToasterSamplingCache(max_bytes)
+        elif max_bytes is not None:
+            _sampling_cache.configure(max_bytes)
+        return _sampling_cache
+
+
+def sampling_cache_stats():
+    """
+    Returns hit/miss statistics of the sampling cache in the current
+    process (each worker process of process pool has its own cache)
+    """
+    with _sampling_cache_lock:
+        cache = _sampling_cache
+    if cache is None:
+        return None
+    return cache.stats()
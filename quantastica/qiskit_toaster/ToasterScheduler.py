@@ -0,0 +1,493 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+from concurrent import futures
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+import weakref
+
+import numpy as np
+
+from quantastica.qiskit_toaster import ToasterBalancer
+from quantastica.qiskit_toaster import ToasterHttpInterface
+
+logger = logging.getLogger(__name__)
+
+# toaster keeps statevector of complex doubles
+BYTES_PER_AMPLITUDE = 16
+
+
+def estimate_memory(qobj_dict):
+    """
+    Returns estimated toaster memory (bytes) needed to simulate
+    experiments of qobj dict one after another, i.e. memory of the
+    largest one
+    """
+    memory = 0
+    for exp in qobj_dict["experiments"]:
+        n_qubits = exp.get("header", {}).get("n_qubits", 0)
+        memory = max(memory, BYTES_PER_AMPLITUDE * 2 ** n_qubits)
+    return memory
+
+
+def circuit_features(experiment):
+    """
+    Returns (n_qubits, gate_count, depth) of qobj experiment dict.
+    Barriers are not counted.
+    """
+    n_qubits = experiment.get("header", {}).get("n_qubits", 0)
+    gates = 0
+    layers = dict()
+    for instruction in experiment.get("instructions", []):
+        if instruction["name"] == "barrier":
+            continue
+        gates += 1
+        qubits = instruction.get("qubits", [])
+        layer = 1 + max((layers.get(q, 0) for q in qubits), default=0)
+        for q in qubits:
+            layers[q] = layer
+    depth = max(layers.values(), default=0)
+    return n_qubits, gates, depth
+
+
+class ToasterCostModel:
+    """
+    Estimates simulation time (seconds) of an experiment as linear
+    function of 2^n_qubits * gate_count and 2^n_qubits * depth.
+    Coefficients are fitted (least squares) to time_taken reported by
+    toaster, until enough observations are collected prior coefficients
+    are used.
+    """
+
+    # roughly 1ns per amplitude update
+    PRIOR = np.array([1e-3, 1e-9, 0.0])
+    MIN_OBSERVATIONS = 8
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._xtx = np.zeros((3, 3))
+        self._xty = np.zeros(3)
+        self.observations = 0
+        self.coefficients = ToasterCostModel.PRIOR.copy()
+
+    @staticmethod
+    def _vector(features):
+        n_qubits, gates, depth = features
+        amplitudes = float(2 ** n_qubits)
+        return np.array([1.0, amplitudes * gates, amplitudes * depth])
+
+    def estimate(self, features):
+        return max(float(self._vector(features) @ self.coefficients), 0.0)
+
+    def observe(self, features, time_taken):
+        x = self._vector(features)
+        with self._lock:
+            self._xtx += np.outer(x, x)
+            self._xty += x * time_taken
+            self.observations += 1
+            if self.observations < ToasterCostModel.MIN_OBSERVATIONS:
+                return
+            # features differ by orders of magnitude, fit scaled columns
+            scale = np.sqrt(np.diag(self._xtx))
+            scale[scale == 0] = 1.0
+            xtx = self._xtx / np.outer(scale, scale)
+            xty = self._xty / scale
+            coefficients, *_ = np.linalg.lstsq(
+                xtx + 1e-9 * np.eye(3), xty, rcond=None
+            )
+            self.coefficients = coefficients / scale
+
+
+def physical_memory():
+    """Returns physical memory of this machine in bytes or None"""
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class ToasterMemoryBudget:
+    """
+    Memory (bytes) available to toaster on a single machine, shared by
+    schedulers of all jobs sent to it. Work whose estimated memory
+    doesn't fit next to work in flight is not admitted, work larger than
+    the whole budget is admitted alone. None means unlimited.
+    """
+
+    def __init__(self, limit=None, explicit=True):
+        self.limit = limit
+        # default budgets give way to the first one set by user
+        self.explicit = explicit
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.in_flight_memory = 0
+        self.peak_memory = 0
+        # schedulers waiting for memory released by the others
+        self.schedulers = weakref.WeakSet()
+
+    def reserve(self, memory):
+        """Reserves memory if it fits, returns False if it doesn't"""
+        with self._lock:
+            if self.in_flight and self.limit is not None and (
+                self.in_flight_memory + memory > self.limit
+            ):
+                return False
+            self.in_flight += 1
+            self.in_flight_memory += memory
+            self.peak_memory = max(self.peak_memory, self.in_flight_memory)
+            return True
+
+    def release(self, memory):
+        with self._lock:
+            self.in_flight -= 1
+            self.in_flight_memory -= memory
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_budget": self.limit,
+                "in_flight": self.in_flight,
+                "in_flight_memory": self.in_flight_memory,
+                "peak_memory": self.peak_memory,
+            }
+
+
+class ToasterScheduler:
+    """
+    Orders work sent to worker pools of a single toaster machine.
+
+    Pending work is started by priority (higher first) and estimated
+    cost (cheaper first), and only while its executor has an idle worker
+    and estimated memory of work in flight fits into memory budget of
+    the machine (see ToasterMemoryBudget).
+
+    With balancer (several toaster endpoints) each endpoint has its own
+    budget, admitted work gets the endpoint picked by the balancer among
+    those it fits into. It is passed as toaster_urls keyword argument:
+    its url followed by the other endpoints to fail over to. Work returns
+    list of experiment result dicts, whose "toaster_url" tells which
+    endpoint served the experiment. Endpoint is released with latency of
+    the work, or as failed if work had to fail over.
+    """
+
+    def __init__(self, memory_budget=None, balancer=None, budgets=None):
+        self.balancer = balancer
+        if budgets is None:
+            keys = [None]
+            if balancer is not None:
+                keys = [e.url for e in balancer.endpoints]
+            budgets = {
+                key: ToasterMemoryBudget(memory_budget) for key in keys
+            }
+        # by endpoint url, or None without balancer
+        self.budgets = budgets
+        for budget in budgets.values():
+            budget.schedulers.add(self)
+        self.cost_model = ToasterCostModel()
+        self._lock = threading.Lock()
+        # heap of (-priority, cost, sequence, item) per executor
+        self._pending = dict()
+        self._counter = itertools.count()
+        self._in_flight_memory = 0
+        self._in_flight = 0
+        self._executor_load = dict()
+        # executor futures of admitted work, by future returned from submit
+        self._inner = dict()
+        self.peak_memory = 0
+
+    def submit(self, executor, memory, fn, *args, cost=0.0, priority=0,
+               **kwargs):
+        """
+        Returns future which is completed with result of
+        executor.submit(fn, *args, **kwargs) once the work is admitted
+        """
+        future = futures.Future()
+        item = (executor, memory, future, fn, args, kwargs)
+        with self._lock:
+            heapq.heappush(
+                self._pending.setdefault(executor, []),
+                (-priority, cost, next(self._counter), item),
+            )
+        self._dispatch()
+        return future
+
+    def _reserve(self, memory):
+        """
+        Reserves memory in budget of the toaster machine, with balancer
+        in budget of the best endpoint it fits into. Returns key of the
+        budget, or _FULL if memory doesn't fit.
+        """
+        if self.balancer is None:
+            keys = [None]
+        else:
+            keys = self.balancer.ranked_urls()
+        for key in keys:
+            if self.budgets[key].reserve(memory):
+                return key
+        return _FULL
+
+    def _has_idle_worker(self, executor):
+        # executors without known size are fed immediately
+        max_workers = getattr(executor, "_max_workers", None)
+        if max_workers is None:
+            return True
+        return self._executor_load.get(executor, 0) < max_workers
+
+    def _next_item(self):
+        """
+        Pops best pending item among executors with idle worker and
+        returns it with key of budget its memory is reserved in, or
+        returns None. If the best item doesn't fit into memory budget
+        it blocks the rest.
+        """
+        best = None
+        for executor, pending in self._pending.items():
+            while pending and pending[0][3][2].cancelled():
+                heapq.heappop(pending)
+            if pending and self._has_idle_worker(executor):
+                if best is None or pending[0] < best[0]:
+                    best = pending[0], pending
+        if best is None:
+            return None
+        item = best[0][3]
+        key = self._reserve(item[1])
+        if key is _FULL:
+            return None
+        heapq.heappop(best[1])
+        return item, key
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                next_item = self._next_item()
+                if next_item is None:
+                    return
+                item, key = next_item
+                # under the lock, so it can't race with cancel()
+                if not item[2].set_running_or_notify_cancel():
+                    self.budgets[key].release(item[1])
+                    continue
+                executor, memory = item[:2]
+                self._in_flight_memory += memory
+                self._in_flight += 1
+                self._executor_load[executor] = (
+                    self._executor_load.get(executor, 0) + 1
+                )
+                self.peak_memory = max(
+                    self.peak_memory, self._in_flight_memory
+                )
+            self._start(key, *item)
+
+    def _start(self, key, executor, memory, future, fn, args, kwargs):
+        endpoint = None
+        if self.balancer is not None:
+            endpoint = self.balancer.acquire([key])
+            kwargs = dict(
+                kwargs, toaster_urls=self.balancer.fallback_urls(endpoint)
+            )
+        started = time.monotonic()
+        try:
+            inner = executor.submit(fn, *args, **kwargs)
+        except Exception as e:
+            if endpoint is not None:
+                self.balancer.release(endpoint)
+            self._release(key, executor, memory)
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._inner[future] = inner
+        inner.add_done_callback(
+            lambda f: self._finish(
+                future, key, executor, memory, f, endpoint, started
+            )
+        )
+
+    def _finish(self, future, key, executor, memory, inner, endpoint,
+                started):
+        with self._lock:
+            self._inner.pop(future, None)
+        if endpoint is not None:
+            self._release_endpoint(endpoint, inner, started)
+        self._release(key, executor, memory)
+        if inner.cancelled():
+            future.set_exception(futures.CancelledError())
+        elif inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
+        self._dispatch()
+
+    def _release_endpoint(self, endpoint, inner, started):
+        if inner.cancelled():
+            self.balancer.release(endpoint)
+            return
+        error = inner.exception()
+        if error is not None:
+            self.balancer.release(
+                endpoint,
+                failed=isinstance(
+                    error, ToasterHttpInterface.ToasterConnectionError
+                ),
+            )
+            return
+        failed = any(
+            result.get("toaster_url", endpoint.url) != endpoint.url
+            for result in inner.result()
+        )
+        if failed:
+            self.balancer.release(endpoint, failed=True)
+        else:
+            self.balancer.release(
+                endpoint, latency=time.monotonic() - started
+            )
+
+    def cancel(self, future):
+        """
+        Cancels work of future returned from submit. Pending work is
+        dropped, admitted work is cancelled if executor didn't start it
+        yet. Returns False if the work is already running.
+        """
+        with self._lock:
+            if future.cancel():
+                # wakes up futures.wait() and as_completed() waiters
+                future.set_running_or_notify_cancel()
+                return True
+            inner = self._inner.get(future)
+        return inner is not None and inner.cancel()
+
+    def _release(self, key, executor, memory):
+        budget = self.budgets[key]
+        budget.release(memory)
+        with self._lock:
+            self._in_flight_memory -= memory
+            self._in_flight -= 1
+            load = self._executor_load[executor] - 1
+            if load:
+                self._executor_load[executor] = load
+            else:
+                del self._executor_load[executor]
+                if not self._pending.get(executor, True):
+                    del self._pending[executor]
+        # other jobs sent to the same machine may fit now
+        for scheduler in list(budget.schedulers):
+            if scheduler is not self:
+                scheduler._dispatch()
+
+    def stats(self):
+        """
+        Returns counters of work of this scheduler. memory_budget is
+        budget of the toaster machine, with balancer dict of budgets by
+        endpoint url.
+        """
+        if self.balancer is None:
+            memory_budget = self.budgets[None].limit
+        else:
+            memory_budget = {
+                url: budget.limit for url, budget in self.budgets.items()
+            }
+        with self._lock:
+            return {
+                "memory_budget": memory_budget,
+                "in_flight": self._in_flight,
+                "in_flight_memory": self._in_flight_memory,
+                "peak_memory": self.peak_memory,
+                "pending": sum(len(p) for p in self._pending.values()),
+                "cost_observations": self.cost_model.observations,
+            }
+
+
+# returned by ToasterScheduler._reserve when memory doesn't fit
+_FULL = object()
+
+_budgets = dict()
+_budgets_lock = threading.Lock()
+
+
+def get_budget(target, memory_budget=None):
+    """
+    Returns memory budget of toaster machine identified by target
+    ("host:port" or "cli" for local toaster binary). Budget is fixed
+    once set: when memory_budget is not given local toaster binary gets
+    physical memory of this machine and remote toasters are not limited,
+    until a job sets the budget. Other budgets asked for later are
+    ignored (with a warning).
+    """
+    with _budgets_lock:
+        budget = _budgets.get(target)
+        if budget is None:
+            if memory_budget is not None:
+                budget = ToasterMemoryBudget(memory_budget)
+            elif target == "cli":
+                budget = ToasterMemoryBudget(physical_memory(), False)
+            else:
+                budget = ToasterMemoryBudget(None, False)
+            _budgets[target] = budget
+        elif memory_budget is not None and memory_budget != budget.limit:
+            if budget.explicit:
+                logger.warning(
+                    "Memory budget of toaster %s is already %d bytes, "
+                    "ignoring %d",
+                    target, budget.limit, memory_budget,
+                )
+            else:
+                budget.limit = memory_budget
+                budget.explicit = True
+    return budget
+
+
+def budget_stats():
+    with _budgets_lock:
+        budgets = list(_budgets.items())
+    return {target: budget.stats() for target, budget in budgets}
+
+
+_schedulers = dict()
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(target, memory_budget=None, urls=None,
+                  balancer_options=None):
+    """
+    Returns scheduler of toaster machine identified by target
+    ("host:port" or "cli" for local toaster binary), or of several
+    toaster endpoints of given urls (target joins their "host:port"),
+    balanced by ToasterBalancer. memory_budget is budget of each toaster
+    machine, see get_budget.
+    """
+    balancer = None
+    if urls:
+        balancer = ToasterBalancer.get_balancer(
+            urls, **(balancer_options or {})
+        )
+        budgets = {
+            url: get_budget(urlsplit(url).netloc, memory_budget)
+            for url in urls
+        }
+    else:
+        budgets = {None: get_budget(target, memory_budget)}
+    with _schedulers_lock:
+        scheduler = _schedulers.get(target)
+        if scheduler is None:
+            scheduler = ToasterScheduler(balancer=balancer, budgets=budgets)
+            _schedulers[target] = scheduler
+    return scheduler
+
+
+def scheduler_stats():
+    with _schedulers_lock:
+        schedulers = list(_schedulers.items())
+    return {target: scheduler.stats() for target, scheduler in schedulers}
@@ -0,0 +1,208 @@
+# This code is part of quantastica.qiskit_toaster
+#
+# (C) Copyright Quantastica 2019.
+# https://quantastica.com/
+#
+# This code is licensed under the Apache License, Version 2.0. You may
+# obtain a copy of this license in the LICENSE.txt file in the root directory
+# of this source tree or at http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Any modifications or derivative works of this code must retain this
+# copyright notice, and modified files need to carry a notice indicating
+# that they have been altered from the originals.
+import json
+import logging
+
+import numpy as np
+
+try:
+    # converter internals, templates fall back to converting each bind
+    # set separately if they are not available
+    from quantastica.qconvert.qconvert_base import (
+        gate_defs,
+        eval_mathjs_matrix,
+    )
+
+    TEMPLATES_AVAILABLE = True
+except ImportError:
+    TEMPLATES_AVAILABLE = False
+from quantastica.qiskit_toaster import ToasterCache
+from qiskit.circuit import Parameter, ParameterExpression
+
+logger = logging.getLogger(__name__)
+
+_PARAMS_MARK = "@@toaster-template-params@@"
+_MATRIX_MARK = "@@toaster-template-matrix@@"
+
+
+class ToasterCircuitTemplate:
+    """
+    Parameterized circuit converted to toaster format once. Binding
+    parameter values only re-evaluates matrices of the gates which depend
+    on parameters, the rest of the converted circuit is reused as is.
+    """
+
+    def __init__(self, circuit, experiment, cache_options=None):
+        """
+        circuit - parameterized QuantumCircuit
+        experiment - qobj experiment dict assembled from the same circuit
+            with any values assigned to its parameters
+        cache_options - kwargs of ToasterCache.get_conversion_cache
+        """
+        self.parameters = list(circuit.parameters)
+        self.experiment = experiment
+        cache = ToasterCache.get_conversion_cache(**(cache_options or {}))
+        converted = cache.convert({"experiments": [experiment]})
+        self._circuit = json.loads(converted)
+        self._param_index = {p: i for i, p in enumerate(self.parameters)}
+        self._gates = self._find_parameterized_gates(circuit)
+        self._serialize_static_parts()
+
+    def _serialize_static_parts(self):
+        """
+        Pre-serializes the converted circuit gate by gate, so binding only
+        needs to serialize the parameterized gates.
+        """
+        head = dict(self._circuit)
+        program = head.pop("program")
+        head_json = json.dumps(head)
+        if head:
+            self._head = head_json[:-1] + ', "program": ['
+        else:
+            self._head = '{"program": ['
+        self._pieces = [json.dumps(gate) for gate in program]
+        # parameterized gates are kept as JSON text with placeholders
+        # for their params and matrix
+        self._gate_texts = []
+        for index, _, _ in self._gates:
+            gate = dict(program[index])
+            gate["options"] = dict(gate["options"], params=_PARAMS_MARK)
+            gate["matrix"] = _MATRIX_MARK
+            self._gate_texts.append(json.dumps(gate))
+
+    def _find_parameterized_gates(self, circuit):
+        """
+        Returns (program_index, gate_name, params) for each gate with
+        parameterized params. Converter emits one program entry per
+        instruction except for barriers (none) and measurements (one per
+        qubit).
+        """
+        program = self._circuit["program"]
+        gates = []
+        index = 0
+        for instruction in circuit.data:
+            operation = instruction.operation
+            if operation.name == "barrier":
+                continue
+            if operation.name == "measure":
+                index += len(instruction.qubits)
+                continue
+            if index >= len(program) or (
+                program[index]["name"] != operation.name
+            ):
+                raise ValueError(
+                    "Cannot create template for circuit '%s', unexpected "
+                    "instruction '%s'" % (circuit.name, operation.name)
+                )
+            params = list(operation.params)
+            if any(
+                isinstance(p, ParameterExpression) and p.parameters
+                for p in params
+            ):
+                gate_def = gate_defs.get(operation.name, {})
+                if "matrix" not in gate_def:
+                    raise ValueError(
+                        "Cannot create template for circuit '%s', gate '%s' "
+                        "has no matrix definition"
+                        % (circuit.name, operation.name)
+                    )
+                gates.append((index, operation.name, params))
+            index += 1
+        return gates
+
+    def bind_sets(self, binds):
+        """See module function bind_sets"""
+        return bind_sets(self.parameters, binds)
+
+    def bind(self, values):
+        """
+        Returns converted toaster circuit (JSON string) with given
+        parameter values (sequence in self.parameters order)
+        """
+        pieces = list(self._pieces)
+        # gates with the same name and values share params and matrix
+        memo = dict()
+        for (index, name, params), text in zip(self._gates, self._gate_texts):
+            numeric = tuple(self._bind_param(p, values) for p in params)
+            key = (name, numeric)
+            replacements = memo.get(key)
+            if replacements is None:
+                gate_def = gate_defs[name]
+                params_dict = dict(zip(gate_def.get("params", []), numeric))
+                matrix = eval_mathjs_matrix(gate_def["matrix"], params_dict)
+                replacements = (json.dumps(params_dict), json.dumps(matrix))
+                memo[key] = replacements
+            pieces[index] = text.replace(
+                '"%s"' % _PARAMS_MARK, replacements[0]
+            ).replace('"%s"' % _MATRIX_MARK, replacements[1])
+        return self._head + ", ".join(pieces) + "]}"
+
+    def _bind_param(self, param, values):
+        if isinstance(param, Parameter):
+            return float(values[self._param_index[param]])
+        if isinstance(param, ParameterExpression):
+            bound = param.bind(
+                {p: values[self._param_index[p]] for p in param.parameters}
+            )
+            return float(bound)
+        return float(param)
+
+    def experiments(self, binds):
+        """
+        Returns list of qobj experiment dicts, one per bind set. Each one
+        carries already converted circuit under "toaster_circuit" key and
+        shares header and instructions with the template experiment.
+        """
+        experiments = []
+        for values in self.bind_sets(binds):
+            experiment = dict(self.experiment)
+            experiment["toaster_circuit"] = self.bind(values)
+            experiments.append(experiment)
+        return experiments
+
+
+def bind_sets(parameters, binds):
+    """
+    Returns 2D array of parameter values: one row per bind set, one
+    column per parameter (in parameters order).
+
+    binds can be dict {Parameter: value or sequence/array of values}
+    or array_like of shape (num_bind_sets, num_parameters).
+    """
+    if binds is None or len(parameters) == 0:
+        return np.zeros((1, len(parameters)))
+    if isinstance(binds, dict):
+        missing = [p for p in parameters if p not in binds]
+        if missing:
+            raise ValueError(
+                "Missing values for parameters: %s"
+                % ", ".join(p.name for p in missing)
+            )
+        columns = [
+            np.asarray(binds[p], dtype=float).reshape(-1)
+            for p in parameters
+        ]
+        if len(set(len(c) for c in columns)) > 1:
+            raise ValueError(
+                "All parameters must have the same number of values"
+            )
+        return np.column_stack(columns)
+    values = np.asarray(binds, dtype=float)
+    if values.ndim == 1:
+        values = values.reshape(1, -1)
+    if values.ndim != 2 or values.shape[1] != len(parameters):
+        raise ValueError(
+            "Expected array of shape (num_bind_sets, %d), got %s"
+            % (len(parameters), values.shape)
+        )
+    return values
@@ -8,12 +8,13 @@ import time
 
 class TestToasterBase(unittest.TestCase):
     @staticmethod
-    def toaster_backend(backend_name=None):
+    def toaster_backend(backend_name=None, **kwargs):
         return ToasterBackend.get_backend(
             backend_name,
             toaster_host=os.getenv("TOASTER_HOST", None),
             toaster_port=os.getenv("TOASTER_PORT", None),
             use_cli=os.getenv("USE_CLI", False),
+            **kwargs
         )
 
     @classmethod
@@ -0,0 +1,98 @@
+import unittest
+import os
+import tempfile
+from qiskit import QuantumCircuit
+from qiskit.circuit import Parameter
+from quantastica.qconvert import qobj_to_toaster
+from quantastica.qiskit_toaster import ToasterBackend, ToasterCache, ToasterJob
+
+
+class TestConversionCache(unittest.TestCase):
+    @staticmethod
+    def get_single_experiments(circuits):
+        backend = ToasterBackend.get_backend()
+        qobj_dict = backend._assemble(circuits).to_dict()
+        return [exp for _, exp in ToasterJob._split_experiments(qobj_dict, "")]
+
+    @staticmethod
+    def get_qc(angle, name):
+        qc = QuantumCircuit(2, 2, name=name)
+        qc.rx(angle, 0)
+        qc.cx(0, 1)
+        qc.measure([0, 1], [0, 1])
+        return qc
+
+    def test_hits_and_misses(self):
+        exps = self.get_single_experiments(
+            [self.get_qc(0.1, "a"), self.get_qc(0.1, "b"), self.get_qc(0.2, "c")]
+        )
+        cache = ToasterCache.ToasterConversionCache()
+        for exp in exps:
+            self.assertEqual(
+                cache.convert(exp),
+                qobj_to_toaster(exp, {"all_experiments": False}),
+            )
+        stats = cache.stats()
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["entries"], 2)
+
+    def test_size_eviction(self):
+        circuits = []
+        for i in range(4):
+            qc = QuantumCircuit(4, name="qc%d" % i)
+            qc.x(i)
+            circuits.append(qc)
+        exps = self.get_single_experiments(circuits)
+        size = len(qobj_to_toaster(exps[0], {"all_experiments": False}))
+        cache = ToasterCache.ToasterConversionCache(max_bytes=size * 2 + 10)
+        for exp in exps:
+            cache.convert(exp)
+        stats = cache.stats()
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["evictions"], 2)
+        cache.convert(exps[0])
+        self.assertEqual(cache.stats()["misses"], 5)
+
+    def test_disk_tier(self):
+        exps = self.get_single_experiments([self.get_qc(0.3, "a")])
+        with tempfile.TemporaryDirectory() as directory:
+            ToasterCache.ToasterConversionCache(directory=directory).convert(
+                exps[0]
+            )
+            self.assertEqual(len(os.listdir(directory)), 1)
+            # fresh cache (e.g. in another worker process) hits the disk tier
+            cache = ToasterCache.ToasterConversionCache(directory=directory)
+            cache.convert(exps[0])
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            self.assertEqual(cache.stats()["misses"], 0)
+
+    def test_backend_settings_are_kept(self):
+        theta = Parameter("theta")
+        qc = self.get_qc(theta, "template")
+        with tempfile.TemporaryDirectory() as directory:
+            configured = ToasterBackend.get_backend(
+                conversion_cache_dir=directory,
+                conversion_cache_size=12345,
+                conversion_cache_disk_size=67890,
+            )
+            configured._assemble(qc, parameter_binds=[{theta: [0.1]}])
+            # templates use conversion cache of their backend
+            self.assertEqual(len(os.listdir(directory)), 1)
+            # backend without cache options doesn't reset the settings
+            ToasterBackend.get_backend()._assemble(
+                qc, parameter_binds=[{theta: [0.2]}]
+            )
+            ToasterCache.get_conversion_cache(directory=directory)
+            stats = ToasterCache.conversion_cache_stats()
+            self.assertEqual(stats[directory]["max_bytes"], 12345)
+            self.assertEqual(
+                stats[None]["max_bytes"],
+                ToasterCache.ToasterConversionCache.DEFAULT_MAX_BYTES,
+            )
+            cache = ToasterCache.get_conversion_cache(directory=directory)
+            self.assertEqual(cache._disk.max_bytes, 67890)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import os
+import stat
+import tempfile
+import threading
+import time
+import uuid
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler
+from qiskit import QuantumCircuit
+from qiskit.compiler import assemble
+from qiskit.providers import JobStatus
+from quantastica.qiskit_toaster import (
+    ToasterCliInterface,
+    ToasterHttpInterface,
+    ToasterJob,
+)
+
+try:
+    from .test_http_interface import StandInToaster
+except Exception:
+    from test_http_interface import StandInToaster
+
+
+class AbortableToasterHandler(BaseHTTPRequestHandler):
+    """Keeps every /submit running until its job is aborted"""
+
+    protocol_version = "HTTP/1.1"
+    aborted = set()
+    lock = threading.Condition()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/abort/"):
+            with self.lock:
+                self.aborted.add(self.path.split("/")[2])
+                self.lock.notify_all()
+            return self._send(200)
+        job_id = self.headers.get("x-qtc-jobid")
+        with self.lock:
+            self.lock.wait_for(lambda: job_id in self.aborted, timeout=30)
+        self._send(500)
+
+
+class TestCancel(unittest.TestCase):
+    def test_cli_process_is_killed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "qubit-toaster")
+            with open(path, "w") as f:
+                f.write("#!/bin/sh\nexec sleep 30\n")
+            os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+            toaster = ToasterCliInterface.ToasterCliInterface(path)
+            start = time.time()
+            with self.assertRaises(futures.CancelledError):
+                toaster.execute(b"{}", shots=1, is_cancelled=lambda: True)
+            self.assertLess(time.time() - start, 10)
+
+    def test_cancel_marker_is_unique(self):
+        self.assertNotEqual(
+            ToasterJob._cancel_marker("job"), ToasterJob._cancel_marker("job")
+        )
+
+    def test_http_job_cancel(self):
+        toaster = StandInToaster(AbortableToasterHandler)
+        circuit = QuantumCircuit(1)
+        circuit.h(0)
+        circuit.measure_all()
+        qobj = assemble([circuit] * 6, shots=10).to_dict()
+        executor = futures.ThreadPoolExecutor(max_workers=2)
+        port = toaster.server.server_address[1]
+        job_id = str(uuid.uuid4())
+        try:
+            job = ToasterJob.ToasterJob(
+                None, job_id, qobj, "127.0.0.1", port,
+                executor=executor,
+            )
+            job.submit()
+            while sum(f.running() for f in job._futures) < 2:
+                time.sleep(0.01)
+            self.assertTrue(job.cancel())
+            self.assertEqual(job.status(), JobStatus.CANCELLED)
+            # only two experiments were started, the rest is dropped
+            self.assertEqual(sum(f.cancelled() for f in job._futures), 4)
+            self.assertEqual(
+                AbortableToasterHandler.aborted,
+                {"Exp_1_%s" % job_id, "Exp_2_%s" % job_id},
+            )
+            done, _ = futures.wait(job._futures, timeout=10)
+            self.assertEqual(len(done), 6)
+            # done callbacks removing the marker run after wait() returns
+            marker = job._cancel_marker
+            deadline = time.time() + 5
+            while os.path.exists(marker) and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(os.path.exists(marker))
+        finally:
+            executor.shutdown()
+            toaster.close()
+            ToasterHttpInterface.close_connection_pools()
+
+
+if __name__ == "__main__":
+    unittest.main()
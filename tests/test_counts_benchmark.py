@@ -0,0 +1,85 @@
+import unittest
+import os
+import time
+import numpy as np
+from quantastica.qiskit_toaster import ToasterCounts, ToasterJob
+
+
+def convert_counts_loop(counts):
+    """Previous implementation of ToasterJob._convert_counts"""
+    ret = dict()
+    for key in counts:
+        nicekey = key.replace(" ", "")
+        nicekey = hex(int(nicekey, 2))
+        ret[nicekey] = counts[key]
+    return ret
+
+
+class TestCountsBenchmark(unittest.TestCase):
+    """
+    Microbenchmark of counts conversion with 2^16 distinct outcomes
+    of two registers, against the previous per-key loop.
+    """
+
+    @staticmethod
+    def get_counts(num_bits=16, split=5):
+        rng = np.random.default_rng(0)
+        counts = dict()
+        for value, frequency in enumerate(
+            rng.integers(1, 1000, size=2 ** num_bits).tolist()
+        ):
+            key = format(value, "0%db" % num_bits)
+            counts[key[:split] + " " + key[split:]] = frequency
+        return counts
+
+    @staticmethod
+    def best_time(fn, counts, repeats=5):
+        best = None
+        for i in range(repeats):
+            t = time.perf_counter()
+            fn(counts)
+            elapsed = time.perf_counter() - t
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def test_matches_loop(self):
+        counts = self.get_counts(num_bits=10, split=3)
+        self.assertEqual(
+            ToasterJob.ToasterJob._convert_counts(counts),
+            convert_counts_loop(counts),
+        )
+        outcomes, frequencies = ToasterCounts.counts_to_arrays(counts)
+        self.assertEqual(outcomes.dtype, np.uint64)
+        self.assertEqual(int(outcomes[5]), int("0000000101", 2))
+        self.assertEqual(int(frequencies.sum()), sum(counts.values()))
+
+    def test_wide_registers(self):
+        counts = {"1" * 70 + " 01": 3, "0" * 70 + " 10": 4}
+        self.assertEqual(
+            ToasterCounts.convert_counts(counts), convert_counts_loop(counts)
+        )
+
+    def test_full_size(self):
+        counts = self.get_counts()
+        self.assertEqual(
+            ToasterCounts.convert_counts(counts), convert_counts_loop(counts)
+        )
+        outcomes, frequencies = ToasterCounts.counts_to_arrays(counts)
+        self.assertEqual(len(outcomes), len(counts))
+        self.assertEqual(int(frequencies.sum()), sum(counts.values()))
+
+    @unittest.skipUnless(
+        os.getenv("SLOW") == "1",
+        "Skipping this test (environment variable SLOW must be set to 1)",
+    )
+    def test_benchmark(self):
+        counts = self.get_counts()
+        t_loop = self.best_time(convert_counts_loop, counts)
+        t_dict = self.best_time(ToasterCounts.convert_counts, counts)
+        t_arrays = self.best_time(ToasterCounts.counts_to_arrays, counts)
+        self.assertLess(t_dict, t_loop)
+        self.assertLess(t_arrays, t_loop / 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
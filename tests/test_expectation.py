@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+from qiskit.quantum_info import (
+    SparsePauliOp,
+    random_pauli_list,
+    random_statevector,
+)
+from quantastica.qiskit_toaster import ToasterExpectation
+
+
+class TestToasterExpectation(unittest.TestCase):
+    def assert_matches_qiskit(self, n_qubits, n_terms, seed):
+        rng = np.random.default_rng(seed)
+        state = random_statevector(2 ** n_qubits, seed=seed)
+        paulis = random_pauli_list(n_qubits, n_terms, seed=seed, phase=True)
+        observable = SparsePauliOp(
+            paulis, rng.normal(size=n_terms) + 1j * rng.normal(size=n_terms)
+        )
+        self.assertAlmostEqual(
+            ToasterExpectation.expectation_value(state.data, observable),
+            state.expectation_value(observable),
+        )
+
+    def test_matches_qiskit(self):
+        for n_qubits in [1, 2, 5]:
+            # few terms per commuting set and many (Walsh-Hadamard)
+            for n_terms in [1, 3, 40]:
+                self.assert_matches_qiskit(n_qubits, n_terms, n_qubits)
+
+    def test_qubit_wise_commuting_groups(self):
+        observable = SparsePauliOp.from_list(
+            [("ZZ", 1), ("ZI", 2), ("IZ", 3), ("XX", 4), ("XI", 5)]
+        )
+        engine = ToasterExpectation.ToasterPauliExpectation(observable)
+        self.assertEqual(len(engine.groups), 2)
+        self.assertTrue(engine.hermitian)
+        # |00>: Z terms are +1, X terms average out
+        state = np.zeros(4)
+        state[0] = 1
+        self.assertAlmostEqual(engine.evaluate(state), 6)
+
+    def test_size_mismatch(self):
+        with self.assertRaises(ValueError):
+            ToasterExpectation.expectation_value(np.ones(2), "ZZ")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,603 @@
+import unittest
+import asyncio
+import json
+import multiprocessing
+import threading
+import time
+import uuid
+from concurrent import futures
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from qiskit import QuantumCircuit
+from qiskit.compiler import assemble
+from qiskit.providers import JobStatus
+from quantastica.qiskit_toaster import (
+    ToasterAsyncJob,
+    ToasterBalancer,
+    ToasterHttpInterface,
+    ToasterJob,
+    ToasterScheduler,
+)
+
+
+class StandInToasterHandler(BaseHTTPRequestHandler):
+    """Answers every /submit with canned toaster response"""
+
+    protocol_version = "HTTP/1.1"
+    response = {
+        "counts": {"00": 1},
+        "time_taken": 0.001,
+        "qtoaster_version": "0.9.9",
+    }
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps(self.response).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LongPollToasterHandler(StandInToasterHandler):
+    """
+    Accepts /submit with 202 and holds each /pollresult for up to
+    x-qtc-wait seconds, the result is ready after ready_after polls
+    """
+
+    ready_after = 3
+    polls = []
+
+    def _send_empty(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._send_empty(202)
+
+    def do_GET(self):
+        self.polls.append(self.headers.get("x-qtc-wait"))
+        if len(self.polls) < self.ready_after:
+            time.sleep(float(self.headers.get("x-qtc-wait") or 0))
+            return self._send_empty(202)
+        body = json.dumps(self.response).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class NeverReadyToasterHandler(LongPollToasterHandler):
+    ready_after = float("inf")
+    polls = []
+
+
+class SlowToasterHandler(StandInToasterHandler):
+    """Answers /submit after a delay and records which server answered"""
+
+    delay = 0.3
+    served = []
+
+    def do_POST(self):
+        time.sleep(self.delay)
+        self.served.append(self.server.server_address[1])
+        super().do_POST()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class ConcurrentToasterHandler(StandInToasterHandler):
+    """Answers /submit after a delay and records peak concurrency"""
+
+    delay = 0.1
+    lock = threading.Lock()
+    running = 0
+    peak = 0
+    served = 0
+
+    def do_POST(self):
+        cls = ConcurrentToasterHandler
+        with cls.lock:
+            cls.running += 1
+            cls.peak = max(cls.peak, cls.running)
+        time.sleep(self.delay)
+        with cls.lock:
+            cls.running -= 1
+            cls.served += 1
+        super().do_POST()
+
+
+class NpyRejectingToasterHandler(StandInToasterHandler):
+    """Answers /submit with 400 if binary statevector is requested"""
+
+    response = {
+        "counts": {"00": 1},
+        "statevector": [[1, 0], [0, 0], [0, 0], [0, 0]],
+        "time_taken": 0.001,
+        "qtoaster_version": "1.0.0",
+    }
+    formats = []
+
+    def do_POST(self):
+        statevector_format = self.headers.get("x-qtc-statevector-format")
+        self.formats.append(statevector_format)
+        if statevector_format is None:
+            return super().do_POST()
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(400)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class StandInToaster:
+    def __init__(self, handler=StandInToasterHandler, port=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestToasterHttpInterface(unittest.TestCase):
+    def setUp(self):
+        self.toaster = StandInToaster()
+
+    def tearDown(self):
+        self.toaster.close()
+        ToasterHttpInterface.close_connection_pools()
+
+    def test_connection_reuse(self):
+        toaster = ToasterHttpInterface.ToasterHttpInterface(
+            self.toaster.url, pool_size=2
+        )
+        for i in range(5):
+            txt = toaster.execute(b"{}", job_id="job%d" % i, shots=1)
+            self.assertEqual(json.loads(txt)["counts"], {"00": 1})
+        stats = ToasterHttpInterface.connection_pool_stats()
+        key = self.toaster.url[len("http://"):]
+        self.assertEqual(stats[key]["misses"], 1)
+        self.assertEqual(stats[key]["hits"], 4)
+        self.assertEqual(stats[key]["idle"], 1)
+
+    def test_idle_eviction(self):
+        toaster = ToasterHttpInterface.ToasterHttpInterface(
+            self.toaster.url, pool_idle_timeout=0
+        )
+        toaster.execute(b"{}", job_id="job1", shots=1)
+        toaster.execute(b"{}", job_id="job2", shots=1)
+        stats = ToasterHttpInterface.connection_pool_stats()
+        key = self.toaster.url[len("http://"):]
+        self.assertEqual(stats[key]["misses"], 2)
+        self.assertEqual(stats[key]["evictions"], 1)
+
+    def test_process_pool_after_parent_request(self):
+        toaster = ToasterHttpInterface.ToasterHttpInterface(self.toaster.url)
+        # leaves an idle keep-alive connection in the parent's pool
+        toaster.execute(b"{}", job_id="parent", shots=1)
+        circuit = QuantumCircuit(2)
+        circuit.h(0)
+        circuit.measure_all()
+        qobj = assemble([circuit] * 8, shots=10).to_dict()
+        context = multiprocessing.get_context("fork")
+        with futures.ProcessPoolExecutor(
+            max_workers=2, mp_context=context
+        ) as executor:
+            # forked workers start without the parent's connections
+            self.assertEqual(
+                executor.submit(
+                    ToasterHttpInterface.connection_pool_stats
+                ).result(),
+                dict(),
+            )
+            job = ToasterJob.ToasterJob(
+                None, "forked", qobj, "127.0.0.1",
+                self.toaster.server.server_address[1],
+                executor=executor,
+            )
+            job.submit()
+            result = job.result(timeout=30)
+        self.assertEqual(len(result.results), 8)
+        self.assertTrue(result.success)
+
+
+class TestToasterHttpRetries(unittest.TestCase):
+    def tearDown(self):
+        ToasterHttpInterface.close_connection_pools()
+
+    def test_backoff_delay(self):
+        for attempt in range(1, 12):
+            delay = ToasterHttpInterface.backoff_delay(attempt, 0.1, 2)
+            expected = min(2, 0.1 * 2 ** (attempt - 1))
+            self.assertGreaterEqual(delay, expected / 2)
+            self.assertLessEqual(delay, expected)
+
+    def test_long_poll(self):
+        LongPollToasterHandler.polls = []
+        server = StandInToaster(LongPollToasterHandler)
+        try:
+            toaster = ToasterHttpInterface.ToasterHttpInterface(
+                server.url, poll_wait=1
+            )
+            start = time.time()
+            txt = toaster.execute(b"{}", job_id="job1", shots=1)
+            self.assertEqual(json.loads(txt)["counts"], {"00": 1})
+            # waiting is done by the server, not by polling often
+            self.assertEqual(LongPollToasterHandler.polls, ["1", "1", "1"])
+            self.assertGreaterEqual(time.time() - start, 2)
+        finally:
+            server.close()
+
+    def test_no_long_poll(self):
+        NeverReadyToasterHandler.polls = []
+        server = StandInToaster(NeverReadyToasterHandler)
+        try:
+            toaster = ToasterHttpInterface.ToasterHttpInterface(
+                server.url, poll_wait=0, deadline=time.time() + 1
+            )
+            with self.assertRaises(ToasterHttpInterface.ToasterDeadlineError):
+                toaster.execute(b"{}", job_id="job1", shots=1)
+            # toaster answers 202 at once, polls are spaced by backoff
+            self.assertLess(len(NeverReadyToasterHandler.polls), 20)
+            self.assertEqual(set(NeverReadyToasterHandler.polls), {None})
+        finally:
+            server.close()
+
+    def test_deadline(self):
+        LongPollToasterHandler.polls = []
+        server = StandInToaster(LongPollToasterHandler)
+        try:
+            toaster = ToasterHttpInterface.ToasterHttpInterface(
+                server.url, poll_wait=5, deadline=time.time() + 0.5
+            )
+            start = time.time()
+            with self.assertRaises(ToasterHttpInterface.ToasterDeadlineError):
+                toaster.execute(b"{}", job_id="job1", shots=1)
+            self.assertLess(time.time() - start, 3)
+        finally:
+            server.close()
+
+    def test_async_deadline(self):
+        LongPollToasterHandler.polls = []
+        server = StandInToaster(LongPollToasterHandler)
+        try:
+            toaster = ToasterHttpInterface.ToasterAsyncHttpInterface(
+                server.url, poll_wait=5, deadline=time.time() + 0.5
+            )
+            start = time.time()
+            with self.assertRaises(ToasterHttpInterface.ToasterDeadlineError):
+                asyncio.run(toaster.execute(b"{}", job_id="job1", shots=1))
+            self.assertLess(time.time() - start, 3)
+        finally:
+            server.close()
+
+    def test_async_no_long_poll(self):
+        NeverReadyToasterHandler.polls = []
+        server = StandInToaster(NeverReadyToasterHandler)
+        try:
+            toaster = ToasterHttpInterface.ToasterAsyncHttpInterface(
+                server.url, poll_wait=0, deadline=time.time() + 1
+            )
+            with self.assertRaises(ToasterHttpInterface.ToasterDeadlineError):
+                asyncio.run(toaster.execute(b"{}", job_id="job1", shots=1))
+            self.assertLess(len(NeverReadyToasterHandler.polls), 20)
+        finally:
+            server.close()
+
+    def test_connection_retries(self):
+        # nothing listens on a port of closed server
+        server = StandInToaster()
+        url = server.url
+        server.close()
+        toaster = ToasterHttpInterface.ToasterHttpInterface(
+            url, max_retries=2
+        )
+        with self.assertRaises(RuntimeError):
+            toaster.execute(b"{}", job_id="job1", shots=1)
+
+
+class TestStatevectorFormatFallback(unittest.TestCase):
+    def setUp(self):
+        NpyRejectingToasterHandler.formats = []
+        self.toaster = StandInToaster(NpyRejectingToasterHandler)
+        self.port = self.toaster.server.server_address[1]
+        # toaster reported version which should support npy
+        ToasterJob._toaster_versions[self.toaster.url] = "1.0.0"
+        circuit = QuantumCircuit(2)
+        circuit.h(0)
+        self.qobj = assemble(circuit).to_dict()
+
+    def tearDown(self):
+        self.toaster.close()
+        ToasterHttpInterface.close_connection_pools()
+
+    def check(self, result):
+        self.assertEqual(result.get_statevector()[0], 1)
+        self.assertIn(self.toaster.url, ToasterJob._npy_rejected)
+        self.assertEqual(NpyRejectingToasterHandler.formats, ["npy", None])
+
+    def test_fallback(self):
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            job = ToasterJob.ToasterJob(
+                None, str(uuid.uuid4()), self.qobj, "127.0.0.1", self.port,
+                getstates=True, executor=executor,
+            )
+            job.submit()
+            self.check(job.result())
+            # toaster is remembered to get JSON
+            job = ToasterJob.ToasterJob(
+                None, str(uuid.uuid4()), self.qobj, "127.0.0.1", self.port,
+                getstates=True, executor=executor,
+            )
+            job.submit()
+            job.result()
+        self.assertEqual(
+            NpyRejectingToasterHandler.formats, ["npy", None, None]
+        )
+
+    def test_async_fallback(self):
+        async def run():
+            job = ToasterAsyncJob.ToasterAsyncJob(
+                None, str(uuid.uuid4()), self.qobj, "127.0.0.1", self.port,
+                getstates=True,
+            )
+            job.submit()
+            return await job
+
+        self.check(asyncio.run(run()))
+
+
+class TestToasterBalancer(unittest.TestCase):
+    def setUp(self):
+        SlowToasterHandler.served = []
+        self.toasters = [StandInToaster(SlowToasterHandler) for i in range(3)]
+        self.urls = [t.url for t in self.toasters]
+
+    def tearDown(self):
+        for toaster in self.toasters:
+            toaster.close()
+        ToasterHttpInterface.close_connection_pools()
+
+    @staticmethod
+    def request(job_id, toaster_urls):
+        return ToasterBalancer.failover(
+            toaster_urls,
+            lambda url: [
+                {
+                    "toaster_url": url,
+                    "response": ToasterHttpInterface.ToasterHttpInterface(
+                        url, max_retries=0
+                    ).execute(b"{}", job_id=job_id, shots=1),
+                }
+            ],
+        )
+
+    def execute(self, balancer, job_id):
+        scheduler = ToasterScheduler.ToasterScheduler(balancer=balancer)
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            future = scheduler.submit(executor, 0, self.request, job_id)
+            return future.result()[0]["response"]
+
+    def spread(self, executor):
+        balancer = ToasterBalancer.ToasterBalancer(self.urls)
+        scheduler = ToasterScheduler.ToasterScheduler(balancer=balancer)
+        jobs = [
+            scheduler.submit(executor, 0, self.request, "job%d" % i)
+            for i in range(3)
+        ]
+        for job in jobs:
+            job.result()
+        return balancer
+
+    def test_least_in_flight(self):
+        with futures.ThreadPoolExecutor(max_workers=3) as executor:
+            balancer = self.spread(executor)
+        # concurrent requests went to different endpoints
+        self.assertEqual(len(set(SlowToasterHandler.served)), 3)
+        for stats in balancer.stats().values():
+            self.assertEqual(stats["in_flight"], 0)
+            self.assertEqual(stats["requests"], 1)
+            self.assertGreater(stats["latency"], 0.2)
+
+    def test_process_workers_share_balancer(self):
+        # endpoints are picked in this process, not by each worker
+        context = multiprocessing.get_context("fork")
+        with futures.ProcessPoolExecutor(
+            max_workers=3, mp_context=context
+        ) as executor:
+            self.spread(executor)
+        self.assertEqual(len(set(SlowToasterHandler.served)), 3)
+
+    def test_failover(self):
+        self.toasters[0].close()
+        balancer = ToasterBalancer.ToasterBalancer(
+            self.urls, health_check_interval=60
+        )
+        for i in range(4):
+            txt = self.execute(balancer, "job%d" % i)
+            self.assertEqual(json.loads(txt)["counts"], {"00": 1})
+        stats = balancer.stats()
+        self.assertFalse(stats[self.urls[0]]["healthy"])
+        self.assertEqual(stats[self.urls[0]]["failures"], 1)
+        self.assertEqual(stats[self.urls[0]]["in_flight"], 0)
+        self.assertEqual(len(SlowToasterHandler.served), 4)
+
+    def test_failover_gives_up(self):
+        for toaster in self.toasters:
+            toaster.close()
+        with self.assertRaises(ToasterHttpInterface.ToasterConnectionError):
+            ToasterBalancer.failover(
+                self.urls,
+                lambda url: ToasterHttpInterface.ToasterHttpInterface(
+                    url, max_retries=0
+                ).execute(b"{}", job_id="job", shots=1),
+                max_retries=0,
+            )
+
+    def test_health_check(self):
+        port = self.toasters[0].server.server_address[1]
+        self.toasters[0].close()
+        balancer = ToasterBalancer.ToasterBalancer(
+            self.urls, health_check_interval=0.1
+        )
+        self.execute(balancer, "job1")
+        self.assertFalse(balancer.stats()[self.urls[0]]["healthy"])
+        self.toasters[0] = StandInToaster(SlowToasterHandler, port)
+        deadline = time.time() + 5
+        while not balancer.stats()[self.urls[0]]["healthy"]:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+
+    def test_forked_process_has_own_balancers(self):
+        balancer = ToasterBalancer.get_balancer(self.urls)
+        self.execute(balancer, "parent")
+        self.assertIn(self.urls[0], ToasterBalancer.balancer_stats())
+        context = multiprocessing.get_context("fork")
+        with futures.ProcessPoolExecutor(
+            max_workers=1, mp_context=context
+        ) as executor:
+            stats = executor.submit(ToasterBalancer.balancer_stats).result()
+        self.assertEqual(stats, dict())
+
+    def test_job_endpoints(self):
+        self.toasters[0].close()
+        circuit = QuantumCircuit(2)
+        circuit.h(0)
+        circuit.measure_all()
+        qobj = assemble([circuit] * 6, shots=10).to_dict()
+        with futures.ThreadPoolExecutor(max_workers=3) as executor:
+            job = ToasterJob.ToasterJob(
+                None, "balanced", qobj, None, 0,
+                executor=executor,
+                toaster_endpoints=self.urls,
+            )
+            job.submit()
+            result = job.result()
+        self.assertEqual(len(result.results), 6)
+        self.assertEqual(len(set(SlowToasterHandler.served)), 2)
+
+    def test_job_endpoints_memory_budget(self):
+        circuit = QuantumCircuit(2)
+        circuit.h(0)
+        circuit.measure_all()
+        qobj = assemble([circuit] * 6, shots=10).to_dict()
+        # each 2-qubit experiment needs 64 bytes, one fits each server
+        with futures.ThreadPoolExecutor(max_workers=6) as executor:
+            job = ToasterJob.ToasterJob(
+                None, "budget", qobj, None, 0,
+                executor=executor,
+                toaster_endpoints=self.urls,
+                memory_budget=64,
+            )
+            job.submit()
+            job.result()
+        stats = ToasterScheduler.scheduler_stats()
+        target = ",".join(url.split("://")[1] for url in self.urls)
+        self.assertEqual(
+            stats[target]["memory_budget"], {url: 64 for url in self.urls}
+        )
+        budgets = ToasterScheduler.budget_stats()
+        for url in self.urls:
+            self.assertEqual(budgets[url.split("://")[1]]["peak_memory"], 64)
+        self.assertEqual(len(set(SlowToasterHandler.served)), 3)
+
+    def test_async_job_endpoints(self):
+        self.toasters[0].close()
+        circuit = QuantumCircuit(2)
+        circuit.h(0)
+        circuit.measure_all()
+        qobj = assemble([circuit] * 3, shots=100).to_dict()
+
+        async def run():
+            job = ToasterAsyncJob.ToasterAsyncJob(
+                None, "async-balanced", qobj, None, 0,
+                toaster_endpoints=self.urls,
+                shots_per_run=30,
+            )
+            job.submit()
+            # 4 sub-runs per experiment
+            self.assertEqual(len(job._tasks), 12)
+            return await job
+
+        result = asyncio.run(run())
+        self.assertEqual(len(result.results), 3)
+        for experiment in result.results:
+            self.assertEqual(experiment.shots, 100)
+            # stand-in toaster answers each sub-run with a single count
+            self.assertEqual(experiment.data.counts, {"0x0": 4})
+        self.assertEqual(len(set(SlowToasterHandler.served)), 2)
+
+
+class TestAsyncAdmission(unittest.TestCase):
+    def setUp(self):
+        ConcurrentToasterHandler.peak = 0
+        ConcurrentToasterHandler.served = 0
+        self.toaster = StandInToaster(ConcurrentToasterHandler)
+        self.port = self.toaster.server.server_address[1]
+        circuit = QuantumCircuit(2)
+        circuit.h(0)
+        circuit.measure_all()
+        self.qobj = assemble([circuit] * 6, shots=10).to_dict()
+
+    def tearDown(self):
+        self.toaster.close()
+
+    def job(self, **kwargs):
+        return ToasterAsyncJob.ToasterAsyncJob(
+            None, str(uuid.uuid4()), self.qobj, "127.0.0.1", self.port,
+            **kwargs
+        )
+
+    def run_job(self, **kwargs):
+        async def run():
+            job = self.job(**kwargs)
+            job.submit()
+            return await job
+
+        return asyncio.run(run())
+
+    def test_worker_limit(self):
+        result = self.run_job(max_workers=2)
+        self.assertEqual(len(result.results), 6)
+        self.assertEqual(ConcurrentToasterHandler.peak, 2)
+
+    def test_memory_budget(self):
+        # each 2-qubit experiment needs 64 bytes
+        result = self.run_job(max_workers=4, memory_budget=64)
+        self.assertEqual(len(result.results), 6)
+        self.assertEqual(ConcurrentToasterHandler.peak, 1)
+
+    def test_cancel_drops_queued_experiments(self):
+        async def run():
+            job = self.job(max_workers=1)
+            job.submit()
+            while not any(f.running() for f in job._futures):
+                await asyncio.sleep(0.01)
+            job.cancel()
+            outcomes = await asyncio.gather(
+                *job._tasks, return_exceptions=True
+            )
+            return job, outcomes
+
+        job, outcomes = asyncio.run(run())
+        self.assertEqual(job.status(), JobStatus.CANCELLED)
+        self.assertTrue(
+            all(isinstance(o, asyncio.CancelledError) for o in outcomes)
+        )
+        time.sleep(0.3)
+        self.assertLessEqual(ConcurrentToasterHandler.served, 1)
+        self.assertEqual(job._scheduler.stats()["pending"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+from qiskit import QuantumCircuit
+from qiskit.circuit import Parameter
+from qiskit.primitives import Estimator, Sampler
+from qiskit.quantum_info import SparsePauliOp
+from quantastica.qiskit_toaster.ToasterPrimitives import (
+    ToasterEstimator,
+    ToasterSampler,
+    _unique_bindings,
+)
+
+try:
+    from . import common
+except Exception:
+    import common
+
+
+class TestToasterPrimitives(common.TestToasterBase):
+    @staticmethod
+    def ansatz():
+        theta = Parameter("theta")
+        phi = Parameter("phi")
+        qc = QuantumCircuit(2)
+        qc.ry(theta, 0)
+        qc.cx(0, 1)
+        qc.rz(phi, 1)
+        qc.rx(theta + phi, 1)
+        return qc
+
+    def test_unique_bindings(self):
+        qc = self.ansatz()
+        other = QuantumCircuit(2)
+        other.h(0)
+        circuits, binds, experiments = _unique_bindings(
+            [qc, qc, other, qc.copy(), other],
+            [[0.1, 0.2], [0.3, 0.4], [], [0.1, 0.2], []],
+        )
+        self.assertEqual(len(circuits), 2)
+        self.assertEqual([b.shape for b in binds], [(2, 2), (1, 0)])
+        self.assertEqual(experiments, [0, 1, 2, 0, 2])
+
+    def test_estimator(self):
+        qc = self.ansatz()
+        observables = [
+            SparsePauliOp.from_list([("ZZ", 1.0), ("XI", 0.5)]),
+            SparsePauliOp("YY"),
+        ]
+        values = [[0.3, 1.1], [2.0, -0.4], [0.3, 1.1]]
+        circuits = [qc] * 3
+        observables = [observables[0], observables[1], observables[1]]
+        estimator = ToasterEstimator(self.toaster_backend())
+        result = estimator.run(circuits, observables, values).result()
+        expected = Estimator().run(circuits, observables, values).result()
+        np.testing.assert_allclose(result.values, expected.values, atol=1e-6)
+
+    def test_sampler(self):
+        qc = self.ansatz()
+        qc.measure_all()
+        values = [[0.3, 1.1], [2.0, -0.4]]
+        sampler = ToasterSampler(self.toaster_backend())
+        result = sampler.run([qc, qc], values).result()
+        expected = Sampler().run([qc, qc], values).result()
+        for dist, expected_dist in zip(
+            result.quasi_dists, expected.quasi_dists
+        ):
+            for key, probability in expected_dist.items():
+                self.assertAlmostEqual(dist.get(key, 0), probability)
+        result = sampler.run([qc], [values[0]], shots=1000).result()
+        self.assertAlmostEqual(sum(result.quasi_dists[0].values()), 1)
+        self.assertEqual(result.metadata[0]["shots"], 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import json
+import os
+import tempfile
+import numpy as np
+from quantastica.qiskit_toaster import ToasterResponse, ToasterJob
+
+
+class TestToasterResponseParser(unittest.TestCase):
+    @staticmethod
+    def get_response(statevector):
+        return json.dumps(
+            {
+                "counts": {"00 1": 3},
+                "statevector": [[a.real, a.imag] for a in statevector],
+                "time_taken": 0.5,
+                "qtoaster_version": "0.9.9",
+            }
+        ).encode("utf-8")
+
+    def test_chunked_feed(self):
+        rng = np.random.default_rng(1)
+        statevector = rng.normal(size=256) + 1j * rng.normal(size=256)
+        response = self.get_response(statevector)
+        for chunk_size in [1, 5, 64, 1000, len(response)]:
+            for n_qubits in [8, 3, None]:
+                parser = ToasterResponse.ToasterResponseParser(n_qubits)
+                for i in range(0, len(response), chunk_size):
+                    parser.feed(response[i:i + chunk_size])
+                result = parser.close()
+                self.assertEqual(result["statevector"].dtype, np.complex128)
+                np.testing.assert_array_equal(
+                    result["statevector"], statevector
+                )
+                self.assertEqual(result["counts"], {"00 1": 3})
+                self.assertEqual(result["time_taken"], 0.5)
+
+    def test_without_statevector(self):
+        self.assertIsNone(ToasterResponse.parse(b""))
+        self.assertEqual(
+            ToasterResponse.parse('{"counts": {"1": 2}}'), {"counts": {"1": 2}}
+        )
+        result = ToasterResponse.parse('{"statevector": [ ], "counts": {}}')
+        self.assertEqual(len(result["statevector"]), 0)
+
+    def test_npy_format(self):
+        rng = np.random.default_rng(2)
+        statevector = rng.normal(size=64) + 1j * rng.normal(size=64)
+        result = ToasterResponse.parse(self.get_response(statevector))
+        response = ToasterResponse.to_npy(result)
+        self.assertLess(len(response), 16 * 64 + 256)
+        for chunk_size in [1, 7, 100, len(response)]:
+            parser = ToasterResponse.ToasterResponseParser(6)
+            for i in range(0, len(response), chunk_size):
+                parser.feed(response[i:i + chunk_size])
+            parsed = parser.close()
+            np.testing.assert_array_equal(parsed["statevector"], statevector)
+            self.assertEqual(parsed["counts"], {"00 1": 3})
+
+    def test_spool_to_file(self):
+        statevector = np.arange(8) * (1 + 0.5j)
+        text = self.get_response(statevector)
+        with tempfile.TemporaryDirectory() as directory:
+            for i, response in enumerate([text, ToasterResponse.to_npy(
+                ToasterResponse.parse(text)
+            )]):
+                path = os.path.join(directory, "%d.npy" % i)
+                parser = ToasterResponse.ToasterResponseParser(3, path)
+                parser.feed(response)
+                result = parser.close()
+                self.assertIsInstance(result["statevector"], np.memmap)
+                del result
+                np.testing.assert_array_equal(np.load(path), statevector)
+
+    def test_statevector_format_negotiation(self):
+        url = "http://toaster.invalid:8001"
+        self.assertIsNone(ToasterJob._statevector_format(url, True))
+        ToasterJob._toaster_versions[url] = "0.9.9"
+        self.assertIsNone(ToasterJob._statevector_format(url, True))
+        ToasterJob._toaster_versions[url] = "1.0.0"
+        self.assertEqual(ToasterJob._statevector_format(url, True), "npy")
+        self.assertIsNone(ToasterJob._statevector_format(url, False))
+        ToasterJob._npy_rejected.add(url)
+        self.assertIsNone(ToasterJob._statevector_format(url, True))
+
+    def test_truncated(self):
+        parser = ToasterResponse.ToasterResponseParser(1)
+        parser.feed(b'{"statevector": [[1, 0], [0, ')
+        with self.assertRaises(ValueError):
+            parser.close()
+
+    def test_to_json(self):
+        statevector = np.array([0.5 + 0.5j, -0.5j])
+        result = ToasterResponse.parse(self.get_response(statevector))
+        self.assertEqual(
+            json.loads(ToasterResponse.to_json(result))["statevector"],
+            [[0.5, 0.5], [0.0, -0.5]],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
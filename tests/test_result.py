@@ -0,0 +1,70 @@
+import unittest
+import numpy as np
+from qiskit.result import Result
+from quantastica.qiskit_toaster import ToasterCounts, ToasterResult
+
+
+class TestToasterResult(unittest.TestCase):
+    @staticmethod
+    def get_result_dict(num_experiments):
+        results = []
+        for i in range(num_experiments):
+            counts = {"0 1": i + 1, "1 0": 2}
+            data = {"counts_arrays": ToasterCounts.counts_to_arrays(counts)}
+            if i % 2:
+                data = ToasterCounts.expand_counts(data)
+                data["statevector"] = np.array([0, 1, 0, 0], dtype=complex)
+            results.append(
+                {
+                    "success": True,
+                    "meas_level": 2,
+                    "shots": i + 3,
+                    "data": data,
+                    "header": {
+                        "name": "exp%d" % i,
+                        "creg_sizes": [["c0", 1], ["c1", 1]],
+                        "memory_slots": 2,
+                    },
+                    "status": "DONE",
+                }
+            )
+        return {
+            "success": True,
+            "backend_name": "Toaster",
+            "backend_version": "1.0.0",
+            "qobj_id": "qobj",
+            "job_id": "job",
+            "header": {},
+            "results": results,
+            "status": "COMPLETED",
+        }
+
+    def test_decodes_on_access(self):
+        result = ToasterResult.ToasterResult.from_dict(self.get_result_dict(1000))
+        self.assertEqual(result.results.decoded, 0)
+        self.assertEqual(result.get_counts(4), {"0 1": 5, "1 0": 2})
+        self.assertEqual(result.get_counts("exp500"), {"0 1": 501, "1 0": 2})
+        np.testing.assert_array_equal(result.get_statevector(7), [0, 1, 0, 0])
+        self.assertEqual(result.results.decoded, 3)
+        self.assertEqual(len(result.results), 1000)
+
+    def test_matches_qiskit_result(self):
+        result_dict = self.get_result_dict(5)
+        result = ToasterResult.ToasterResult.from_dict(result_dict)
+        expected = Result.from_dict(
+            dict(
+                result_dict,
+                results=[
+                    dict(r, data=ToasterCounts.expand_counts(r["data"]))
+                    for r in result_dict["results"]
+                ],
+            )
+        )
+        self.assertEqual(result.get_counts(), expected.get_counts())
+        self.assertEqual(result.results[-1].shots, 7)
+        self.assertEqual(len(result.results[1:4]), 3)
+        self.assertEqual(result.to_dict()["results"][0]["header"]["name"], "exp0")
+
+
+if __name__ == "__main__":
+    unittest.main()
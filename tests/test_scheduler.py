@@ -0,0 +1,143 @@
+import unittest
+import threading
+import time
+from concurrent import futures
+from quantastica.qiskit_toaster import ToasterScheduler
+
+
+class ConcurrencyProbe:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def work(self, value):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return value
+
+
+class TestToasterScheduler(unittest.TestCase):
+    def test_memory_budget(self):
+        mb = 1024 * 1024
+        scheduler = ToasterScheduler.ToasterScheduler(memory_budget=32 * mb)
+        probe = ConcurrencyProbe()
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            fs = [
+                scheduler.submit(executor, 16 * mb, probe.work, i)
+                for i in range(6)
+            ]
+            self.assertEqual([f.result() for f in fs], list(range(6)))
+        self.assertEqual(probe.peak, 2)
+        self.assertEqual(scheduler.stats()["peak_memory"], 32 * mb)
+        self.assertEqual(scheduler.stats()["in_flight"], 0)
+
+    def test_shared_budget(self):
+        mb = 1024 * 1024
+        budget = ToasterScheduler.ToasterMemoryBudget(32 * mb)
+        schedulers = [
+            ToasterScheduler.ToasterScheduler(budgets={None: budget})
+            for i in range(2)
+        ]
+        probe = ConcurrencyProbe()
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            fs = [
+                scheduler.submit(executor, 16 * mb, probe.work, i)
+                for i in range(3)
+                for scheduler in schedulers
+            ]
+            futures.wait(fs)
+        self.assertEqual(probe.peak, 2)
+        self.assertEqual(budget.stats()["in_flight"], 0)
+
+    def test_budget_is_fixed_once_set(self):
+        budget = ToasterScheduler.get_budget("fixed-budget:1", 100)
+        with self.assertLogs(ToasterScheduler.logger, "WARNING"):
+            ToasterScheduler.get_budget("fixed-budget:1", 200)
+        self.assertEqual(budget.limit, 100)
+        # default budget gives way to the first one set
+        budget = ToasterScheduler.get_budget("fixed-budget:2")
+        self.assertIsNone(budget.limit)
+        ToasterScheduler.get_budget("fixed-budget:2", 300)
+        ToasterScheduler.get_budget("fixed-budget:2")
+        self.assertEqual(budget.limit, 300)
+
+    def test_oversized_runs_alone(self):
+        scheduler = ToasterScheduler.ToasterScheduler(memory_budget=10)
+        probe = ConcurrencyProbe()
+        with futures.ThreadPoolExecutor(max_workers=4) as executor:
+            fs = [scheduler.submit(executor, 100, probe.work, i) for i in range(3)]
+            futures.wait(fs)
+        self.assertEqual(probe.peak, 1)
+
+    def test_cheapest_first_and_priority(self):
+        scheduler = ToasterScheduler.ToasterScheduler()
+        started = threading.Event()
+        release = threading.Event()
+        order = []
+
+        def blocker():
+            started.set()
+            release.wait()
+
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            fs = [scheduler.submit(executor, 0, blocker)]
+            started.wait()
+            for name, cost, priority in [
+                ("slow", 30.0, 0),
+                ("fast", 0.1, 0),
+                ("medium", 2.0, 0),
+                ("urgent", 100.0, 1),
+            ]:
+                fs.append(
+                    scheduler.submit(
+                        executor, 0, order.append, name,
+                        cost=cost, priority=priority,
+                    )
+                )
+            release.set()
+            futures.wait(fs)
+        self.assertEqual(order, ["urgent", "fast", "medium", "slow"])
+
+    def test_cost_model_calibration(self):
+        model = ToasterScheduler.ToasterCostModel()
+        for n_qubits in range(10, 20):
+            for gates in [10, 100, 1000]:
+                features = (n_qubits, gates, gates // 2)
+                model.observe(features, 0.01 + 3e-9 * 2 ** n_qubits * gates)
+        estimate = model.estimate((22, 500, 250))
+        self.assertAlmostEqual(estimate, 0.01 + 3e-9 * 2 ** 22 * 500, places=3)
+
+    def test_circuit_features(self):
+        experiment = {
+            "header": {"n_qubits": 3},
+            "instructions": [
+                {"name": "h", "qubits": [0]},
+                {"name": "barrier", "qubits": [0, 1, 2]},
+                {"name": "cx", "qubits": [0, 1]},
+                {"name": "x", "qubits": [2]},
+                {"name": "cx", "qubits": [1, 2]},
+            ],
+        }
+        self.assertEqual(
+            ToasterScheduler.circuit_features(experiment), (3, 4, 3)
+        )
+
+    def test_estimate_memory(self):
+        qobj_dict = {
+            "experiments": [
+                {"header": {"n_qubits": 3}},
+                {"header": {"n_qubits": 30}},
+            ]
+        }
+        self.assertEqual(
+            ToasterScheduler.estimate_memory(qobj_dict), 16 * 2 ** 30
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
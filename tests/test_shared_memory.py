@@ -0,0 +1,135 @@
+import unittest
+import gc
+import os
+import time
+from concurrent import futures
+import numpy as np
+from qiskit import QuantumCircuit
+from quantastica.qiskit_toaster import (
+    ToasterBackend,
+    ToasterJob,
+    ToasterResponse,
+)
+
+
+def make_results(n_qubits):
+    rng = np.random.default_rng(n_qubits)
+    statevector = rng.normal(size=2 ** n_qubits) + 0j
+    results = [{"data": {"counts": {}, "statevector": statevector}}]
+    return ToasterJob._export_statevectors(results), statevector.sum()
+
+
+def parse_results(response, n_qubits):
+    """
+    Parses response in worker process, returns exported results and names
+    of shared memory blocks allocated while parsing
+    """
+    allocator = ToasterJob._statevector_allocator()
+    parser = ToasterResponse.ToasterResponseParser(
+        n_qubits, allocator=allocator
+    )
+    for i in range(0, len(response), 65536):
+        parser.feed(response[i:i + 65536])
+    data = parser.close()
+    names = [shm.name for shm, array in allocator.blocks]
+    results = [{"data": {"statevector": data["statevector"]}}]
+    return ToasterJob._export_statevectors(results, allocator), names
+
+
+@unittest.skipUnless(os.path.isdir("/dev/shm"), "requires /dev/shm")
+class TestSharedMemoryResults(unittest.TestCase):
+    def test_statevector_through_shared_memory(self):
+        with ToasterJob.ToasterJob.create_executor("process", 1) as executor:
+            results, checksum = executor.submit(make_results, 17).result()
+            small, _ = executor.submit(make_results, 3).result()
+        handle = results[0]["data"]["statevector_shm"]
+        path = os.path.join("/dev/shm", handle["name"])
+        self.assertTrue(os.path.exists(path))
+        ToasterJob._attach_statevectors(results)
+        self.assertFalse(os.path.exists(path))
+        statevector = results[0]["data"]["statevector"]
+        self.assertEqual(len(statevector), 2 ** 17)
+        self.assertEqual(statevector.sum(), checksum)
+        # small statevectors are pickled as usual
+        self.assertIn("statevector", small[0]["data"])
+
+    def response(self, n_qubits):
+        statevector = np.arange(2 ** n_qubits) * (1 + 1j)
+        return statevector, {
+            "counts": {},
+            "time_taken": 0,
+            "statevector": statevector,
+        }
+
+    def test_statevector_is_decoded_into_shared_memory(self):
+        statevector, response = self.response(17)
+        with ToasterJob.ToasterJob.create_executor("process", 1) as executor:
+            results, names = executor.submit(
+                parse_results, ToasterResponse.to_npy(response), 17
+            ).result()
+        # no copy: the block the parser allocated is sent as is
+        handle = results[0]["data"]["statevector_shm"]
+        self.assertEqual(names, [handle["name"]])
+        ToasterJob._attach_statevectors(results)
+        self.assertFalse(os.path.exists(os.path.join("/dev/shm", names[0])))
+        np.testing.assert_array_equal(
+            results[0]["data"]["statevector"], statevector
+        )
+
+    def test_unused_blocks_are_released(self):
+        statevector, response = self.response(17)
+        text = ToasterResponse.to_json(response).encode("utf-8")
+        with ToasterJob.ToasterJob.create_executor("process", 1) as executor:
+            # too small expected size, parser grows its array
+            results, names = executor.submit(parse_results, text, 16).result()
+        self.assertEqual(len(names), 2)
+        paths = [os.path.join("/dev/shm", name) for name in names]
+        self.assertFalse(os.path.exists(paths[0]))
+        self.assertTrue(os.path.exists(paths[1]))
+        ToasterJob._attach_statevectors(results)
+        self.assertFalse(os.path.exists(paths[1]))
+        np.testing.assert_array_equal(
+            results[0]["data"]["statevector"], statevector
+        )
+
+    def test_main_process_keeps_arrays(self):
+        results, _ = make_results(17)
+        self.assertIsInstance(results[0]["data"]["statevector"], np.ndarray)
+
+    def shm_job(self):
+        qc = QuantumCircuit(17)
+        qc.h(range(17))
+        backend = ToasterBackend.get_backend(
+            "statevector_simulator",
+            executor_type="process",
+            executor_lifetime="backend",
+        )
+        self.addCleanup(backend.shutdown)
+        job = backend.run([qc, qc])
+        futures.wait(job._futures)
+        while len(job._shm_results) < 2:
+            time.sleep(0.01)
+        paths = [
+            os.path.join("/dev/shm", r["data"]["statevector_shm"]["name"])
+            for r in job._shm_results
+        ]
+        self.assertTrue(all(os.path.exists(p) for p in paths))
+        return job, paths
+
+    def test_dropped_job_releases_shared_memory(self):
+        job, paths = self.shm_job()
+        del job
+        gc.collect()
+        self.assertFalse(any(os.path.exists(p) for p in paths))
+
+    def test_partial_iteration_releases_shared_memory(self):
+        job, paths = self.shm_job()
+        next(job.iter_results())
+        self.assertEqual(sum(os.path.exists(p) for p in paths), 1)
+        del job
+        gc.collect()
+        self.assertFalse(any(os.path.exists(p) for p in paths))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import os
+import time
+from concurrent import futures
+from qiskit import QuantumCircuit
+from quantastica.qiskit_toaster import ToasterBackend, ToasterJob
+
+
+class RecordingExecutor(futures.Executor):
+    """Executor which only records submitted work, nothing is executed"""
+
+    def __init__(self):
+        self.submitted = []
+        self.futures = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted.append(args)
+        future = futures.Future()
+        self.futures.append(future)
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        """Cancels recorded work, so the scheduler releases it"""
+        for future in self.futures:
+            future.cancel()
+
+
+class TestSubmitBenchmark(unittest.TestCase):
+    """
+    ToasterJob.submit must be linear in the number of experiments:
+    each experiment is shipped alone, without copies of the others.
+    """
+
+    @staticmethod
+    def get_qobj(backend, num_experiments):
+        circuits = []
+        for i in range(num_experiments):
+            qc = QuantumCircuit(10, 10, name="exp%d" % i)
+            for layer in range(10):
+                for q in range(10):
+                    qc.rx(0.1 * (layer + 1), q)
+                for q in range(9):
+                    qc.cx(q, q + 1)
+            qc.measure(range(10), range(10))
+            circuits.append(qc)
+        return backend._assemble(circuits, shots=16)
+
+    @staticmethod
+    def time_submit(backend, qobj, repeats=5):
+        best = None
+        for i in range(repeats):
+            executor = RecordingExecutor()
+            job = ToasterJob.ToasterJob(
+                backend,
+                "bench",
+                qobj,
+                toaster_host="127.0.0.1",
+                toaster_port=8001,
+                executor=executor,
+            )
+            t = time.perf_counter()
+            job.submit()
+            elapsed = time.perf_counter() - t
+            executor.shutdown()
+            best = elapsed if best is None else min(best, elapsed)
+        return best, executor
+
+    def test_submit_does_not_copy(self):
+        backend = ToasterBackend.get_backend()
+        qobj = self.get_qobj(backend, 100)
+        executor = RecordingExecutor()
+        job = ToasterJob.ToasterJob(
+            backend,
+            "bench",
+            qobj,
+            toaster_host="127.0.0.1",
+            toaster_port=8001,
+            executor=executor,
+        )
+        job.submit()
+        self.addCleanup(executor.shutdown)
+        experiments = job._qobj_dict["experiments"]
+        shipped = [
+            single_exp
+            for args in executor.submitted
+            for exp_job_id, single_exp in args[0]
+        ]
+        self.assertEqual(len(shipped), len(experiments))
+        for single_exp, exp in zip(shipped, experiments):
+            # each experiment is shipped alone and shares the rest
+            self.assertEqual(len(single_exp["experiments"]), 1)
+            self.assertIs(single_exp["experiments"][0], exp)
+            self.assertIs(single_exp["config"], job._qobj_dict["config"])
+        executor.shutdown()
+        self.assertEqual(job._scheduler.stats()["in_flight"], 0)
+
+    @unittest.skipUnless(
+        os.getenv("SLOW") == "1",
+        "Skipping this test (environment variable SLOW must be set to 1)",
+    )
+    def test_submit_is_linear(self):
+        backend = ToasterBackend.get_backend()
+        small, large = 100, 800
+        t_small, _ = self.time_submit(backend, self.get_qobj(backend, small))
+        t_large, _ = self.time_submit(backend, self.get_qobj(backend, large))
+        # 8x experiments: linear is ~8x, quadratic would be ~64x
+        self.assertLess(t_large, t_small * 24)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import json
+import numpy as np
+from qiskit import QuantumCircuit
+from qiskit.circuit import Parameter
+from quantastica.qconvert import qobj_to_toaster
+from quantastica.qiskit_toaster import ToasterBackend
+
+
+class TestToasterTemplate(unittest.TestCase):
+    @staticmethod
+    def get_parameterized_qc():
+        a = Parameter("a")
+        b = Parameter("b")
+        qc = QuantumCircuit(3, 3, name="Template")
+        qc.rx(a, 0)
+        qc.barrier()
+        qc.cx(0, 1)
+        qc.ry(2 * b + a, 1)
+        qc.rz(a, 2)
+        qc.h(2)
+        qc.measure([0, 1], [0, 1])
+        qc.rz(b, 2).c_if(qc.cregs[0], 1)
+        qc.measure(2, 2)
+        return qc
+
+    def test_bind_matches_full_conversion(self):
+        backend = ToasterBackend.get_backend()
+        qc = self.get_parameterized_qc()
+        values = np.array([[0.1, 0.2], [0.5, -1.5], [3.0, 0.0]])
+        qobj_dict = backend._assemble(qc, parameter_binds=values, shots=8)
+        self.assertEqual(len(qobj_dict["experiments"]), len(values))
+        for row, exp in zip(values, qobj_dict["experiments"]):
+            bound = qc.assign_parameters(dict(zip(qc.parameters, row)))
+            expected = qobj_to_toaster(
+                backend._assemble(bound).to_dict(), {"all_experiments": False}
+            )
+            self.assertEqual(
+                json.loads(exp["toaster_circuit"]), json.loads(expected)
+            )
+
+    def test_bind_dict_of_arrays(self):
+        backend = ToasterBackend.get_backend()
+        qc = self.get_parameterized_qc()
+        a, b = qc.parameters
+        qobj_dict = backend._assemble(
+            [qc, qc], parameter_binds=[{a: [0.1, 0.2], b: np.zeros(2)}] * 2
+        )
+        self.assertEqual(len(qobj_dict["experiments"]), 4)
+        with self.assertRaises(ValueError):
+            backend._assemble(qc, parameter_binds={a: [0.1]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,17 @@
 import unittest
+import asyncio
+import os
+import tempfile
+import threading
+from concurrent import futures
+from unittest import mock
 from qiskit import QuantumRegister, ClassicalRegister
 from qiskit import QuantumCircuit, execute
 from qiskit.providers.aer import AerSimulator
+from qiskit.circuit import Parameter
+from quantastica.qiskit_toaster import ToasterTemplate
 from math import pi
+import numpy as np
 
 try:
     from . import common
@@ -65,6 +74,27 @@ class TestToasterBackend(common.TestToasterBase):
         self.assertEqual(len(stats["counts"]), 1)
         self.assertEqual(stats["totalcounts"], 1)
 
+    def test_spooled_state_vector(self):
+        qc = TestToasterBackend.get_bell_qc()
+        expected = (
+            self.toaster_backend(backend_name="statevector_simulator")
+            .run(qc, seed_simulator=3)
+            .result()
+            .get_statevector()
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            backend = self.toaster_backend(
+                backend_name="statevector_simulator",
+                statevector_dir=directory,
+            )
+            result = backend.run(qc, seed_simulator=3).result()
+            statevector = result.get_statevector()
+            self.assertIsInstance(statevector, np.memmap)
+            self.assertFalse(statevector.flags.writeable)
+            self.assertEqual(len(os.listdir(directory)), 1)
+            np.testing.assert_allclose(statevector, expected)
+            del result, statevector
+
     def test_teleport_state_vector(self):
         """
         This is test for statevector which means that
@@ -126,6 +156,282 @@ class TestToasterBackend(common.TestToasterBase):
         self.assertEqual(len(bell_counts), 2)
         self.assertEqual(len(tel_counts), 4)
 
+    def test_batched_experiments(self):
+        backend = self.toaster_backend(batch_size=3)
+        qc_list = [self.get_bell_qc(), self.get_teleport_qc()] * 4
+        qc_list.append(self.get_bell_qc())
+        result = backend.run(qc_list, shots=128).result()
+        self.assertEqual(len(result.results), len(qc_list))
+        for i, qc in enumerate(qc_list):
+            counts = result.get_counts(i)
+            self.assertEqual(sum(counts.values()), 128)
+            self.assertEqual(len(counts), 2 if qc.name == "Bell" else 4)
+
+    def test_result_cache(self):
+        qc = self.get_teleport_qc()
+        with tempfile.TemporaryDirectory() as directory:
+            backend = self.toaster_backend(
+                executor_type="thread", result_cache_dir=directory
+            )
+            counts1 = backend.run(qc, shots=256, seed_simulator=5).result()
+            self.assertEqual(len(os.listdir(directory)), 1)
+            stats = backend.result_cache_stats()[directory]
+            counts2 = backend.run(qc, shots=256, seed_simulator=5).result()
+            self.assertEqual(counts1.get_counts(), counts2.get_counts())
+            after = backend.result_cache_stats()[directory]
+            self.assertEqual(after["hits"], stats["hits"] + 1)
+            # runs without seed are not cached
+            backend.run(qc, shots=256).result()
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+    def test_iter_results(self):
+        qc_list = [self.get_bell_qc(), self.get_teleport_qc()] * 3
+        for i, qc in enumerate(qc_list):
+            qc_list[i] = qc.copy(name="%s%d" % (qc.name, i))
+        finished = []
+        job = self.toaster_backend().run(
+            qc_list, shots=64, callback=finished.append
+        )
+        names = []
+        for experiment_result in job.iter_results(timeout=60):
+            self.assertEqual(sum(experiment_result.data.counts.values()), 64)
+            names.append(experiment_result.header.name)
+        self.assertEqual(sorted(names), sorted(qc.name for qc in qc_list))
+        job.result()
+        self.assertEqual(
+            sorted(r.header.name for r in finished), sorted(names)
+        )
+
+    def test_slow_callback(self):
+        release = threading.Event()
+        finished = []
+
+        def callback(experiment_result):
+            release.wait(30)
+            finished.append(experiment_result)
+            raise RuntimeError("callback failure")
+
+        backend = self.toaster_backend(executor_type="thread", max_workers=1)
+        qc_list = [self.get_bell_qc()] * 3
+        job = backend.run(qc_list, shots=64, callback=callback)
+        # callback blocked on the first experiment doesn't hold up the rest
+        done, _ = futures.wait(job._futures, timeout=30)
+        self.assertEqual(len(done), 3)
+        self.assertEqual(finished, [])
+        release.set()
+        self.assertEqual(len(job.result().results), 3)
+        self.assertEqual(len(finished), 3)
+
+    def test_shot_splitting(self):
+        qc = self.get_teleport_qc()
+        backend = self.toaster_backend(shots_per_run=300)
+        result1 = backend.run(qc, shots=1000, seed_simulator=9).result()
+        result2 = backend.run(qc, shots=1000, seed_simulator=9).result()
+        counts = result1.get_counts()
+        self.assertEqual(sum(counts.values()), 1000)
+        self.assertEqual(len(counts), 4)
+        self.assertEqual(counts, result2.get_counts())
+        self.assertEqual(result1.results[0].shots, 1000)
+        self.assertEqual(result1.results[0].seed_simulator, 9)
+        # sub-runs are merged for compact counts and callbacks as well
+        finished = []
+        backend = self.toaster_backend(shots_per_run=300, compact_counts=True)
+        job = backend.run(
+            [qc, self.get_bell_qc()], shots=1000, callback=finished.append
+        )
+        for outcomes, frequencies in job.counts_arrays():
+            self.assertEqual(int(frequencies.sum()), 1000)
+        self.assertEqual(len(finished), 2)
+
+    def test_sample_locally(self):
+        backend = self.toaster_backend(
+            executor_type="thread", sample_locally=True
+        )
+        qc = QuantumCircuit(2, 2)
+        qc.h(0)
+        qc.ry(1.1, 1)
+        qc.measure([0, 1], [0, 1])
+        stats = backend.sampling_cache_stats() or {"hits": 0, "misses": 0}
+        result1 = backend.run(qc, shots=500, seed_simulator=3).result()
+        result2 = backend.run(qc, shots=500, seed_simulator=3).result()
+        result3 = backend.run(qc, shots=2000, seed_simulator=4).result()
+        self.assertEqual(result1.get_counts(), result2.get_counts())
+        self.assertEqual(sum(result3.get_counts().values()), 2000)
+        self.assertEqual(len(result3.get_counts()), 4)
+        after = backend.sampling_cache_stats()
+        # simulated once, then only sampled
+        self.assertEqual(after["misses"], stats["misses"] + 1)
+        self.assertEqual(after["hits"], stats["hits"] + 2)
+
+    def test_sample_locally_register_layout(self):
+        backend = self.toaster_backend(sample_locally=True)
+        qc = QuantumCircuit(3, 3)
+        qc.x(0)
+        qc.h(2)
+        qc.measure([0, 1, 2], [1, 0, 2])
+        counts = backend.run(qc, shots=400).result().get_counts()
+        self.assertEqual(set(counts), {"010", "110"})
+        self.assertEqual(sum(counts.values()), 400)
+        # gate after measurement, simulated by toaster as usual
+        qc = QuantumCircuit(1, 2)
+        qc.h(0)
+        qc.measure(0, 0)
+        qc.x(0)
+        qc.measure(0, 1)
+        counts = backend.run(qc, shots=100).result().get_counts()
+        self.assertEqual(set(counts), {"01", "10"})
+
+    def test_expectation_values(self):
+        from qiskit.quantum_info import SparsePauliOp, Statevector
+
+        theta = Parameter("theta")
+        qc = QuantumCircuit(3)
+        qc.ry(theta, 0)
+        qc.cx(0, 1)
+        qc.rx(0.4, 2)
+        qc.cx(1, 2)
+        hamiltonian = SparsePauliOp.from_list(
+            [("ZZI", 0.5), ("IZZ", -1.2), ("XXX", 0.3), ("YIY", 0.7)]
+        )
+        thetas = np.array([[0.1], [1.3], [2.9]])
+        values = self.toaster_backend().expectation_values(
+            qc, [hamiltonian, SparsePauliOp("ZII")], parameter_binds=thetas
+        )
+        self.assertEqual(values.shape, (3, 2))
+        self.assertEqual(values.dtype, np.float64)
+        for row, (value,) in zip(values, thetas):
+            state = Statevector(qc.assign_parameters([value]))
+            self.assertAlmostEqual(
+                row[0], state.expectation_value(hamiltonian).real, places=5
+            )
+            self.assertAlmostEqual(
+                row[1],
+                state.expectation_value(SparsePauliOp("ZII")).real,
+                places=5,
+            )
+
+    def test_parameter_shift_gradient(self):
+        from qiskit.quantum_info import SparsePauliOp, Statevector
+
+        a = Parameter("a")
+        b = Parameter("b")
+        qc = QuantumCircuit(2)
+        qc.ry(a, 0)
+        qc.cx(0, 1)
+        qc.rz(b, 1)
+        qc.rx(2 * a + b, 1)
+        qc.ry(a * b, 0)
+        hamiltonian = SparsePauliOp.from_list(
+            [("ZZ", 1.0), ("XI", 0.5), ("YY", 0.3)]
+        )
+
+        def energy(values):
+            state = Statevector(qc.assign_parameters(values))
+            return state.expectation_value(hamiltonian).real
+
+        points = np.array([[0.3, 1.1], [0.3, 1.1], [-0.7, 2.0]])
+        eps = 1e-6
+        expected = np.array(
+            [
+                [
+                    (energy(p + eps * e) - energy(p - eps * e)) / (2 * eps)
+                    for e in np.eye(2)
+                ]
+                for p in points
+            ]
+        )
+        backend = self.toaster_backend()
+        gradients = backend.parameter_shift_gradient(qc, hamiltonian, points)
+        np.testing.assert_allclose(gradients, expected, atol=1e-5)
+        gradient = backend.parameter_shift_gradient(
+            qc, hamiltonian, points[2]
+        )
+        np.testing.assert_allclose(gradient, expected[2], atol=1e-5)
+
+        qc.crx(a, 0, 1)
+        with self.assertRaises(ValueError):
+            backend.parameter_shift_gradient(qc, hamiltonian, points)
+
+    def test_compact_counts(self):
+        backend = self.toaster_backend(compact_counts=True)
+        job = backend.run(self.get_bell_qc(), shots=128)
+        outcomes, frequencies = job.counts_arrays()[0]
+        self.assertEqual(sorted(outcomes.tolist()), [0, 3])
+        self.assertEqual(int(frequencies.sum()), 128)
+        counts = job.result().get_counts()
+        self.assertEqual(set(counts), {"00", "11"})
+
+    def test_parameter_binds(self):
+        theta = Parameter("theta")
+        qc = QuantumCircuit(1, 1, name="Rotation")
+        qc.rx(theta, 0)
+        qc.measure(0, 0)
+        angles = np.array([0, pi, 0, pi])
+        job = self.toaster_backend().run(
+            qc, parameter_binds=[{theta: angles}], shots=64
+        )
+        result = job.result()
+        self.assertEqual(len(result.results), len(angles))
+        for i, angle in enumerate(angles):
+            expected = "1" if angle else "0"
+            self.assertEqual(result.get_counts(i), {expected: 64})
+
+    def test_parameter_binds_without_templates(self):
+        theta = Parameter("theta")
+        qc = QuantumCircuit(1, 1, name="Rotation")
+        qc.rx(theta, 0)
+        qc.measure(0, 0)
+        angles = np.array([0, pi])
+        with mock.patch.object(
+            ToasterTemplate, "TEMPLATES_AVAILABLE", False
+        ):
+            job = self.toaster_backend().run(
+                qc, parameter_binds=[{theta: angles}], shots=64
+            )
+        result = job.result()
+        self.assertEqual(result.get_counts(0), {"0": 64})
+        self.assertEqual(result.get_counts(1), {"1": 64})
+
+    def test_empty_parameter_binds(self):
+        qc = self.get_bell_qc()
+        job = self.toaster_backend().run(qc, parameter_binds=[], shots=64)
+        self.assertEqual(sum(job.result().get_counts().values()), 64)
+
+    def test_run_async(self):
+        backend = self.toaster_backend()
+        qc_list = [self.get_bell_qc(), self.get_teleport_qc()]
+
+        async def run_jobs():
+            jobs = [await backend.run_async(qc_list) for i in range(10)]
+            names = [exp.header.name async for exp in jobs[0]]
+            results = await asyncio.gather(*jobs)
+            return names, results
+
+        names, results = asyncio.run(run_jobs())
+        self.assertEqual(sorted(names), ["Bell", "Teleport"])
+        self.assertEqual(len(results), 10)
+        for result in results:
+            self.assertEqual(len(result.get_counts("Bell")), 2)
+            self.assertEqual(len(result.get_counts("Teleport")), 4)
+
+    def test_run_async_options(self):
+        qc = self.get_bell_qc()
+
+        async def run(backend, **run_options):
+            job = await backend.run_async(qc, **run_options)
+            return await job
+
+        backend = self.toaster_backend(shots_per_run=100, job_timeout=60)
+        result = asyncio.run(run(backend, shots=250, seed_simulator=5))
+        self.assertEqual(sum(result.get_counts().values()), 250)
+        backend = self.toaster_backend(batch_size=2, max_workers=1)
+        result = asyncio.run(run(backend, shots=250, priority=1))
+        self.assertEqual(sum(result.get_counts().values()), 250)
+        with self.assertRaises(ValueError):
+            asyncio.run(run(self.toaster_backend(sample_locally=True)))
+        with self.assertRaises(ValueError):
+            asyncio.run(run(backend, callback=print))
+
     def test_too_many_qubits(self):
         qc = QuantumCircuit(name="TooManyQubits")
 